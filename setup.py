@@ -19,8 +19,11 @@ setup(
     install_requires=[
         'future',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     tests_require=[
-        'django>=1.5,<1.7',
+        'django>=1.8,<2',
     ],
     classifiers=[
         'Development Status :: 3 - Alpha',
@@ -18,10 +18,317 @@ ThirdParty must implement:
 from __future__ import unicode_literals
 from future.utils import python_2_unicode_compatible
 from builtins import object
-from collections import namedtuple
+from collections import OrderedDict, defaultdict, namedtuple
+from datetime import datetime, timedelta
 from decimal import Decimal
-from django.db import transaction
-from django.db.models import Sum
+from itertools import chain, islice
+from django.conf import settings
+from django.core import signing
+from django.db import connections, router, transaction
+from django.db.models import BigIntegerField, Case, DateTimeField, ExpressionWrapper, F, Q, Sum, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .cache import cached, entries_written
+from .fields import from_minor_units, to_minor_units
+from .instrumentation import instrumented
+
+try:
+    from django.db.models.functions import Trunc
+except ImportError:  # pragma: no coverage
+    #django < 1.10: totals_series() truncates with the backend's SQL instead
+    Trunc = None
+
+try:
+    from .aio import AccountAsyncMixin, BookSetAsyncMixin
+except SyntaxError:  # pragma: no coverage
+    #python 2: no asyncio API
+    AccountAsyncMixin = BookSetAsyncMixin = object
+
+#how many transactions are written per bulk INSERT by the batch posting functions
+BULK_CHUNK_SIZE = 500
+
+#how many ledger entries share a query when fetching their transactions' other legs
+LEDGER_CHUNK_SIZE = 500
+
+#default number of entries in a page from ledger_page() and iter_ledger()
+LEDGER_PAGE_SIZE = 1000
+
+_LEDGER_CURSOR_SALT = 'swingtix.bookkeeper.ledger_page'
+
+#A single two-legged posting for BookSetBase.post_many().  'account' is posted
+#'amount' and 'other_account' the negative amount, just like AccountBase.post().
+Posting = namedtuple('Posting', ['account', 'amount', 'other_account', 'description',
+    'self_memo', 'other_memo', 'datetime'])
+Posting.__new__.__defaults__ = ("", "", None)
+
+#Sums of the debits and credits, and the net change, over a period of time.
+#(Defined at the module level so it can be pickled by shared caches.)
+Totals = namedtuple('Totals', ['credits', 'debits', 'net'])
+
+#An account's ledger as NumPy arrays, one element per entry; see
+#AccountBase.ledger_arrays().
+LedgerArrays = namedtuple('LedgerArrays', ['t_stamp', 'amount', 'tid', 'aeid', 'opening', 'closing'])
+
+#One leg of a split transaction for BookSetBase.post_split().  Debits are
+#positive and credits negative, the same as AccountBase.post().
+Leg = namedtuple('Leg', ['account', 'amount', 'memo', 'third_party'])
+Leg.__new__.__defaults__ = ("", None)
+
+
+class PeriodClosedError(ValueError):
+    """ Raised when posting entries dated before the time a bookset is closed
+    until; see BookSet.close_period(). """
+
+
+def _check_open(closed, account, t_stamp):
+    """ Raises PeriodClosedError if 't_stamp' is in a closed period of the
+    account's bookset.  'closed' is a dict caching each bookset's
+    _closed_until(). """
+
+    book = account.get_bookset()
+    if book not in closed:
+        closed[book] = book._closed_until()
+    closed_until = closed[book]
+    if closed_until is not None and t_stamp < closed_until:
+        raise PeriodClosedError("{0} is closed until {1}; can't post at {2}".format(book, closed_until, t_stamp))
+
+
+def _chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _count_entries(posted):
+    "The number of entries in the result of _bulk_post()."
+    return sum(len(entries) for entries in posted)
+
+
+def _can_bulk_insert_with_pks(model):
+    features = connections[router.db_for_write(model)].features
+    return (getattr(features, 'can_return_ids_from_bulk_insert', False) or
+        getattr(features, 'can_return_rows_from_bulk_insert', False))
+
+
+def _save_transactions(txs):
+    """ Saves new transactions so they have primary keys.  A single INSERT is
+    used on databases that return ids from bulk inserts (eg. postgresql).
+    Elsewhere they're saved one by one."""
+
+    model = type(txs[0])
+    if _can_bulk_insert_with_pks(model):
+        model._default_manager.bulk_create(txs)
+    else:
+        for tx in txs:
+            tx.save()
+
+
+def _bulk_post(postings, chunk_size=BULK_CHUNK_SIZE, check_open=True):
+    """ Writes many transactions using bulk inserts, in chunks of 'chunk_size'
+    transactions, inside a single atomic block.
+
+    'postings' is an iterable of (description, datetime, legs) tuples, where
+    'legs' is a sequence of (account, db_amount, memo).  The amounts must
+    already be in the database's sign convention.  The first leg's account
+    creates the transaction.  PeriodClosedError is raised (and nothing is
+    written) if a transaction is in a closed period, unless 'check_open' is
+    false.
+
+    Returns a list with a tuple of the new AccountEntries for each posting.
+    (Depending on the database, the entries may not have primary keys.)
+    """
+
+    created = []
+    closed = {}
+    with transaction.atomic():
+        for chunk in _chunked(postings, chunk_size):
+            txs = []
+            for description, datetime, legs in chunk:
+                tx = legs[0][0]._new_transaction()
+                if datetime:
+                    tx.t_stamp = datetime
+                if check_open:
+                    _check_open(closed, legs[0][0], tx.t_stamp)
+                tx.description = description
+                txs.append(tx)
+            _save_transactions(txs)
+
+            entries = []
+            posted = []
+            for tx, (_description, _datetime, legs) in zip(txs, chunk):
+                aes = tuple(account._make_ae(amount, memo, tx) for account, amount, memo in legs)
+                entries.extend(aes)
+                created.append(aes)
+                posted.extend((account, ae, tx.t_stamp) for (account, _amount, _memo), ae in zip(legs, aes))
+            type(entries[0])._default_manager.bulk_create(entries)
+
+            _entries_posted(posted)
+
+    return created
+
+
+def _entries_posted(posted):
+    """ Called after new entries are written.  'posted' is a sequence of
+    (account, entry, t_stamp) tuples.
+
+    Deletes the balance checkpoints made obsolete by backdated entries and
+    bumps the accounts' versions, using one query each, and drops the
+    accounts' cached balances.
+
+    The versions are bumped first: the UPDATE locks the accounts' rows until
+    the posting commits, which keeps a concurrent checkpoint (that locks them
+    too) from missing the new entries.  See BalanceCheckpoint.
+    """
+
+    entries_written(set(ae.account_id for _account, ae, _t_stamp in posted))
+
+    earliest = {}
+    for account, ae, t_stamp in posted:
+        key = ae.account_id
+        if key not in earliest or t_stamp < earliest[key][1]:
+            earliest[key] = (account, t_stamp)
+
+    versions = None
+    for account, _t_stamp in earliest.values():
+        qs = account._versions()
+        if qs is not None:
+            versions = qs if versions is None else versions | qs
+    if versions is not None:
+        versions.update(version=F('version') + 1)
+
+    obsolete = None
+    for account, t_stamp in earliest.values():
+        checkpoints = account._checkpoints()
+        if checkpoints is None:
+            continue
+        checkpoints = checkpoints.filter(as_of__gt=t_stamp)
+        obsolete = checkpoints if obsolete is None else obsolete | checkpoints
+
+    if obsolete is not None:
+        obsolete.delete()
+
+
+def _with_transaction_entries(rows, prefetch):
+    """ Yields (entry, transaction_entries) for each of the AccountEntry 'rows'.
+
+    If 'prefetch' is true, transaction_entries is a list of all of the
+    entry's transaction's entries, with their accounts.  They're fetched
+    with one query for every LEDGER_CHUNK_SIZE rows.  Otherwise it's None.
+    """
+
+    if not prefetch:
+        for e in rows:
+            yield e, None
+        return
+
+    for chunk in _chunked(rows, LEDGER_CHUNK_SIZE):
+        by_tid = defaultdict(list)
+        siblings = type(chunk[0])._default_manager.filter(
+            transaction_id__in=set(e.transaction_id for e in chunk)).select_related('account')
+        for ae in siblings:
+            by_tid[ae.transaction_id].append(ae)
+
+        for e in chunk:
+            yield e, by_tid[e.transaction_id]
+
+
+def _filter_range(qs, start=None, end=None):
+    "Restricts an AccountEntry queryset to the entries from 'start' (inclusive) to 'end' (exclusive)."
+    if start:
+        qs = qs.filter(t_stamp__gte=start)
+    if end:
+        qs = qs.filter(t_stamp__lt=end)
+    return qs
+
+
+def _minor_units(field='amount'):
+    "Selects an amount field as its raw number of minor units, instead of a Decimal."
+    return ExpressionWrapper(F(field), output_field=BigIntegerField())
+
+
+def _sum_positive():
+    return Sum(Case(When(amount__gt=0, then='amount'), default=Value(0)))
+
+
+def _sum_negative():
+    return Sum(Case(When(amount__lt=0, then='amount'), default=Value(0)))
+
+
+def _local(value, tz):
+    "Returns the naive, local time of 'value' in 'tz'."
+    if timezone.is_aware(value):
+        return timezone.make_naive(value, tz)
+    return value
+
+
+if Trunc is not None:
+    class _LocalTrunc(Trunc):
+        """ Trunc to a DateTimeField in 'tzinfo', giving naive local times.
+
+        Trunc itself makes the results aware, which raises for local midnights
+        that don't exist (or happen twice) where DST changes at midnight.
+        """
+
+        def convert_value(self, value, *args):
+            if value is not None:
+                value = value.replace(tzinfo=None)
+            return value
+
+
+def _annotate_bucket(qs, field_name, kind, tz):
+    """ Annotates 'qs' with 'bucket': 'field_name' truncated to the 'kind'
+    (day or month) in 'tz', as a naive local datetime.
+
+    Django < 1.10 doesn't have Trunc, so the backend's own truncation SQL
+    is added with extra() instead (which is what Trunc uses anyway).
+    """
+    if Trunc is not None:
+        return qs.annotate(bucket=_LocalTrunc(field_name, kind, output_field=DateTimeField(), tzinfo=tz))
+
+    connection = connections[qs.db]
+    qn = connection.ops.quote_name
+    opts = qs.model._meta
+    column = "{0}.{1}".format(qn(opts.db_table), qn(opts.get_field(field_name).column))
+    tzname = timezone._get_timezone_name(tz) if settings.USE_TZ else None
+    sql, params = connection.ops.datetime_trunc_sql(kind, column, tzname)
+    return qs.extra(select={'bucket': sql}, select_params=params)
+
+
+def _bucket_value(value):
+    "The naive datetime of an annotated 'bucket' (sqlite's truncation SQL returns strings)."
+    if not isinstance(value, datetime):
+        value = parse_datetime(value)
+    return value.replace(tzinfo=None)
+
+
+def _make_aware(value, tz):
+    "timezone.make_aware(value, tz, is_dst=False), which django 1.8 doesn't have."
+    if hasattr(tz, 'localize'):
+        return tz.localize(value, is_dst=False)
+    return timezone.make_aware(value, tz)
+
+
+def _bucket_floor(value, bucket):
+    "Returns the start of the day, week or month (a naive datetime) containing the naive datetime 'value'."
+    day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == 'month':
+        return day.replace(day=1)
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def _next_bucket(value, bucket):
+    if bucket == 'month':
+        if value.month == 12:
+            return value.replace(year=value.year + 1, month=1)
+        return value.replace(month=value.month + 1)
+    if bucket == 'week':
+        return value + timedelta(days=7)
+    return value + timedelta(days=1)
 
 
 @python_2_unicode_compatible
@@ -30,12 +337,15 @@ class LedgerEntry(object):
 
      """
 
-    def __init__(self, normalized_amount, ae, opening, closing):
+    def __init__(self, normalized_amount, ae, opening, closing, transaction_entries=None):
+        #the amounts are in minor units; they're converted to Decimals when read
         assert ae != None
         self._e = ae
         self._opening = opening
         self._closing = closing
         self._amount = normalized_amount
+        #all of the transaction's entries (with their accounts), if they were prefetched
+        self._transaction_entries = transaction_entries
 
     def __str__(self):
         if self._amount > 0:
@@ -58,30 +368,34 @@ class LedgerEntry(object):
     @property
     def debit(self):
         if self._amount >= 0:
-            return self._amount
+            return from_minor_units(self._amount)
         else:
             return None
 
     @property
     def credit(self):
         if self._amount < 0:
-            return -self._amount
+            return from_minor_units(-self._amount)
         else:
             return None
 
     @property
     def opening(self):
-        return self._opening
+        return from_minor_units(self._opening)
 
     @property
     def closing(self):
-        return self._closing
+        return from_minor_units(self._closing)
 
     @property
     def txid(self):
         d = self._e.transaction.t_stamp.date()
         return "{:04d}{:02d}{:02d}{:08d}".format(d.year, d.month, d.day, self._e.aeid)
 
+    def _key(self):
+        "The entry's position in the ledger: (t_stamp, tid, pk)."
+        return (self._e.t_stamp, self._e.transaction_id, self._e.pk)
+
     def other_entry(self):
         """ Returns the account of the other leg of this transaction.  Asserts if there's more than two legs. """
         l = self.other_entries()
@@ -99,8 +413,10 @@ class LedgerEntry(object):
         """
 
         l = []
-        t = self._e.transaction
-        for ae in t.entries.all():
+        entries = self._transaction_entries
+        if entries is None:
+            entries = self._e.transaction.entries.all()
+        for ae in entries:
             if ae != self._e:
                 amount = ae.amount * ae.account._DEBIT_IN_DB()
                 l.append((amount, ae.account))
@@ -108,7 +424,70 @@ class LedgerEntry(object):
         return l
 
 
-class AccountBase(object):
+#the columns a LedgerRow is built from
+_LEDGER_ROW_FIELDS = ('t_stamp', 'transaction__description', 'description', 'minor_amount', 'transaction_id', 'pk')
+
+
+@python_2_unicode_compatible
+class LedgerRow(object):
+    """ A compact, read-only ledger entry, built from a row of plain values
+    instead of model instances.  Returned by ledger(compact=True).
+
+    It has the same properties as LedgerEntry, but not other_entry() or
+    other_entries().
+    """
+
+    __slots__ = ('time', 'description', 'memo', '_amount', '_opening', '_closing', '_tid', '_aeid', '_txid')
+
+    def __init__(self, normalized_amount, row, opening, closing):
+        #the amounts are in minor units; they're converted to Decimals when read
+        self.time, self.description, self.memo, _amount, self._tid, self._aeid = row
+        self._amount = normalized_amount
+        self._opening = opening
+        self._closing = closing
+        self._txid = None
+
+    def __str__(self):
+        if self._amount > 0:
+            return "<ledger entry {0}Dr {1} {2}>".format(self.debit, self.time, self.description)
+        else:
+            return "<ledger entry {0}Cr {1} {2}>".format(self.credit, self.time, self.description)
+
+    @property
+    def debit(self):
+        if self._amount >= 0:
+            return from_minor_units(self._amount)
+        else:
+            return None
+
+    @property
+    def credit(self):
+        if self._amount < 0:
+            return from_minor_units(-self._amount)
+        else:
+            return None
+
+    @property
+    def opening(self):
+        return from_minor_units(self._opening)
+
+    @property
+    def closing(self):
+        return from_minor_units(self._closing)
+
+    @property
+    def txid(self):
+        if self._txid is None:
+            d = self.time.date()
+            self._txid = "{:04d}{:02d}{:02d}{:08d}".format(d.year, d.month, d.day, self._aeid)
+        return self._txid
+
+    def _key(self):
+        "The entry's position in the ledger: (t_stamp, tid, pk)."
+        return (self.time, self._tid, self._aeid)
+
+
+class AccountBase(AccountAsyncMixin):
     """ Implements a high-level account interface.
 
     Children must implement: _make_ae, _new_transaction, _entries,
@@ -134,6 +513,30 @@ class AccountBase(object):
     def get_bookset(self):  # pragma: no coverage
         raise NotImplementedError()
 
+    def _bookset_id(self):
+        "Return the id of the BookSet this account belongs to."
+        return self.get_bookset().pk
+
+    def _account_id(self):  # pragma: no coverage
+        "Return the id of the underlying account, which entries are written to."
+        raise NotImplementedError()
+
+    def _checkpoints(self):
+        "Return a queryset of the balance checkpoints for the underlying account, or None if it has none."
+        return None
+
+    def _balance_checkpoints(self):
+        "Return a queryset of balance checkpoints that match _entries(), or None if checkpoints can't be used."
+        return None
+
+    def _cache_key(self):
+        "Return a hashable key identifying this account's entries (starting with the underlying account's id) for caching, or None."
+        return None
+
+    def _versions(self):
+        "Return a queryset of the underlying account, whose 'version' is incremented whenever entries are posted to it, or None."
+        return None
+
     #If, by historical accident, debits are negative and credits are positive in the database, set this to -1.  By default
     #otherwise leave it as 1 as standard partice is to have debits positive.
     #(this variable is multipled against data before storage and after retrieval.)
@@ -158,6 +561,7 @@ class AccountBase(object):
         return self.post(-amount, debit_account, description, self_memo=credit_memo, other_memo=debit_memo, datetime=datetime)
 
     @transaction.atomic
+    @instrumented('post', rows=len)
     def post(self, amount, other_account, description, self_memo="", other_memo="", datetime=None):
         """ Post a transaction of 'amount' against this account and the negative amount against 'other_account'.
 
@@ -171,6 +575,7 @@ class AccountBase(object):
         if datetime:
             tx.t_stamp = datetime
         #else now()
+        _check_open({}, self, tx.t_stamp)
 
         tx.description = description
         tx.save()
@@ -180,16 +585,58 @@ class AccountBase(object):
         a2 = other_account._make_ae(-self._DEBIT_IN_DB() * amount, other_memo, tx)
         a2.save()
 
+        _entries_posted([(self, a1, tx.t_stamp), (other_account, a2, tx.t_stamp)])
+
         return (a1, a2)
 
-    def balance(self, date=None):
-        """ returns the account balance as of 'date' (datetime stamp) or now().  """
+    @instrumented('post_batch', rows=_count_entries)
+    def post_batch(self, postings, chunk_size=BULK_CHUNK_SIZE):
+        """ Post many transactions against this account at once.
+
+        'postings' is an iterable of tuples with the same arguments as post():
+        (amount, other_account, description[, self_memo[, other_memo[, datetime]]]).
+        They're written with bulk inserts in chunks of 'chunk_size', all
+        inside one database transaction.
+
+        Returns a list of (self_entry, other_entry) tuples, like post().
+        """
+
+        return _post_many((Posting(self, *p) for p in postings), chunk_size)
+
+    def _db_balance(self, date=None):
+        """ returns the sum of the entries before 'date' (or all of them), as stored in the database.
+
+        Only the entries after the closest balance checkpoint are summed. """
 
         qs = self._entries()
+        b = 0
+
+        checkpoints = self._balance_checkpoints()
+        if checkpoints is not None:
+            if date:
+                checkpoints = checkpoints.filter(as_of__lte=date)
+            checkpoint = (checkpoints.order_by('-as_of').annotate(minor_balance=_minor_units('balance'))
+                .values_list('as_of', 'minor_balance').first())
+            if checkpoint:
+                as_of, b = checkpoint
+                qs = qs.filter(t_stamp__gte=as_of)
+
         if date:
-            qs = qs.filter(transaction__t_stamp__lt=date)
-        r = qs.aggregate(b=Sum('amount'))
-        b = r['b']
+            qs = qs.filter(t_stamp__lt=date)
+        r = qs.aggregate(b=Sum(_minor_units()))
+        if r['b'] is not None:
+            b += r['b']
+
+        return from_minor_units(b)
+
+    @instrumented('balance')
+    def balance(self, date=None):
+        """ returns the account balance as of 'date' (datetime stamp) or now().  """
+
+        return cached(self, 'balance', (date,), lambda: self._normalize_balance(self._db_balance(date)))
+
+    def _normalize_balance(self, b):
+        """ Converts a sum of entries, as stored in the database, to this account's balance. """
 
         flip = self._DEBIT_IN_DB()
         if self._positive_credit():
@@ -197,18 +644,11 @@ class AccountBase(object):
 
         if b is None:
             b = Decimal("0.00")
-        b *= flip
-
-        #print "returning balance %s for %s" % (b, self)
-        return b
+        return b * flip
 
     def _entries_range(self, start=None, end=None):
-        qs = self._entries()
-        if start:
-            qs = qs.filter(transaction__t_stamp__gte=start)
-        if end:
-            qs = qs.filter(transaction__t_stamp__lt=end)
-        qs = qs.order_by("transaction__t_stamp", "transaction__tid")
+        qs = _filter_range(self._entries(), start, end)
+        qs = qs.order_by("t_stamp", "transaction_id")
 
         return qs
 
@@ -216,7 +656,8 @@ class AccountBase(object):
     #a time period.
     #   - cashflow? No necessarily cash
     #   - transactions? How is it different from entries or ledger?
-    Totals = namedtuple('Totals', ['credits', 'debits', 'net'])
+    Totals = Totals
+    @instrumented('totals')
     def totals(self, start=None, end=None):
         """Returns a Totals object containing the sum of all debits, credits
         and net change over the period of time from start to end.
@@ -224,13 +665,20 @@ class AccountBase(object):
         'start' is inclusive, 'end' is exclusive
         """
 
-        qs = self._entries_range(start=start, end=end)
-        qs_positive = qs.filter(amount__gt=Decimal("0.00")).all().aggregate(Sum('amount'))
-        qs_negative = qs.filter(amount__lt=Decimal("0.00")).all().aggregate(Sum('amount'))
+        def compute():
+            qs = self._entries_range(start=start, end=end)
+            r = qs.aggregate(positives=_sum_positive(), negatives=_sum_negative())
+            return self._make_totals(r['positives'], r['negatives'])
+
+        return cached(self, 'totals', (start, end), compute)
+
+    def _make_totals(self, positive_sum, negative_sum):
+        """ Returns a Totals object given the sums of the positive and the
+        negative entries, as stored in the database (None if there were none.) """
 
         #Is there a cleaner way of saying this?  Should the sum of 0 things be None?
-        positives = qs_positive['amount__sum'] if qs_positive['amount__sum'] is not None else 0
-        negatives = -qs_negative['amount__sum'] if qs_negative['amount__sum'] is not None else 0
+        positives = positive_sum if positive_sum is not None else 0
+        negatives = -negative_sum if negative_sum is not None else 0
 
         if self._DEBIT_IN_DB() > 0:
             debits = positives
@@ -245,7 +693,51 @@ class AccountBase(object):
 
         return self.Totals(credits, debits, net)
 
-    def ledger(self, start=None, end=None):
+    def totals_series(self, start, end, bucket='day', tz=None):
+        """Returns a list of (bucket_start, Totals) tuples: one for every
+        day, week (starting on Monday) or month from start to end, as
+        given by 'bucket'.
+
+        'start' is inclusive, 'end' is exclusive.  Buckets are computed in
+        the timezone 'tz' (by default, the current timezone).  The first
+        bucket begins at or before 'start', and buckets without any entries
+        have zero totals.  All of the buckets are summed with one query.
+
+        Where DST starts at midnight, that day's bucket begins when the day
+        does (eg. 01:00); where it ends at midnight, at the first midnight.
+        """
+
+        if bucket not in ('day', 'week', 'month'):
+            raise ValueError("unknown bucket: {0}".format(bucket))
+        if tz is None:
+            tz = timezone.get_current_timezone()
+
+        #weeks are summed by day and added up here since not all databases
+        #can truncate to weeks.
+        kind = 'month' if bucket == 'month' else 'day'
+        qs = self._entries_range(start=start, end=end).order_by()
+        rows = _annotate_bucket(qs, 't_stamp', kind, tz
+            ).values('bucket').annotate(positives=_sum_positive(), negatives=_sum_negative())
+
+        sums = defaultdict(lambda: [0, 0])
+        for row in rows:
+            key = _bucket_floor(_bucket_value(row['bucket']), bucket)
+            sums[key][0] += row['positives'] or 0
+            sums[key][1] += row['negatives'] or 0
+
+        series = []
+        key = _bucket_floor(_local(start, tz), bucket)
+        local_end = _local(end, tz)
+        while key < local_end:
+            positives, negatives = sums.get(key, (None, None))
+            bucket_start = _make_aware(key, tz) if timezone.is_aware(start) else key
+            series.append((bucket_start, self._make_totals(positives, negatives)))
+            key = _next_bucket(key, bucket)
+
+        return series
+
+    @instrumented('ledger', iterator=True)
+    def ledger(self, start=None, end=None, with_counterparties=False, compact=False):
         """Returns a list of entries for this account.
 
         Ledger returns a sequence of LedgerEntry's matching the criteria
@@ -257,35 +749,188 @@ class AccountBase(object):
 
         If 'end' is given, only entries before that datetime are
         returned.  'end' must be given with a timezone.
+
+        If 'with_counterparties' is true, the other legs of the entries'
+        transactions (and their accounts) are fetched with one query for
+        every LEDGER_CHUNK_SIZE entries, so other_entry() and other_entries()
+        don't need to query the database.
+
+        If 'compact' is true, the entries are LedgerRow's, built from plain
+        column values without any model instances.  They take much less time
+        and memory for long ledgers, but don't have other_entries(), so
+        'with_counterparties' can't be used with them.
+        """
+
+        qs = self._ledger_rows(self._entries_range(start=start, end=end), with_counterparties, compact)
+
+        balance = 0
+        if start:
+            balance = to_minor_units(self.balance(start))
+
+        #stream the rows, but peek at the first one so the caller can test
+        #for no entries.
+        rows = qs.iterator()
+        first = next(rows, None)
+        if first is None:
+            return []
+
+        return self._ledger_entries(chain([first], rows), balance, with_counterparties, compact)
+
+    def _ledger_rows(self, qs, with_counterparties, compact):
+        "Selects what the ledger's entries are built from: AccountEntries, or a LedgerRow's columns."
+        qs = qs.annotate(minor_amount=_minor_units())
+        if compact:
+            if with_counterparties:
+                raise ValueError("compact ledger rows don't have counterparties")
+            return qs.values_list(*_LEDGER_ROW_FIELDS)
+        return qs.select_related('transaction')
+
+    def ledger_arrays(self, start=None, end=None):
+        """Returns the same ledger as ledger(), as a LedgerArrays of NumPy
+        arrays suitable for analysis (eg. building a pandas DataFrame.)
+
+        The arrays are:
+
+            t_stamp -- datetime64[us]; in UTC if the time stamps have a timezone
+            amount -- int64 minor units (cents); debits positive, credits negative
+            tid, aeid -- int64 transaction and entry ids
+            opening, closing -- int64 minor units; the account's running balance
+
+        The rows are streamed straight from the database into the arrays,
+        without creating any model instances or LedgerEntry's.  Requires
+        numpy.
         """
 
+        import numpy
+
+        qs = self._entries_range(start=start, end=end).order_by("t_stamp", "transaction_id", "pk")
+        rows = qs.annotate(minor_amount=_minor_units()).values_list(
+            't_stamp', 'minor_amount', 'transaction_id', 'pk').iterator()
+
+        def columns():
+            for t_stamp, amount, tid, aeid in rows:
+                if timezone.is_aware(t_stamp):
+                    t_stamp = timezone.make_naive(t_stamp, timezone.utc)
+                yield t_stamp, amount, tid, aeid
+
+        table = numpy.fromiter(columns(), dtype=[
+            ('t_stamp', 'datetime64[us]'), ('amount', 'int64'), ('tid', 'int64'), ('aeid', 'int64')])
+
+        amount = table['amount'] * self._DEBIT_IN_DB()
+        change = -amount if self._positive_credit() else amount
+
+        opening_balance = to_minor_units(self.balance(start)) if start else 0
+        closing = opening_balance + numpy.cumsum(change)
+        opening = closing - change
+
+        return LedgerArrays(table['t_stamp'], amount, table['tid'], table['aeid'], opening, closing)
+
+    def _ledger_entries(self, rows, balance, with_counterparties=False, compact=False):
+        """ Yields a LedgerEntry for each of the AccountEntry 'rows' (or a
+        LedgerRow for each row of _LEDGER_ROW_FIELDS values, if 'compact'),
+        keeping a running balance, in minor units, starting at 'balance'. """
+
         DEBIT_IN_DB = self._DEBIT_IN_DB()
 
         flip = 1
         if self._positive_credit():
             flip *= -1
 
-        qs = self._entries_range(start=start, end=end)
-        qs = qs.order_by("transaction__t_stamp", "transaction__tid")
+        if compact:
+            for row in rows:
+                amount = row[3] * DEBIT_IN_DB
+                o_balance = balance
+                balance += flip * amount
 
-        balance = Decimal("0.00")
-        if start:
-            balance = self.balance(start)
+                yield LedgerRow(amount, row, o_balance, balance)
+            return
+
+        for e, transaction_entries in _with_transaction_entries(rows, with_counterparties):
+            amount = e.minor_amount * DEBIT_IN_DB
+            o_balance = balance
+            balance += flip * amount
+
+            yield LedgerEntry(amount, e, o_balance, balance, transaction_entries)
+
+    def _ledger_page(self, start, end, after, balance, page_size, with_counterparties, compact=False):
+        """ Returns a list of up to 'page_size' LedgerEntry's following the
+        (t_stamp, tid, pk) key 'after' (or from the start), and whether there
+        are more.  'balance' is the balance before the first entry, in minor units. """
+
+        qs = self._ledger_rows(self._entries_range(start=start, end=end), with_counterparties, compact)
+        qs = qs.order_by("t_stamp", "transaction_id", "pk")
+        if after:
+            t_stamp, tid, pk = after
+            qs = qs.filter(Q(t_stamp__gt=t_stamp) |
+                Q(t_stamp=t_stamp, transaction_id__gt=tid) |
+                Q(t_stamp=t_stamp, transaction_id=tid, pk__gt=pk))
+
+        rows = list(qs[:page_size + 1])
+        entries = list(self._ledger_entries(rows[:page_size], balance, with_counterparties, compact))
+        return entries, len(rows) > page_size
+
+    def ledger_page(self, start=None, end=None, cursor=None, page_size=LEDGER_PAGE_SIZE, with_counterparties=False,
+            compact=False):
+        """Returns one page of this account's ledger: a tuple of a list of up
+        to 'page_size' LedgerEntry's, and a cursor for the next page (None
+        if this is the last page.)
+
+        Pass the cursor back, with the same 'start' and 'end', to get the
+        next page.  Pages are found by their position in the ledger (no
+        OFFSET) and the cursor carries the running balance, so each page
+        costs the same.  Cursors are signed strings, safe to hand to an HTTP
+        client; django.core.signing.BadSignature is raised for a forged one.
+
+        'start', 'end', 'with_counterparties' and 'compact' are the same as
+        ledger().
+        """
 
-        if not qs:
-            return []
+        if cursor:
+            value = signing.loads(cursor, salt=_LEDGER_CURSOR_SALT)
+            after = (parse_datetime(value['t_stamp']), value['tid'], value['pk'])
+            balance = to_minor_units(Decimal(value['balance']))
+        else:
+            after = None
+            balance = to_minor_units(self.balance(start)) if start else 0
+
+        entries, more = self._ledger_page(start, end, after, balance, page_size, with_counterparties, compact)
+
+        next_cursor = None
+        if more:
+            t_stamp, tid, pk = entries[-1]._key()
+            next_cursor = signing.dumps({
+                't_stamp': t_stamp.isoformat(),
+                'tid': tid,
+                'pk': pk,
+                'balance': str(entries[-1].closing),
+            }, salt=_LEDGER_CURSOR_SALT)
+
+        return entries, next_cursor
+
+    @instrumented('iter_ledger', iterator=True)
+    def iter_ledger(self, start=None, end=None, page_size=LEDGER_PAGE_SIZE, with_counterparties=False, compact=False):
+        """Iterates over the same LedgerEntry's (or LedgerRow's) as ledger(),
+        but fetches them 'page_size' at a time so memory use stays flat no
+        matter how long the ledger is.
+        """
 
-        #helper is a hack so the caller can test for no entries.
-        def helper(balance_in):
-            balance = balance_in
-            for e in qs.all():
-                amount = e.amount * DEBIT_IN_DB
-                o_balance = balance
-                balance += flip * amount
+        for entries in self._ledger_pages(start, end, page_size, with_counterparties, compact):
+            for le in entries:
+                yield le
+
+    def _ledger_pages(self, start, end, page_size, with_counterparties, compact=False):
+        "Yields lists of up to 'page_size' LedgerEntry's until the whole ledger has been returned."
 
-                yield LedgerEntry(amount, e, o_balance, balance)
+        after = None
+        balance = to_minor_units(self.balance(start)) if start else 0
+        while True:
+            entries, more = self._ledger_page(start, end, after, balance, page_size, with_counterparties, compact)
+            yield entries
+            if not more:
+                return
 
-        return helper(balance)
+            after = entries[-1]._key()
+            balance = entries[-1]._closing
 
 
 @python_2_unicode_compatible
@@ -301,6 +946,12 @@ class ThirdPartySubAccount(AccountBase):
     def get_bookset(self):
         return self._parent.get_bookset()
 
+    def _bookset_id(self):
+        return self._parent._bookset_id()
+
+    def _account_id(self):
+        return self._parent._account_id()
+
     def _make_ae(self, amount, memo, tx):
         ae = self._parent._make_ae(amount, memo, tx)
         if self._third_party:
@@ -321,6 +972,18 @@ class ThirdPartySubAccount(AccountBase):
     def _positive_credit(self):
         return self._parent._positive_credit()
 
+    def _checkpoints(self):
+        return self._parent._checkpoints()
+
+    def _versions(self):
+        return self._parent._versions()
+
+    def _cache_key(self):
+        key = self._parent._cache_key()
+        if key is not None and self._third_party:
+            key += ('third_party', self._third_party.pk)
+        return key
+
     def _DEBIT_IN_DB(self):
         return self._parent._DEBIT_IN_DB()
 
@@ -354,20 +1017,173 @@ class ProjectAccount(ThirdPartySubAccount):
 
         return qs
 
+    def _cache_key(self):
+        key = super(ProjectAccount, self)._cache_key()
+        if key is not None and self._project:
+            key += ('project', self._project.pk)
+        return key
+
     def __str__(self):
         return """<ProjectAccount for bookset {0} tp {1}>""".format(self.get_bookset(), self._third_party)
 
 
-class BookSetBase(object):
+def _post_many(postings, chunk_size=BULK_CHUNK_SIZE):
+    def legs():
+        for p in postings:
+            DEBIT_IN_DB = p.account._DEBIT_IN_DB()
+            yield p.description, p.datetime, (
+                (p.account, DEBIT_IN_DB * p.amount, p.self_memo),
+                (p.other_account, -DEBIT_IN_DB * p.amount, p.other_memo),
+            )
+
+    return _bulk_post(legs(), chunk_size)
+
+
+class BookSetBase(BookSetAsyncMixin):
     """ Base account for BookSet-like-things, such as BookSets and Projects.
 
-    children must implement accounts()
+    children must implement accounts() and _entries()
     """
 
     def accounts(self):  # pragma: no coverage
         """Returns a sequence of account objects belonging to this bookset."""
         raise NotImplementedError()
 
+    def _entries(self):  # pragma: no coverage
+        "Return a queryset of all the AccountEntries in this bookset."
+        raise NotImplementedError()
+
+    def _closed_until(self):
+        "Returns the time before which nothing may be posted, or None if no period is closed."
+        return None
+
+    def _bookset_id(self):  # pragma: no coverage
+        "Return the id of the BookSet (for projects, their parent BookSet)."
+        raise NotImplementedError()
+
+    def _check_accounts(self, accounts):
+        "Raises ValueError unless all of 'accounts' belong to this bookset."
+        bookset_id = self._bookset_id()
+        for account in accounts:
+            if account._bookset_id() != bookset_id:
+                raise ValueError("{0} doesn't belong to bookset {1}".format(account, bookset_id))
+
+    def trial_balance(self, as_of=None):
+        """ Returns the balances of all of this bookset's accounts, as of
+        'as_of' (datetime stamp) or now().
+
+        The balances are computed with one query, and returned as an
+        OrderedDict of account -> balance in the order of accounts().
+        """
+
+        qs = self._entries()
+        if as_of:
+            qs = qs.filter(t_stamp__lt=as_of)
+        sums = dict(qs.values_list('account').annotate(b=Sum('amount')).order_by())
+
+        return OrderedDict((a, a._normalize_balance(sums.get(a.pk))) for a in self.accounts())
+
+    def totals_for(self, accounts, start=None, end=None):
+        """ Returns the totals (see AccountBase.totals) of each of 'accounts'
+        over the period of time from start to end, using one query.
+
+        'accounts' may include third party and project accounts, but must
+        belong to this bookset: otherwise ValueError is raised.  'start' is
+        inclusive, 'end' is exclusive.  Returns an OrderedDict of
+        account -> Totals in the same order as 'accounts'.
+        """
+
+        accounts = list(accounts)
+        self._check_accounts(accounts)
+
+        #summed by underlying account, third party and project, then added up
+        #for each account's (see _cache_key()) third party or project, if any
+        qs = _filter_range(self._entries().filter(account__in=set(a._account_id() for a in accounts)), start, end)
+        rows = defaultdict(list)
+        for row in qs.values_list('account', 'third_party', 'transaction__project').annotate(
+                positives=_sum_positive(), negatives=_sum_negative()).order_by():
+            rows[row[0]].append(row[1:])
+
+        def totals(account):
+            key = account._cache_key()
+            if key is None:
+                return account.totals(start, end)
+
+            filters = dict(zip(key[1::2], key[2::2]))
+            positive_sum = negative_sum = None
+            for third_party_id, project_id, positives, negatives in rows.get(key[0], ()):
+                if (filters.get('third_party', third_party_id) == third_party_id
+                        and filters.get('project', project_id) == project_id):
+                    positive_sum = (positive_sum or 0) + positives
+                    negative_sum = (negative_sum or 0) + negatives
+            return account._make_totals(positive_sum, negative_sum)
+
+        return OrderedDict((a, totals(a)) for a in accounts)
+
+    @instrumented('post_many', rows=_count_entries)
+    def post_many(self, postings, chunk_size=BULK_CHUNK_SIZE):
+        """ Post many two-legged transactions at once.
+
+        'postings' is an iterable of Posting tuples (or plain tuples in the
+        same order).  Each is equivalent to calling
+        account.post(amount, other_account, description, self_memo, other_memo, datetime),
+        but the transactions are written with bulk inserts in chunks of
+        'chunk_size', all inside one database transaction.  If an account
+        doesn't belong to this bookset, ValueError is raised and none of the
+        postings are written.
+
+        Returns a list of (entry, other_entry) tuples, one for each posting.
+        """
+
+        def checked():
+            for p in postings:
+                p = Posting(*p)
+                self._check_accounts((p.account, p.other_account))
+                yield p
+
+        return _post_many(checked(), chunk_size)
+
+    def _leg_account(self, account, third_party):
+        if third_party:
+            return ThirdPartySubAccount(account, third_party=third_party)
+        return account
+
+    @instrumented('post_split', rows=len)
+    def post_split(self, description, legs, datetime=None):
+        """ Post a split transaction: one with any number of legs.
+
+        'legs' is a sequence of Leg tuples (or plain tuples in the same order):
+        (account, amount[, memo[, third_party]]).  Debits are positive amounts
+        and credits are negative.  ValueError is raised before anything is
+        written unless the amounts, rounded to minor units, add up to zero and
+        the accounts are different accounts of this bookset.  (Third parties
+        of one account count as the same account.)  All the legs are written
+        with a single bulk insert.
+
+        Returns a tuple of the new AccountEntries, in the same order as 'legs'.
+        """
+
+        legs = [Leg(*l) for l in legs]
+        if len(legs) < 2:
+            raise ValueError("a transaction needs at least two legs")
+
+        accounts = [self._leg_account(l.account, l.third_party) for l in legs]
+        self._check_accounts(accounts)
+        if len(set(account._account_id() for account in accounts)) != len(accounts):
+            raise ValueError("a transaction can only have one leg per account")
+
+        #what will be stored, so the stored legs add up to zero too
+        amounts = [to_minor_units(l.amount) for l in legs]
+        if sum(amounts) != 0:
+            raise ValueError("the legs of a transaction must sum to zero")
+
+        db_legs = []
+        for account, amount, l in zip(accounts, amounts, legs):
+            db_legs.append((account, account._DEBIT_IN_DB() * from_minor_units(amount), l.memo))
+
+        return _bulk_post([(description, datetime, db_legs)])[0]
+
+    @instrumented('get_third_party')
     def get_third_party(self, third_party):
         """Return the account for the given third-party.  Raise <something> if the third party doesn't belong to this bookset."""
         actual_account = third_party.get_account()
@@ -378,17 +1194,32 @@ class BookSetBase(object):
 class ProjectBase(BookSetBase):
     """ Base account for Projects.
 
-    Children must implement: get_bookset() and accounts()
+    Children must implement: get_bookset(), accounts() and _filter_project_qs()
     """
 
     def get_bookset(self):  # pragma: no coverage
         """Returns the the parent (main) bookset """
         raise NotImplementedError()
 
+    def _filter_project_qs(self, qs):  # pragma: no coverage
+        "Return the AccountEntry queryset 'qs' restricted to this project."
+        raise NotImplementedError()
+
+    def _entries(self):
+        return self._filter_project_qs(self.get_bookset()._entries())
+
+    @instrumented('get_account')
     def get_account(self, name):
         actual_account = self.get_bookset().get_account(name)
         return ProjectAccount(actual_account, project=self)
 
+    def _closed_until(self):
+        return self.get_bookset()._closed_until()
+
+    def _leg_account(self, account, third_party):
+        return ProjectAccount(account, project=self, third_party=third_party)
+
+    @instrumented('get_third_party')
     def get_third_party(self, third_party):
         """Return the account for the given third-party.  Raise <something> if the third party doesn't belong to this bookset."""
         actual_account = third_party.get_account()
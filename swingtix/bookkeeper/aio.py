@@ -0,0 +1,109 @@
+"""
+
+asyncio counterparts of the account API, for use from async code (eg. ASGI views).
+
+AccountBase and BookSetBase get these methods on python 3.6 and later:
+
+    await account.apost(...)          await bookset.apost_many(...)
+    await account.apost_batch(...)    await bookset.apost_split(...)
+    await account.abalance(...)       await bookset.atrial_balance(...)
+    await account.atotals(...)        await bookset.atotals_for(...)
+    async for le in account.aledger(...):
+
+Django's ORM is synchronous, so each call runs its synchronous counterpart
+in a bounded thread pool: many independent reports can run at the same
+time from one event loop (eg. with asyncio.gather), at most
+BOOKKEEPER_ASYNC_THREADS (default 8) at once.  Like a request, each call
+closes its thread's database connection afterwards when it's older than
+CONN_MAX_AGE.
+
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+
+
+def get_executor():
+    """Returns the thread pool used to run the synchronous API."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'BOOKKEEPER_ASYNC_THREADS', 8))
+    return _executor
+
+
+def set_executor(executor):
+    """Replaces the thread pool (eg. with a larger one) and returns the previous one."""
+    global _executor
+    previous = _executor
+    _executor = executor
+    return previous
+
+
+def _call(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    """Runs func(*args, **kwargs) in the thread pool and returns its result."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(), partial(_call, func, args, kwargs))
+
+
+class AccountAsyncMixin(object):
+    """ asyncio versions of AccountBase's API. """
+
+    async def apost(self, *args, **kwargs):
+        return await run_sync(self.post, *args, **kwargs)
+
+    async def apost_batch(self, *args, **kwargs):
+        return await run_sync(self.post_batch, *args, **kwargs)
+
+    async def abalance(self, *args, **kwargs):
+        return await run_sync(self.balance, *args, **kwargs)
+
+    async def atotals(self, *args, **kwargs):
+        return await run_sync(self.totals, *args, **kwargs)
+
+    async def aledger(self, start=None, end=None, page_size=None, with_counterparties=False, compact=False):
+        """ An async iterable of the same LedgerEntry's as ledger(), fetched
+        'page_size' at a time like iter_ledger().
+
+        Use with_counterparties=True before calling other_entries() on the
+        results: otherwise that queries the database from the event loop.
+        """
+
+        from .account_api import LEDGER_PAGE_SIZE
+
+        pages = self._ledger_pages(start, end, page_size or LEDGER_PAGE_SIZE, with_counterparties, compact)
+        while True:
+            entries = await run_sync(next, pages, None)
+            if entries is None:
+                return
+            for le in entries:
+                yield le
+
+
+class BookSetAsyncMixin(object):
+    """ asyncio versions of BookSetBase's API. """
+
+    async def apost_many(self, *args, **kwargs):
+        return await run_sync(self.post_many, *args, **kwargs)
+
+    async def apost_split(self, *args, **kwargs):
+        return await run_sync(self.post_split, *args, **kwargs)
+
+    async def atrial_balance(self, *args, **kwargs):
+        return await run_sync(self.trial_balance, *args, **kwargs)
+
+    async def atotals_for(self, *args, **kwargs):
+        return await run_sync(self.totals_for, *args, **kwargs)
@@ -0,0 +1,209 @@
+"""
+
+Benchmarks of the account API against synthetic booksets.
+
+    books = generate_booksets(booksets=1, transactions=100000)
+    results = run_benchmarks(books, repeat=20)
+    json.dump(results, f, cls=DjangoJSONEncoder)
+
+generate_booksets() creates booksets with the given number of accounts,
+third parties, projects and transactions, posted with bulk inserts.  The
+transactions' time stamps are skewed like real books': most are recent, and
+clustered around business hours.  The random numbers are seeded, so the same
+arguments always produce the same books.
+
+run_benchmarks() times the common operations against them, and records how
+many queries each makes and how much memory it allocates at its peak (on
+python 3).  The results are plain dicts, to be saved as JSON and compared
+between releases; see the "bookkeeper_benchmark" management command.
+
+"""
+
+from __future__ import unicode_literals
+from builtins import range
+from datetime import timedelta
+from decimal import Decimal
+from timeit import default_timer
+import platform
+import random
+
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import __VERSION__
+from .account_api import Posting
+from .models import BookSet, Account, ThirdParty, Project
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no coverage
+    #python 2
+    tracemalloc = None
+
+#the operations timed by run_benchmarks(), in order
+OPERATIONS = ('post', 'balance', 'totals', 'ledger', 'other_entries', 'get_third_party')
+
+
+def _t_stamp(rng, end, days):
+    """ A random time stamp in the 'days' before 'end': half of them are in the
+    last days/6 days, and most are during business hours. """
+
+    age = int(days * rng.betavariate(1, 4))
+    hour = min(max(int(rng.gauss(13, 3)), 0), 23)
+    t = end - timedelta(days=age)
+    t = t.replace(hour=hour, minute=rng.randrange(60), second=rng.randrange(60), microsecond=0)
+    if t >= end:
+        t -= timedelta(days=1)
+    return t
+
+
+def generate_bookset(description="benchmark", accounts=10, third_parties=20, projects=2,
+        transactions=1000, days=365, end=None, seed=0):
+    """ Creates a BookSet filled with synthetic data, and returns it.
+
+    The accounts alternate between debit-positive (assets, expenses) and
+    credit-positive ones.  The third parties are spread over the accounts,
+    and a third of the transactions are posted to one.  One in four
+    transactions belongs to a project, if there are any.  The transactions are
+    spread over the 'days' before 'end' (default: now).
+    """
+
+    assert accounts >= 2
+
+    rng = random.Random(seed)
+    if end is None:
+        end = timezone.now()
+
+    book = BookSet.objects.create(description=description)
+    account_list = [Account.objects.create(bookset=book, name="account-{0:03d}".format(i),
+        positive_credit=bool(i % 2)) for i in range(accounts)]
+    third_party_list = [ThirdParty.objects.create(account=account_list[i % accounts],
+        name="third party {0}".format(i)) for i in range(third_parties)]
+    project_list = [Project.objects.create(bookset=book, name="project {0}".format(i))
+        for i in range(projects)]
+
+    def postings():
+        for i in range(transactions):
+            third_party = None
+            if third_party_list and rng.random() < 1.0 / 3:
+                third_party = rng.choice(third_party_list)
+                account = third_party.account
+            else:
+                account = rng.choice(account_list)
+            other_account = rng.choice([a for a in account_list if a != account])
+
+            books = book
+            if project_list and rng.random() < 0.25:
+                books = rng.choice(project_list)
+
+            yield Posting(books._leg_account(account, third_party), Decimal(rng.randrange(1, 100000)) / 100,
+                books._leg_account(other_account, None), "transaction {0}".format(i), "", "",
+                _t_stamp(rng, end, days))
+
+    book.post_many(postings())
+    return book
+
+
+def generate_booksets(booksets=1, seed=0, **kwargs):
+    """ Creates 'booksets' BookSets with generate_bookset(), passing on the
+    other arguments, and returns them as a list. """
+
+    return [generate_bookset(description="benchmark {0}".format(i), seed=seed + i, **kwargs)
+        for i in range(booksets)]
+
+
+def _measure(operation, repeat):
+    """ Calls operation(i) for i in range(repeat) and returns its timings.
+    One more call counts its queries and peak memory, so those don't slow
+    down the timed calls. """
+
+    times = []
+    for i in range(repeat):
+        t0 = default_timer()
+        operation(i)
+        times.append(default_timer() - t0)
+
+    peak_memory = None
+    if tracemalloc:
+        tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            operation(repeat)
+        if tracemalloc:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        if tracemalloc:
+            tracemalloc.stop()
+
+    return {
+        'calls': repeat,
+        'total': sum(times),
+        'mean': sum(times) / repeat,
+        'min': min(times),
+        'max': max(times),
+        'queries': len(queries),
+        'peak_memory': peak_memory,
+    }
+
+
+def run_benchmarks(booksets, repeat=10):
+    """ Times each of OPERATIONS 'repeat' times against the accounts of
+    'booksets', and returns a dict with the results and the environment.
+
+    Calls cycle through the accounts and third parties, so caches don't make
+    every call after the first free.  Note that the 'post' benchmark adds
+    transactions to the books.
+    """
+
+    assert repeat > 0
+
+    #pairs of accounts in the same bookset
+    pairs = []
+    third_parties = []
+    for book in booksets:
+        accounts = list(book.accounts())
+        pairs.extend(zip(accounts, accounts[1:] + accounts[:1]))
+        third_parties.extend((book, tp) for tp in
+            ThirdParty.objects.filter(account__bookset=book).select_related('account__bookset'))
+    assert pairs, "the booksets need some accounts"
+
+    def account(i):
+        return pairs[i % len(pairs)][0]
+
+    def post(i):
+        a, other = pairs[i % len(pairs)]
+        a.post(Decimal("1.00"), other, "benchmark")
+
+    def ledger(i):
+        for _ in account(i).ledger():
+            pass
+
+    def other_entries(i):
+        for le in account(i).ledger():
+            le.other_entries()
+
+    def get_third_party(i):
+        if third_parties:
+            book, third_party = third_parties[i % len(third_parties)]
+            book.get_third_party(third_party)
+
+    operations = {
+        'post': post,
+        'balance': lambda i: account(i).balance(),
+        'totals': lambda i: account(i).totals(),
+        'ledger': ledger,
+        'other_entries': other_entries,
+        'get_third_party': get_third_party,
+    }
+
+    return {
+        'bookkeeper': __VERSION__,
+        'django': django.get_version(),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'entries': sum(book._entries().count() for book in booksets),
+        'repeat': repeat,
+        'results': dict((name, _measure(operations[name], repeat)) for name in OPERATIONS),
+    }
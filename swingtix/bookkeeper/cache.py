@@ -0,0 +1,250 @@
+"""
+
+Optional caching of AccountBase.balance() and totals().
+
+Caching is off by default.  Turn it on by installing a cache, typically at
+start-up:
+
+    from swingtix.bookkeeper.cache import BalanceCache, set_balance_cache
+    set_balance_cache(BalanceCache(max_size=10000))
+
+BalanceCache keeps values in the process's memory.  Cached values are
+dropped whenever entries are posted to their account through the account
+API (post(), post_many(), post_split(), ...).  Entries written by other
+means (raw SQL, AccountEntry.objects.create(), other processes) aren't
+noticed: call invalidate() or clear() after those.
+
+SharedBalanceCache keeps values in one of django's caches (eg. memcached),
+so they're shared between processes:
+
+    set_balance_cache(SharedBalanceCache('default'))
+
+It stays coherent using Account.version, which the account API increments
+in the same database transaction that posts entries.
+
+A cache must implement:
+
+    get(key):
+        " Returns (value, token).  On a miss, value is MISSING. "
+
+    set(key, value, token):
+        " Store value under key, unless the account has been invalidated since get() returned token. "
+
+    invalidate(account_id):
+        " Drop every value for the account. "
+
+key[0] is the account's _cache_key(), whose first element is the id of the
+underlying Account.
+"""
+
+from __future__ import unicode_literals
+from builtins import object
+from collections import OrderedDict, defaultdict
+import hashlib
+import threading
+
+from django.core.cache import caches
+from django.db import transaction
+
+#returned by get() on a cache miss
+MISSING = object()
+
+_cache = None
+
+
+def get_balance_cache():
+    """Returns the installed cache, or None if caching is off."""
+    return _cache
+
+
+def set_balance_cache(cache):
+    """Installs 'cache' (None turns caching off) and returns the previous one."""
+    global _cache
+    previous = _cache
+    _cache = cache
+    return previous
+
+
+class BalanceCache(object):
+    """ A bounded, thread-safe, in-process LRU cache.
+
+    'hits' and 'misses' count the lookups, to check the cache is helping.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._keys_by_account = defaultdict(set)
+        self._generations = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            token = self._generations[key[0][0]]
+            value = self._values.pop(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._values[key] = value  # now the most recently used
+            return value, token
+
+    def set(self, key, value, token):
+        account_id = key[0][0]
+        with self._lock:
+            if self._generations[account_id] != token:
+                return
+            self._values.pop(key, None)
+            self._values[key] = value
+            self._keys_by_account[account_id].add(key)
+
+            while len(self._values) > self.max_size:
+                old_key, _old_value = self._values.popitem(last=False)
+                self._discard_key(old_key)
+
+    def invalidate(self, account_id):
+        with self._lock:
+            self._generations[account_id] += 1
+            for key in self._keys_by_account.pop(account_id, ()):
+                del self._values[key]
+
+    def clear(self):
+        with self._lock:
+            for account_id in list(self._keys_by_account):
+                self._generations[account_id] += 1
+            self._values.clear()
+            self._keys_by_account.clear()
+
+    def __len__(self):
+        return len(self._values)
+
+    def _discard_key(self, key):
+        keys = self._keys_by_account[key[0][0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_account[key[0][0]]
+
+
+class SharedBalanceCache(object):
+    """ A cache shared between processes, using the django cache 'alias'.
+
+    Values are stored under their account's current version, which is read
+    from the database (a primary key lookup) on every get().  Since the
+    version is incremented when entries are committed, a reader never gets
+    a value computed before the latest commit.  Stale versions simply expire
+    after 'timeout' seconds (None uses the cache's default.)
+
+    'hits' and 'misses' count this process's lookups.
+    """
+
+    def __init__(self, alias='default', timeout=None, key_prefix='swingtix.bookkeeper'):
+        self.alias = alias
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_key(self, key, version):
+        #only the account id and a digest of the rest, so the key is safe for memcached
+        digest = hashlib.md5(repr(key[0][1:] + key[1:]).encode('utf-8')).hexdigest()
+        return '{0}:{1}:{2}:{3}'.format(self.key_prefix, key[0][0], version, digest)
+
+    def get(self, key):
+        from .models import Account
+
+        version = Account.objects.filter(pk=key[0][0]).values_list('version', flat=True).first()
+        value = caches[self.alias].get(self._cache_key(key, version), MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value, version
+
+    def set(self, key, value, token):
+        kwargs = {} if self.timeout is None else {'timeout': self.timeout}
+        caches[self.alias].set(self._cache_key(key, token), value, **kwargs)
+
+    def invalidate(self, account_id):
+        #posting increments the account's version, which retires its values
+        pass
+
+
+#Accounts written in this thread's current database transaction.  Their
+#values aren't read from or stored in the cache until it finishes, so the
+#cache never sees uncommitted (and possibly rolled back) entries.
+_local = threading.local()
+
+
+def _written_accounts():
+    """ The ids of the accounts written in this thread's unfinished database
+    transaction.
+
+    Each write queues an on_commit() callback; the accounts stay written for
+    as long as it's queued.  Django drops the callback once it has run (the
+    transaction committed) or when the transaction, or the savepoint it was
+    queued in, is rolled back.
+
+    Django 1.8 doesn't have on_commit(): there, the accounts stay written
+    until this thread next uses the cache outside of any atomic block, and
+    their values are dropped again then.
+    """
+
+    pending = getattr(_local, 'pending', None)
+    if not pending:
+        return frozenset()
+
+    connection = transaction.get_connection()
+    if hasattr(connection, 'run_on_commit'):
+        queued = [f for _savepoint_ids, f in connection.run_on_commit]
+        pending[:] = [(f, account_ids) for f, account_ids in pending if any(f is q for q in queued)]
+    elif not connection.in_atomic_block:
+        for committed, _account_ids in pending:
+            committed()
+        del pending[:]
+    return frozenset().union(*[account_ids for _f, account_ids in pending])
+
+
+def entries_written(account_ids):
+    """ Called by the account API when entries are posted to the accounts
+    'account_ids' (inside a database transaction). """
+
+    cache = get_balance_cache()
+    if cache is None:
+        return
+
+    account_ids = set(account_ids)
+    for account_id in account_ids:
+        cache.invalidate(account_id)
+
+    if transaction.get_connection().in_atomic_block:
+        def committed():
+            for account_id in account_ids:
+                cache.invalidate(account_id)
+        if hasattr(transaction, 'on_commit'):
+            transaction.on_commit(committed)
+
+        pending = getattr(_local, 'pending', None)
+        if pending is None:
+            pending = _local.pending = []
+        pending.append((committed, account_ids))
+
+
+def cached(account, name, args, compute):
+    """ Returns compute(), the value of account.<name>(*args), from the cache if possible. """
+
+    cache = get_balance_cache()
+    if cache is None:
+        return compute()
+
+    account_key = account._cache_key()
+    if account_key is None or account_key[0] in _written_accounts():
+        return compute()
+
+    key = (account_key, name) + tuple(args)
+    value, token = cache.get(key)
+    if value is MISSING:
+        value = compute()
+        cache.set(key, value, token)
+    return value
@@ -0,0 +1,72 @@
+"""
+
+Money amounts stored as whole numbers of minor units (eg. cents).
+
+AmountField is a BigIntegerField: the database stores, compares and sums
+integers, which is exact and fast and allows amounts far beyond the old
+DecimalField(max_digits=8) limit of 999,999.99.  Model attributes and
+aggregates over the field are still Decimals with 'decimal_places' places,
+so the account API is unchanged.
+
+To get the raw integers (eg. for running totals), select the field with a
+BigIntegerField output:
+
+    ExpressionWrapper(F('amount'), output_field=BigIntegerField())
+
+"""
+
+from __future__ import unicode_literals
+from decimal import Decimal
+
+from django.db import models
+
+#the number of decimal places of the amounts in the books: 2, for cents
+DECIMAL_PLACES = 2
+
+
+def to_minor_units(amount, decimal_places=DECIMAL_PLACES):
+    "Converts a Decimal (or int) amount to a whole number of minor units, rounding half to even."
+    return int(Decimal(amount).scaleb(decimal_places).to_integral_value())
+
+
+def from_minor_units(value, decimal_places=DECIMAL_PLACES):
+    "Converts a whole number of minor units to a Decimal amount."
+    return Decimal(value).scaleb(-decimal_places)
+
+
+class AmountField(models.BigIntegerField):
+    """ A money amount, stored as a whole number of minor units in a BIGINT
+    column but used as a Decimal with 'decimal_places' places. """
+
+    description = "Money amount stored in minor units"
+
+    def __init__(self, verbose_name=None, name=None, decimal_places=DECIMAL_PLACES, **kwargs):
+        self.decimal_places = decimal_places
+        super(AmountField, self).__init__(verbose_name, name, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(AmountField, self).deconstruct()
+        if self.decimal_places != DECIMAL_PLACES:
+            kwargs['decimal_places'] = self.decimal_places
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, *args):
+        if value is None:
+            return value
+        return from_minor_units(value, self.decimal_places)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        return Decimal(value)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+        return to_minor_units(value, self.decimal_places)
+
+    def formfield(self, **kwargs):
+        from django import forms
+        defaults = {'form_class': forms.DecimalField, 'decimal_places': self.decimal_places}
+        defaults.update(kwargs)
+        return models.Field.formfield(self, **defaults)
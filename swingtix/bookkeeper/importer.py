@@ -0,0 +1,139 @@
+"""
+
+Imports bank statements, or any other list of dated amounts, into an account.
+
+    with io.open("statement.csv", newline="") as f:
+        result = import_statement(bank, uncategorized, read_csv(f, reference="id"))
+
+Each statement line is posted between the account and 'other_account' (eg. a
+suspense account, to be categorized later).  Lines are read, posted and
+forgotten a chunk at a time, so statements of any size can be imported
+without loading them into memory.  Each chunk is written with bulk inserts in
+its own database transaction.
+
+Every imported line is recorded (see ImportedLine) by a digest of its account,
+date, amount and reference.  Lines already imported are skipped, so
+overlapping statements can be imported and an interrupted import can simply
+be run again.  Note that lines with the same date, amount and reference are
+considered the same line: use the bank's transaction id as the reference when
+the statement has one.
+
+"""
+
+from __future__ import unicode_literals
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+import csv
+import hashlib
+
+from django.db import transaction
+from django.utils import timezone
+
+from .account_api import BULK_CHUNK_SIZE, Posting, _chunked, _post_many
+from .models import ImportedLine
+
+#One line of a statement.  Positive amounts increase the account's balance
+#(eg. deposits to a bank account, or charges to a credit card account).
+StatementLine = namedtuple('StatementLine', ['date', 'amount', 'description', 'reference'])
+StatementLine.__new__.__defaults__ = ("", "")
+
+#Running counts of an import: lines read, posted, and skipped as already imported.
+ImportResult = namedtuple('ImportResult', ['read', 'imported', 'duplicates'])
+
+
+def read_csv(f, date='date', amount='amount', description='description', reference='reference',
+        date_format='%Y-%m-%d', parse_amount=Decimal, **csv_options):
+    """ Yields a StatementLine for each row of the CSV file 'f'.
+
+    The file must have a header row; 'date', 'amount', 'description' and
+    'reference' are the names of the columns to use.  'description' and
+    'reference' may be None if the file doesn't have them.  Dates are parsed
+    with 'date_format' (and made timezone-aware when USE_TZ is on), amounts
+    with parse_amount().  Other keyword arguments are passed to csv.DictReader.
+
+    On python 3, open the file in text mode with newline=''.
+    """
+
+    make_aware = timezone.is_aware(timezone.now())
+
+    for row in csv.DictReader(f, **csv_options):
+        d = datetime.strptime(row[date].strip(), date_format)
+        if make_aware:
+            d = timezone.make_aware(d)
+
+        yield StatementLine(
+            d,
+            parse_amount(row[amount].strip()),
+            row[description].strip() if description else "",
+            row[reference].strip() if reference else "")
+
+
+def line_digest(account, line):
+    "Returns the digest identifying 'line' when imported into 'account'."
+    key = '{0}|{1}|{2}|{3}'.format(account.pk, line.date.isoformat(),
+        Decimal(line.amount).quantize(Decimal('0.01')), line.reference)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def import_statement(account, other_account, lines, chunk_size=BULK_CHUNK_SIZE, dry_run=False, progress=None):
+    """ Posts each of 'lines' (an iterable of StatementLine's) between 'account'
+    and 'other_account', skipping the lines already imported into 'account'.
+
+    The line's description becomes the transaction's description, and its
+    reference the memo of the entry in 'account'.  Lines are handled in
+    chunks of 'chunk_size': one query finds the chunk's duplicates, then the
+    rest are posted in one database transaction.
+
+    With dry_run=True, nothing is posted: 'imported' counts the lines that
+    would have been.  The ImportedLine's (without transactions) are still
+    written, so duplicates in later chunks are found like in a real import
+    without keeping every digest in memory, but in one database transaction
+    that's rolled back at the end.
+
+    If given, progress(result) is called after each chunk with the running
+    ImportResult.  Returns the final ImportResult.
+    """
+
+    if not dry_run:
+        return _import(account, other_account, lines, chunk_size, False, progress)
+
+    with transaction.atomic():
+        result = _import(account, other_account, lines, chunk_size, True, progress)
+        transaction.set_rollback(True)
+    return result
+
+
+def _import(account, other_account, lines, chunk_size, dry_run, progress):
+    sign = -1 if account._positive_credit() else 1
+    read = imported = duplicates = 0
+
+    for chunk in _chunked(lines, chunk_size):
+        digests = [line_digest(account, line) for line in chunk]
+        seen = set(ImportedLine.objects.filter(account=account,
+            digest__in=digests).values_list('digest', flat=True))
+
+        new = []
+        for line, digest in zip(chunk, digests):
+            if digest in seen:
+                duplicates += 1
+            else:
+                seen.add(digest)
+                new.append((line, digest))
+
+        if dry_run:
+            ImportedLine.objects.bulk_create([ImportedLine(account=account, digest=digest) for _line, digest in new])
+        elif new:
+            with transaction.atomic():
+                created = _post_many([Posting(account, sign * line.amount, other_account,
+                    line.description, line.reference, "", line.date) for line, _digest in new], chunk_size)
+                ImportedLine.objects.bulk_create([
+                    ImportedLine(account=account, digest=digest, transaction=entries[0].transaction)
+                    for (_line, digest), entries in zip(new, created)])
+
+        read += len(chunk)
+        imported += len(new)
+        if progress:
+            progress(ImportResult(read, imported, duplicates))
+
+    return ImportResult(read, imported, duplicates)
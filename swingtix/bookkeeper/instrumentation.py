@@ -0,0 +1,241 @@
+"""
+
+Optional instrumentation of the account API.
+
+Instrumentation is off by default.  Turn it on by installing a sink,
+typically at start-up:
+
+    from swingtix.bookkeeper.instrumentation import LoggingSink, set_metrics_sink
+    set_metrics_sink(LoggingSink())
+
+A sink is any callable taking a Metric.  It's called once for each call of an
+instrumented method: post(), post_batch(), post_many(), post_split(),
+balance(), totals(), ledger(), iter_ledger(), get_account() and
+get_third_party().  Nested calls (eg. the balance() inside ledger()) are
+reported separately, and also counted in the outer call.
+
+  * LoggingSink -- logs every call
+  * HistogramSink -- keeps a histogram of the call times in memory
+
+For ledger() and iter_ledger(), the metric is sent once the ledger has been
+iterated over (or discarded), and only counts the time and queries spent
+fetching the entries: not what the caller does with them.
+
+Queries are counted on the default database connection for the duration of
+the call, with connection.execute_wrapper() (django 2.0 and later) or by
+wrapping the cursors it makes.  When no sink is installed, an instrumented
+call costs one extra function call.
+"""
+
+from __future__ import unicode_literals
+from builtins import object
+from collections import namedtuple
+from functools import wraps
+from timeit import default_timer
+import bisect
+import logging
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import CursorWrapper
+
+#One call of an instrumented method: its wall time in seconds, the number of
+#database queries it made, and the number of entries it wrote or returned
+#(None for calls that don't deal in entries, such as balance().)
+Metric = namedtuple('Metric', ['name', 'seconds', 'queries', 'rows'])
+
+_sink = None
+
+
+def get_metrics_sink():
+    """Returns the installed sink, or None if instrumentation is off."""
+    return _sink
+
+
+def set_metrics_sink(sink):
+    """Installs 'sink' (None turns instrumentation off) and returns the previous one."""
+    global _sink
+    previous = _sink
+    _sink = sink
+    return previous
+
+
+class LoggingSink(object):
+    """ Logs each metric, by default at DEBUG level to the
+    'swingtix.bookkeeper.metrics' logger. """
+
+    def __init__(self, logger='swingtix.bookkeeper.metrics', level=logging.DEBUG):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def __call__(self, metric):
+        self.logger.log(self.level, "%s: %.6fs, %d queries, %s rows", *metric)
+
+
+class HistogramSink(object):
+    """ Keeps a histogram of each method's call times in memory, along with
+    its total time, queries and rows.  Thread-safe.
+
+    'buckets' are the upper bounds, in seconds, of the histogram's buckets; a
+    last bucket counts the calls slower than all of them.
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, metric):
+        with self._lock:
+            stats = self._stats.get(metric.name)
+            if stats is None:
+                stats = self._stats[metric.name] = {
+                    'count': 0,
+                    'seconds': 0.0,
+                    'max_seconds': 0.0,
+                    'queries': 0,
+                    'max_queries': 0,
+                    'rows': 0,
+                    'histogram': [0] * (len(self.buckets) + 1),
+                }
+
+            stats['count'] += 1
+            stats['seconds'] += metric.seconds
+            stats['max_seconds'] = max(stats['max_seconds'], metric.seconds)
+            stats['queries'] += metric.queries
+            stats['max_queries'] = max(stats['max_queries'], metric.queries)
+            stats['rows'] += metric.rows or 0
+            stats['histogram'][bisect.bisect_left(self.buckets, metric.seconds)] += 1
+
+    def summary(self):
+        """ Returns a dict of method name -> a dict of its count, seconds,
+        max_seconds, queries, max_queries, rows and histogram (the number of
+        calls in each bucket.) """
+
+        with self._lock:
+            return dict((name, dict(stats, histogram=list(stats['histogram'])))
+                for name, stats in self._stats.items())
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class _CountingCursor(CursorWrapper):
+    "Counts the queries executed with 'cursor' in 'measurement', while it's measuring (for django < 2.0)."
+
+    def __init__(self, cursor, db, measurement):
+        super(_CountingCursor, self).__init__(cursor, db)
+        self.measurement = measurement
+
+    def execute(self, sql, params=None):
+        if self.measurement.measuring:
+            self.measurement.queries += 1
+        return super(_CountingCursor, self).execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        if self.measurement.measuring:
+            self.measurement.queries += 1
+        return super(_CountingCursor, self).executemany(sql, param_list)
+
+
+class _Measurement(object):
+    """ Adds up the time and queries spent inside 'with' blocks. """
+
+    #the connection's methods that wrap its new cursors, on django < 2.0
+    CURSOR_FACTORIES = ('make_cursor', 'make_debug_cursor')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+        self.measuring = False
+
+    def _execute(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        db = connections[DEFAULT_DB_ALIAS]
+        if hasattr(db, 'execute_wrapper'):
+            self._wrapper = db.execute_wrapper(self._execute)
+            self._wrapper.__enter__()
+        else:
+            #nested measurements wrap each other's factories, so all of them count
+            self._factories = dict((name, db.__dict__.get(name)) for name in self.CURSOR_FACTORIES)
+            for name in self.CURSOR_FACTORIES:
+                setattr(db, name, self._counting(getattr(db, name), db))
+        self.measuring = True
+        self._start = default_timer()
+
+    def _counting(self, make_cursor, db):
+        return lambda cursor: _CountingCursor(make_cursor(cursor), db, self)
+
+    def __exit__(self, *exc_info):
+        self.seconds += default_timer() - self._start
+        self.measuring = False
+        db = connections[DEFAULT_DB_ALIAS]
+        if hasattr(db, 'execute_wrapper'):
+            self._wrapper.__exit__(None, None, None)
+            return
+
+        for name, factory in self._factories.items():
+            if factory is None:
+                delattr(db, name)
+            else:
+                setattr(db, name, factory)
+
+
+def _iterate(name, sink, iterator, measurement):
+    "Yields from 'iterator', measuring each step, and sends the metric when done."
+
+    rows = 0
+    try:
+        while True:
+            with measurement:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            rows += 1
+            yield item
+    finally:
+        sink(Metric(name, measurement.seconds, measurement.queries, rows))
+
+
+def instrumented(name, rows=None, iterator=False):
+    """ Decorates a method so each call is sent to the installed sink as a
+    Metric called 'name'.
+
+    'rows', if given, computes the Metric's rows from the return value.  With
+    iterator=True, the method returns a sequence or iterator of entries,
+    which is measured until it's exhausted.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            sink = _sink
+            if sink is None:
+                return f(*args, **kwargs)
+
+            measurement = _Measurement()
+            try:
+                with measurement:
+                    result = f(*args, **kwargs)
+            except Exception:
+                sink(Metric(name, measurement.seconds, measurement.queries, None))
+                raise
+
+            if iterator:
+                if isinstance(result, list):
+                    sink(Metric(name, measurement.seconds, measurement.queries, len(result)))
+                    return result
+                return _iterate(name, sink, iter(result), measurement)
+
+            sink(Metric(name, measurement.seconds, measurement.queries, rows(result) if rows else None))
+            return result
+
+        return wrapper
+    return decorator
@@ -0,0 +1,15 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+def parse_datetime_arg(value):
+    """Parse a command-line datetime, making it timezone-aware when USE_TZ is on."""
+    result = parse_datetime(value)
+    if result is None:
+        raise CommandError("invalid datetime: {0}".format(value))
+    if timezone.is_naive(result) and timezone.is_aware(timezone.now()):
+        result = timezone.make_aware(result)
+    return result
@@ -0,0 +1,44 @@
+from __future__ import unicode_literals
+
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from swingtix.bookkeeper.benchmark import generate_booksets, run_benchmarks
+from swingtix.bookkeeper.models import BookSet
+from .bookkeeper_generate import add_scale_arguments, scale_options
+
+
+class Command(BaseCommand):
+    help = """Time the account API and write the results as JSON.  By default, synthetic
+        booksets are generated for the run and rolled back afterwards; use --bookset to
+        benchmark existing ones (eg. made with bookkeeper_generate) instead."""
+
+    def add_arguments(self, parser):
+        add_scale_arguments(parser)
+        parser.add_argument('--bookset', type=int, action='append', dest='bookset_ids',
+            help="id of an existing bookset to benchmark; can be repeated.  Note that "
+                "the 'post' benchmark adds transactions to it.")
+        parser.add_argument('--repeat', type=int, default=10,
+            help="number of timed calls of each operation (default: 10)")
+        parser.add_argument('--output', help="file to write the results to (default: standard output)")
+
+    def handle(self, *args, **options):
+        if options['bookset_ids']:
+            books = list(BookSet.objects.filter(id__in=options['bookset_ids']))
+            results = run_benchmarks(books, repeat=options['repeat'])
+        else:
+            with transaction.atomic():
+                books = generate_booksets(**scale_options(options))
+                results = run_benchmarks(books, repeat=options['repeat'])
+                transaction.set_rollback(True)
+            results['scale'] = scale_options(options)
+
+        output = json.dumps(results, cls=DjangoJSONEncoder, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
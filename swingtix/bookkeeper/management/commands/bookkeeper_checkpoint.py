@@ -0,0 +1,40 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from swingtix.bookkeeper.management import parse_datetime_arg
+from swingtix.bookkeeper.models import BookSet
+
+
+def start_of_month(now):
+    """The start of now's month, in the current timezone when USE_TZ is on."""
+    if timezone.is_aware(now):
+        local = timezone.localtime(now).replace(tzinfo=None)
+        return timezone.make_aware(local.replace(day=1, hour=0, minute=0, second=0, microsecond=0))
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+class Command(BaseCommand):
+    help = """Record balance checkpoints so balance() only sums the entries after them.
+        By default, checkpoints are made at the start of the current month."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of',
+            help="checkpoint time, eg. 2016-01-01T00:00:00 (default: start of the current month)")
+        parser.add_argument('--bookset', type=int, action='append', dest='booksets',
+            help="id of a bookset to checkpoint; can be repeated (default: all booksets)")
+
+    def handle(self, *args, **options):
+        if options['as_of']:
+            as_of = parse_datetime_arg(options['as_of'])
+        else:
+            as_of = start_of_month(timezone.now())
+
+        booksets = BookSet.objects.all()
+        if options['booksets']:
+            booksets = booksets.filter(id__in=options['booksets'])
+
+        for book in booksets:
+            book.checkpoint_balances(as_of)
+            self.stdout.write("checkpointed {0} as of {1}".format(book, as_of))
@@ -0,0 +1,40 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from swingtix.bookkeeper.benchmark import generate_booksets
+
+
+def add_scale_arguments(parser):
+    "The arguments giving the size of the generated booksets."
+    parser.add_argument('--booksets', type=int, default=1, help="number of booksets (default: 1)")
+    parser.add_argument('--accounts', type=int, default=10, help="accounts per bookset (default: 10)")
+    parser.add_argument('--third-parties', type=int, default=20, help="third parties per bookset (default: 20)")
+    parser.add_argument('--projects', type=int, default=2, help="projects per bookset (default: 2)")
+    parser.add_argument('--transactions', type=int, default=1000,
+        help="transactions per bookset (default: 1000)")
+    parser.add_argument('--days', type=int, default=365,
+        help="the transactions are spread over this many days before now (default: 365)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+
+
+def scale_options(options):
+    "The keyword arguments for generate_booksets() from the arguments added by add_scale_arguments()."
+    return dict((name, options[name]) for name in
+        ('booksets', 'accounts', 'third_parties', 'projects', 'transactions', 'days', 'seed'))
+
+
+class Command(BaseCommand):
+    help = """Create booksets filled with synthetic accounts, third parties, projects and
+        transactions, eg. for benchmarking."""
+
+    def add_arguments(self, parser):
+        add_scale_arguments(parser)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            books = generate_booksets(**scale_options(options))
+
+        for book in books:
+            self.stdout.write("created bookset {0}: {1}".format(book.pk, book))
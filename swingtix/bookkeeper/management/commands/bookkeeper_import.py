@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from swingtix.bookkeeper.account_api import BULK_CHUNK_SIZE
+from swingtix.bookkeeper.importer import import_statement, read_csv
+from swingtix.bookkeeper.models import Account
+
+
+class Command(BaseCommand):
+    help = """Import a bank statement in CSV format into an account, skipping the lines
+        that were already imported.  Each line is posted against --other-account."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="the CSV file; it must have a header row")
+        parser.add_argument('--bookset', type=int, required=True, help="id of the bookset")
+        parser.add_argument('--account', required=True, help="name of the account the statement is for")
+        parser.add_argument('--other-account', required=True,
+            help="name of the account to post the other side of each line to, eg. a suspense account")
+        parser.add_argument('--date-column', default='date')
+        parser.add_argument('--date-format', default='%Y-%m-%d')
+        parser.add_argument('--amount-column', default='amount')
+        parser.add_argument('--description-column', default='description')
+        parser.add_argument('--reference-column', default='reference')
+        parser.add_argument('--delimiter', default=',')
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true', default=False,
+            help="report what would be imported without writing anything")
+
+    def _get_account(self, bookset, name):
+        try:
+            return Account.objects.get(bookset_id=bookset, name=name)
+        except Account.DoesNotExist:
+            raise CommandError("no account named {0} in bookset {1}".format(name, bookset))
+
+    def handle(self, *args, **options):
+        account = self._get_account(options['bookset'], options['account'])
+        other_account = self._get_account(options['bookset'], options['other_account'])
+
+        def progress(result):
+            self.stdout.write("{0} lines read, {1} imported, {2} already imported".format(*result))
+
+        with io.open(options['file'], newline='', encoding=options['encoding']) as f:
+            lines = read_csv(f,
+                date=options['date_column'],
+                amount=options['amount_column'],
+                description=options['description_column'] or None,
+                reference=options['reference_column'] or None,
+                date_format=options['date_format'],
+                delimiter=str(options['delimiter']))
+
+            try:
+                result = import_statement(account, other_account, lines,
+                    chunk_size=options['chunk_size'], dry_run=options['dry_run'], progress=progress)
+            except (KeyError, ValueError, ArithmeticError) as e:
+                raise CommandError("can't read {0}: {1!r}".format(options['file'], e))
+
+        if options['dry_run']:
+            self.stdout.write("dry run: {0} of {1} lines would be imported".format(result.imported, result.read))
@@ -0,0 +1,52 @@
+from __future__ import unicode_literals
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from swingtix.bookkeeper.management import parse_datetime_arg
+from swingtix.bookkeeper.models import BookSet
+from swingtix.bookkeeper.runner import run_reports
+
+
+class Command(BaseCommand):
+    help = """Build the trial balance, totals and (optionally) ledgers of many booksets
+        in parallel, writing one JSON object per line."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookset', type=int, action='append', dest='booksets',
+            help="id of a bookset to report on; can be repeated (default: all booksets)")
+        parser.add_argument('--processes', type=int, default=None,
+            help="number of worker processes (default: the number of CPUs; 0 runs in this process)")
+        parser.add_argument('--start', help="start of the reporting period, eg. 2016-01-01T00:00:00")
+        parser.add_argument('--end', help="end of the reporting period (exclusive)")
+        parser.add_argument('--ledgers', action='store_true', default=False,
+            help="include every account's ledger for the period")
+        parser.add_argument('--output', help="file to write to (default: standard output)")
+
+    def handle(self, *args, **options):
+        booksets = options['booksets']
+        if not booksets:
+            booksets = list(BookSet.objects.order_by('id').values_list('id', flat=True))
+
+        kwargs = {'ledgers': options['ledgers']}
+        for name in ('start', 'end'):
+            if options[name]:
+                kwargs[name] = parse_datetime_arg(options[name])
+
+        out = open(options['output'], 'w') if options['output'] else self.stdout
+        failures = 0
+        try:
+            for result in run_reports(booksets, processes=options['processes'], **kwargs):
+                if result.error:
+                    failures += 1
+                    self.stderr.write("bookset {0} failed:\n{1}".format(result.bookset_id, result.error))
+                else:
+                    out.write(json.dumps(result.report, cls=DjangoJSONEncoder, sort_keys=True) + "\n")
+        finally:
+            if out is not self.stdout:
+                out.close()
+
+        if failures:
+            raise CommandError("{0} of {1} booksets failed".format(failures, len(booksets)))
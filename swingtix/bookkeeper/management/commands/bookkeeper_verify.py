@@ -0,0 +1,33 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from swingtix.bookkeeper.verify import CHUNK_SIZE, OVERLAP, verify, verify_incremental
+
+
+class Command(BaseCommand):
+    help = """Find transactions whose entries don't add up to zero or span more than one bookset.
+        By default, only the transactions added since the last run are checked."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', default=False,
+            help="check every transaction, without reading or moving the stored mark")
+        parser.add_argument('--mark', default="default",
+            help="name of the stored mark to check from (default: %(default)s)")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+            help="transaction ids checked per query (default: %(default)s)")
+        parser.add_argument('--overlap', type=int, default=OVERLAP,
+            help="transaction ids before the mark to check again (default: %(default)s)")
+
+    def handle(self, *args, **options):
+        if options['full']:
+            problems = list(verify(chunk_size=options['chunk_size']))
+        else:
+            problems = verify_incremental(options['mark'], chunk_size=options['chunk_size'],
+                overlap=options['overlap'])
+
+        for problem in problems:
+            self.stderr.write("transaction {0}: entries add up to {1}, in {2} booksets".format(*problem))
+
+        if problems:
+            raise CommandError("{0} transactions break the bookkeeping invariants".format(len(problems)))
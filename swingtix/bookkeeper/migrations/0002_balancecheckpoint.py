@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookkeeper', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.AutoField(serialize=False, primary_key=True)),
+                ('as_of', models.DateTimeField(help_text='Entries strictly before this time are included in the balance.')),
+                ('balance', models.DecimalField(decimal_places=2, help_text="The sum of the entries' amounts, as stored in the database.", max_digits=20)),
+                ('account', models.ForeignKey(related_name='checkpoints', to='bookkeeper.Account')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='balancecheckpoint',
+            unique_together=set([('account', 'as_of')]),
+        ),
+        #missing from 0001_initial
+        migrations.AlterUniqueTogether(
+            name='account',
+            unique_together=set([('bookset', 'name')]),
+        ),
+    ]
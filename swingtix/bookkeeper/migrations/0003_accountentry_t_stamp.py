@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Max
+
+#entries are back-filled this many at a time
+CHUNK_SIZE = 10000
+
+
+def backfill_t_stamp(apps, schema_editor):
+    AccountEntry = apps.get_model('bookkeeper', 'AccountEntry')
+    Transaction = apps.get_model('bookkeeper', 'Transaction')
+
+    #a correlated UPDATE, since Subquery() needs django 1.11
+    qn = schema_editor.quote_name
+    sql = ("UPDATE {entry} SET {t_stamp} = (SELECT t.{t_stamp} FROM {transaction} t WHERE t.{tid} = {entry}.{tid})"
+        " WHERE {aeid} >= %s AND {aeid} < %s AND {t_stamp} IS NULL").format(
+        entry=qn(AccountEntry._meta.db_table), transaction=qn(Transaction._meta.db_table),
+        t_stamp=qn('t_stamp'), tid=qn('tid'), aeid=qn('aeid'))
+
+    last = AccountEntry.objects.aggregate(last=Max('aeid'))['last'] or 0
+    for low in range(0, last + 1, CHUNK_SIZE):
+        schema_editor.execute(sql, [low, low + CHUNK_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    #commit each chunk of the back-fill separately so large tables aren't
+    #rewritten in a single database transaction
+    atomic = False
+
+    dependencies = [
+        ('bookkeeper', '0002_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountentry',
+            name='t_stamp',
+            field=models.DateTimeField(null=True, help_text="A copy of the transaction's t_stamp, so entries can be found by time without a join."),
+        ),
+        migrations.RunPython(backfill_t_stamp, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='accountentry',
+            name='t_stamp',
+            field=models.DateTimeField(help_text="A copy of the transaction's t_stamp, so entries can be found by time without a join."),
+        ),
+        migrations.AlterIndexTogether(
+            name='accountentry',
+            index_together=set([('account', 't_stamp', 'transaction')]),
+        ),
+    ]
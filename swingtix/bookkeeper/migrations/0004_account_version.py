@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookkeeper', '0003_accountentry_t_stamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='version',
+            field=models.BigIntegerField(default=0, help_text='Incremented, in the same database transaction, whenever\n        entries are posted to this account.  Used to keep shared caches\n        coherent.'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookkeeper', '0004_account_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedLine',
+            fields=[
+                ('id', models.AutoField(serialize=False, primary_key=True)),
+                ('digest', models.CharField(help_text="sha1 of the line's date, amount and reference.", max_length=40)),
+                ('account', models.ForeignKey(related_name='imported_lines', to='bookkeeper.Account')),
+                ('transaction', models.ForeignKey(related_name='imported_lines', to='bookkeeper.Transaction')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='importedline',
+            unique_together=set([('account', 'digest')]),
+        ),
+    ]
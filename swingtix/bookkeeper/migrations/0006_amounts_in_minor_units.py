@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import F, Func, Max
+
+import swingtix.bookkeeper.fields
+
+#rows are converted this many at a time
+CHUNK_SIZE = 10000
+
+
+class _FromMinorUnits(Func):
+    """ The Decimal amount of a column of minor units, divided exactly (not
+    as a float.)  Cast() needs django 1.10; 'max_digits' is the target
+    column's.  sqlite doesn't have exact decimals: its decimal columns hold
+    floats anyway. """
+
+    template = 'CAST(%(expressions)s AS DECIMAL(%(max_digits)s, 0)) / 100'
+
+    def as_sqlite(self, compiler, connection):
+        return self.as_sql(compiler, connection, template='%(expressions)s / 100.0')
+
+
+def _convert(model_name, pk_name, field_name, max_digits, to_minor):
+    """ Copies the Decimal column 'field_name' into the integer column
+    'minor_<field_name>' (or back again) in chunks of primary keys. """
+
+    minor_name = 'minor_' + field_name
+
+    def convert(apps, schema_editor):
+        Model = apps.get_model('bookkeeper', model_name)
+
+        if to_minor:
+            target, value = minor_name, Func(F(field_name) * 100, function='ROUND')
+        else:
+            target, value = field_name, _FromMinorUnits(F(minor_name), max_digits=max_digits)
+
+        last = Model.objects.aggregate(last=Max(pk_name))['last'] or 0
+        for low in range(0, last + 1, CHUNK_SIZE):
+            Model.objects.filter(**{pk_name + '__gte': low, pk_name + '__lt': low + CHUNK_SIZE}
+                ).update(**{target: value})
+
+    return convert
+
+
+def to_minor_units(model_name, pk_name, field_name, decimal_field, amount_field):
+    """ The operations replacing a DecimalField with an AmountField holding
+    the same amounts, converted to minor units.  They're reversible. """
+
+    minor_name = 'minor_' + field_name
+    null_decimal_field = decimal_field.clone()
+    null_decimal_field.null = True
+
+    return [
+        migrations.AlterField(model_name=model_name, name=field_name, field=null_decimal_field),
+        migrations.AddField(model_name=model_name, name=minor_name, field=models.BigIntegerField(null=True)),
+        migrations.RunPython(_convert(model_name, pk_name, field_name, decimal_field.max_digits, True),
+            _convert(model_name, pk_name, field_name, decimal_field.max_digits, False)),
+        migrations.RemoveField(model_name=model_name, name=field_name),
+        migrations.RenameField(model_name=model_name, old_name=minor_name, new_name=field_name),
+        migrations.AlterField(model_name=model_name, name=field_name, field=amount_field),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    #commit each chunk of the conversion separately so large tables aren't
+    #rewritten in a single database transaction
+    atomic = False
+
+    dependencies = [
+        ('bookkeeper', '0005_importedline'),
+    ]
+
+    operations = to_minor_units('accountentry', 'aeid', 'amount',
+        models.DecimalField(decimal_places=2, help_text='Debits: positive; Credits: negative.', max_digits=8),
+        swingtix.bookkeeper.fields.AmountField(help_text='Debits: positive; Credits: negative.'),
+    ) + to_minor_units('balancecheckpoint', 'id', 'balance',
+        models.DecimalField(decimal_places=2, help_text="The sum of the entries' amounts, as stored in the database.", max_digits=20),
+        swingtix.bookkeeper.fields.AmountField(help_text="The sum of the entries' amounts, as stored in the database."),
+    )
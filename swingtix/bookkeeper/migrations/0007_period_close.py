@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import swingtix.bookkeeper.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookkeeper', '0006_amounts_in_minor_units'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookset',
+            name='closed_until',
+            field=models.DateTimeField(blank=True, help_text='Nothing can be posted before this time; see close_period().', null=True),
+        ),
+        migrations.CreateModel(
+            name='PeriodClose',
+            fields=[
+                ('id', models.AutoField(serialize=False, primary_key=True)),
+                ('end', models.DateTimeField(help_text='The books were closed until this time.')),
+                ('archived', models.BooleanField(default=False, help_text="The transactions before 'end' were moved to the archive tables.")),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bookset', models.ForeignKey(related_name='period_closes', to='bookkeeper.BookSet')),
+                ('opening_transactions', models.ManyToManyField(blank=True, related_name='period_closes', to='bookkeeper.Transaction')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('tid', models.IntegerField(serialize=False, primary_key=True)),
+                ('t_stamp', models.DateTimeField()),
+                ('description', models.TextField()),
+                ('project', models.ForeignKey(null=True, related_name='archived_transactions', to='bookkeeper.Project')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedAccountEntry',
+            fields=[
+                ('aeid', models.IntegerField(serialize=False, primary_key=True)),
+                ('t_stamp', models.DateTimeField()),
+                ('amount', swingtix.bookkeeper.fields.AmountField(help_text='Debits: positive; Credits: negative.')),
+                ('description', models.TextField()),
+                ('account', models.ForeignKey(db_column='accid', related_name='archived_entries', to='bookkeeper.Account')),
+                ('third_party', models.ForeignKey(null=True, related_name='archived_entries', to='bookkeeper.ThirdParty')),
+                ('transaction', models.ForeignKey(db_column='tid', related_name='entries', to='bookkeeper.ArchivedTransaction')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedaccountentry',
+            index_together=set([('account', 't_stamp', 'transaction')]),
+        ),
+        migrations.AlterField(
+            model_name='importedline',
+            name='transaction',
+            field=models.ForeignKey(null=True, related_name='imported_lines', to='bookkeeper.Transaction'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookkeeper', '0007_period_close'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountentry',
+            name='reconciled_at',
+            field=models.DateTimeField(blank=True, help_text='When this entry was matched to a statement line; see swingtix.bookkeeper.reconcile.', null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedaccountentry',
+            name='reconciled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookkeeper', '0008_accountentry_reconciled_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IntegrityMark',
+            fields=[
+                ('id', models.AutoField(serialize=False, primary_key=True)),
+                ('name', models.CharField(help_text='Separate marks let independent checks keep their own progress.', max_length=40, unique=True)),
+                ('checked_through', models.IntegerField(default=0)),
+                ('reported', models.TextField(blank=True, default='', help_text='The ids of the transactions in the overlap already reported, separated by spaces.')),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
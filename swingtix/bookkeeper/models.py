@@ -2,8 +2,13 @@ from __future__ import unicode_literals
 from future.utils import python_2_unicode_compatible
 from builtins import object
 from django.utils import timezone
-from django.db import models
-from .account_api import AccountBase, BookSetBase, ProjectBase
+from datetime import timedelta
+from django.db import models, transaction
+from django.db.models import F, Sum
+from .account_api import AccountBase, BookSetBase, ProjectBase, _bulk_post, _check_open, _chunked, _entries_posted, _minor_units
+from .cache import entries_written
+from .fields import AmountField, from_minor_units
+from .instrumentation import instrumented
 
 
 class _AccountApi(AccountBase):
@@ -18,8 +23,8 @@ class BookSet(models.Model, BookSetBase):
     might have one BookSet for each country a corportation operates in; or, a
     single row for a small company.
 
-    Limitations: only single currencies are supported and balances are only
-    recorded to 2 decimal places.
+    Limitations: only single currencies are supported and amounts are only
+    recorded to 2 decimal places (as whole cents; see fields.AmountField).
 
     Future: the prefered timezone (for reporting and reconcilliation)
     """
@@ -27,13 +32,128 @@ class BookSet(models.Model, BookSetBase):
     id = models.AutoField(primary_key=True)
     description = models.CharField(max_length=80)
 
+    closed_until = models.DateTimeField(null=True, blank=True,
+        help_text="""Nothing can be posted before this time; see close_period().""")
+
+    #the name of the account created to balance opening-balance transactions
+    OPENING_BALANCES_ACCOUNT = "opening balances"
+
+    #how many transactions are moved to the archive tables at a time
+    ARCHIVE_CHUNK_SIZE = 1000
+
     def accounts(self):
         #sorting?
         return self.account_objects.all()
 
+    def _bookset_id(self):
+        return self.pk
+
+    def _closed_until(self):
+        #read from the database: this instance may be older than the latest close
+        return BookSet.objects.filter(pk=self.pk).values_list('closed_until', flat=True).first()
+
+    @instrumented('get_account')
     def get_account(self, name):
         return self.account_objects.get(name=name)
 
+    def _entries(self):
+        return AccountEntry.objects.filter(account__bookset=self)
+
+    @transaction.atomic
+    def checkpoint_balances(self, as_of):
+        """Record a balance checkpoint as of 'as_of' for every account in this
+        bookset, replacing any existing checkpoints at that time.  See
+        BalanceCheckpoint."""
+
+        _lock_accounts(Account.objects.filter(bookset=self))
+        BalanceCheckpoint.objects.filter(account__bookset=self, as_of=as_of).delete()
+
+        sums = AccountEntry.objects.filter(account__bookset=self,
+            t_stamp__lt=as_of).values('account').annotate(b=Sum('amount'))
+        BalanceCheckpoint.objects.bulk_create([
+            BalanceCheckpoint(account_id=row['account'], as_of=as_of, balance=row['b'])
+            for row in sums])
+
+    @transaction.atomic
+    def close_period(self, end, archive=False, clearing_account=None):
+        """ Closes the books until 'end': entries dated before it can't be
+        posted any more (PeriodClosedError is raised instead.)  Balances are
+        checkpointed at 'end'.  Returns the new PeriodClose.
+
+        With archive=True, the transactions before 'end' (and their entries)
+        are also moved to the ArchivedTransaction and ArchivedAccountEntry
+        tables.  In their place, each account gets an opening-balance
+        transaction dated just before 'end' for each of its third parties and
+        projects with a non-zero balance, against 'clearing_account' (by
+        default, an account named OPENING_BALANCES_ACCOUNT, created if
+        needed).  Balances, totals and ledgers from 'end' onward are
+        unchanged, but the history before it is only in the archive.
+        """
+
+        book = BookSet.objects.select_for_update().get(pk=self.pk)
+        if book.closed_until is not None and end < book.closed_until:
+            raise ValueError("{0} is already closed until {1}".format(self, book.closed_until))
+
+        self.closed_until = end
+        BookSet.objects.filter(pk=self.pk).update(closed_until=end)
+        close = PeriodClose.objects.create(bookset=self, end=end, archived=archive)
+
+        if archive:
+            if clearing_account is None:
+                clearing_account, _created = self.account_objects.get_or_create(
+                    name=self.OPENING_BALANCES_ACCOUNT, defaults={'positive_credit': True,
+                    'description': "Balances the opening-balance transactions made by closing periods."})
+            self._archive_until(close, clearing_account)
+
+        self.checkpoint_balances(end)
+        return close
+
+    def _archive_until(self, close, clearing_account):
+        """ Moves the transactions before close.end to the archive tables,
+        replacing them with opening-balance transactions. """
+
+        entries = AccountEntry.objects.filter(account__bookset=self, t_stamp__lt=close.end)
+        balances = list(entries.values_list('account', 'third_party', 'transaction__project').annotate(
+            b=Sum(_minor_units())).order_by())
+
+        tids = Transaction.objects.filter(entries__account__bookset=self, t_stamp__lt=close.end
+            ).values_list('tid', flat=True).distinct().order_by('tid')
+        for chunk in _chunked(tids.iterator(), self.ARCHIVE_CHUNK_SIZE):
+            ArchivedTransaction.objects.bulk_create(ArchivedTransaction(**row) for row in
+                Transaction.objects.filter(tid__in=chunk).values('tid', 't_stamp', 'description', 'project_id'))
+            ArchivedAccountEntry.objects.bulk_create(ArchivedAccountEntry(**row) for row in
+                AccountEntry.objects.filter(transaction_id__in=chunk).values('aeid', 'transaction_id',
+                    't_stamp', 'account_id', 'amount', 'description', 'third_party_id', 'reconciled_at'))
+
+            ImportedLine.objects.filter(transaction_id__in=chunk).update(transaction=None)
+            AccountEntry.objects.filter(transaction_id__in=chunk).delete()
+            Transaction.objects.filter(tid__in=chunk).delete()
+
+        #(in_bulk() needs a list of ids before django 1.10)
+        accounts = dict((a.pk, a) for a in self.account_objects.all())
+        third_parties = dict((t.pk, t) for t in ThirdParty.objects.filter(account__bookset=self))
+        projects = dict((p.pk, p) for p in self.projects.all())
+
+        def postings():
+            for account_id, third_party_id, project_id, b in balances:
+                if b == 0 or account_id == clearing_account.pk:
+                    #the clearing account's balance comes back with the other accounts'
+                    continue
+                book = projects[project_id] if project_id else self
+                account = book._leg_account(accounts[account_id],
+                    third_parties[third_party_id] if third_party_id else None)
+                clearing = book._leg_account(clearing_account, None)
+                yield "opening balance", close.end - timedelta(microseconds=1), (
+                    (account, from_minor_units(b), ""), (clearing, -from_minor_units(b), ""))
+
+        created = _bulk_post(postings(), check_open=False)
+        close.opening_transactions.add(*[entries[0].transaction for entries in created])
+
+        #accounts whose balance went to zero lost entries too
+        entries_written(set(accounts))
+        self.account_objects.update(version=F('version') + 1)
+        BalanceCheckpoint.objects.filter(account__bookset=self, as_of__lt=close.end).delete()
+
     def __str__(self):
         return self.description
 
@@ -63,6 +183,9 @@ class Project(models.Model, ProjectBase):
     def get_bookset(self):
         return self.bookset
 
+    def _bookset_id(self):
+        return self.bookset_id
+
     def _associate_transaction(self, tx):
         tx.project = self
 
@@ -99,6 +222,12 @@ class Account(models.Model, _AccountApi):
     def get_bookset(self):
         return self.bookset
 
+    def _bookset_id(self):
+        return self.bookset_id
+
+    def _account_id(self):
+        return self.pk
+
     positive_credit = models.BooleanField(
         """credit entries increase the value of this account.  Set to False for
         Asset & Expense accounts, True for Liability, Revenue and Equity accounts.""",
@@ -107,6 +236,11 @@ class Account(models.Model, _AccountApi):
     name = models.TextField()  # slugish?  Unique?
     description = models.TextField(blank=True)
 
+    version = models.BigIntegerField(default=0,
+        help_text="""Incremented, in the same database transaction, whenever
+        entries are posted to this account.  Used to keep shared caches
+        coherent.""")
+
     class Meta(object):
         unique_together = ('bookset', 'name')
 
@@ -115,6 +249,7 @@ class Account(models.Model, _AccountApi):
         ae = AccountEntry()
         ae.account = self
         ae.transaction = tx
+        ae.t_stamp = tx.t_stamp
         ae.amount = amount
         ae.description = memo
         return ae
@@ -125,16 +260,98 @@ class Account(models.Model, _AccountApi):
     def _positive_credit(self):
         return self.positive_credit
 
+    def _checkpoints(self):
+        return self.checkpoints.all()
+
+    def _balance_checkpoints(self):
+        return self.checkpoints.all()
+
+    def _cache_key(self):
+        return (self.pk,)
+
+    def _versions(self):
+        return Account.objects.filter(pk=self.pk)
+
+    def third_party_balances(self, as_of=None, project=None):
+        """Returns the balances of all of this account's third parties, as of
+        'as_of' (datetime stamp) or now(), using one query.
+
+        If 'project' is given, only that project's entries are counted.
+        The result is a dict of third party id -> balance, the same as
+        calling balance() on each third party's sub-account.  Third parties
+        without any entries are left out.
+        """
+
+        qs = self.entries.filter(third_party__isnull=False)
+        if project:
+            qs = project._filter_project_qs(qs)
+        if as_of:
+            qs = qs.filter(t_stamp__lt=as_of)
+        sums = qs.values_list('third_party').annotate(b=Sum('amount')).order_by()
+
+        return dict((tp, self._normalize_balance(b)) for tp, b in sums)
+
+    @transaction.atomic
+    def checkpoint(self, as_of):
+        """Record a balance checkpoint for this account as of 'as_of'.  See BalanceCheckpoint."""
+        _lock_accounts(Account.objects.filter(pk=self.pk))
+        b = self._db_balance(as_of)
+        self.checkpoints.update_or_create(as_of=as_of, defaults={'balance': b})
+
     def __str__(self):
         return '{0} {1}'.format(self.bookset.description, self.name)
 
 
+def _lock_accounts(accounts):
+    "Locks the rows of the Account queryset 'accounts' until the end of the database transaction."
+    list(accounts.select_for_update().order_by('pk').values_list('pk', flat=True))
+
+
+@python_2_unicode_compatible
+class BalanceCheckpoint(models.Model):
+    """The sum of all of an account's entries before a point in time.
+
+    Account.balance() starts from the closest checkpoint and only sums the
+    entries after it, instead of the account's whole history.  Checkpoints are
+    typically recorded on period boundaries, either with
+    BookSet.checkpoint_balances() or the "bookkeeper_checkpoint" management
+    command.
+
+    Posting an entry before a checkpoint's 'as_of' deletes that checkpoint.
+    (Entries created without the account API don't, so delete the affected
+    checkpoints when doing so.)
+
+    A post locks its accounts' rows, by incrementing their versions, before
+    deleting checkpoints, and holds the locks until it commits.  Making
+    checkpoints locks the same rows first (select_for_update), so a
+    checkpoint either includes a concurrent backdated post or is deleted by
+    it, never neither.
+    """
+
+    id = models.AutoField(primary_key=True)
+
+    account = models.ForeignKey(Account, related_name='checkpoints')
+
+    as_of = models.DateTimeField(
+        help_text="""Entries strictly before this time are included in the balance.""")
+
+    balance = AmountField(
+        help_text="""The sum of the entries' amounts, as stored in the database.""")
+
+    class Meta(object):
+        unique_together = (('account', 'as_of'),)
+
+    def __str__(self):
+        return '<BalanceCheckpoint {0} {1} {2}>'.format(self.account_id, self.as_of, self.balance)
+
+
 @python_2_unicode_compatible
 class ThirdParty(models.Model):
     """Represents a third party (eg. Account Receivable or Account Payable).
 
-    (Question: using only the ORM, how do I get a third party's balance?
-    account.entries.filter(third_party=self).sum()? )
+    A third party's balance is get_third_party(third_party).balance(); the
+    balances of all of an account's third parties can be had at once with
+    Account.third_party_balances().
 
     Each third party is associated with a bookkeeping account (traditionally
     either the AR or AP account).  A third party's account can be accessed by
@@ -198,6 +415,8 @@ class Transaction(models.Model):
         (This invarient may be enforced in the future.)
 
         2. All entries must be between accounts of the same BookSet.
+
+    swingtix.bookkeeper.verify finds the transactions breaking either one.
     """
 
     tid = models.AutoField(primary_key=True)
@@ -208,10 +427,59 @@ class Transaction(models.Model):
     project = models.ForeignKey(Project, related_name="transactions",
         help_text="""The project for this transaction (if any).""", null=True)
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super(Transaction, self).save(*args, **kwargs)
+            return
+
+        with transaction.atomic():
+            #keep the entries' copy of t_stamp up to date.  Moving entries
+            #changes their accounts' balances from the earlier of the two
+            #times on, like posting them there; neither may be in a closed
+            #period.
+            moved = list(self.entries.exclude(t_stamp=self.t_stamp).select_related('account'))
+            closed = {}
+            for ae in moved:
+                _check_open(closed, ae.account, ae.t_stamp)
+                _check_open(closed, ae.account, self.t_stamp)
+
+            super(Transaction, self).save(*args, **kwargs)
+            if moved:
+                self.entries.filter(pk__in=[ae.pk for ae in moved]).update(t_stamp=self.t_stamp)
+                _entries_posted([(ae.account, ae, min(ae.t_stamp, self.t_stamp)) for ae in moved])
+
     def __str__(self):
         return "<Transaction {0}: {1}/>".format(self.tid, self.description)
 
 
+@python_2_unicode_compatible
+class ImportedLine(models.Model):
+    """A statement line that has been imported into an account; see
+    swingtix.bookkeeper.importer.
+
+    'digest' identifies the line by its date, amount and reference, so
+    importing the same statement twice doesn't post it twice.  Deleting the
+    transaction deletes this row too, allowing the line to be imported again.
+    When the transaction is archived by BookSet.close_period(), 'transaction'
+    becomes None but the line stays imported.
+    """
+
+    id = models.AutoField(primary_key=True)
+
+    account = models.ForeignKey(Account, related_name='imported_lines')
+
+    digest = models.CharField(max_length=40,
+        help_text="""sha1 of the line's date, amount and reference.""")
+
+    transaction = models.ForeignKey(Transaction, related_name='imported_lines', null=True)
+
+    class Meta(object):
+        unique_together = (('account', 'digest'),)
+
+    def __str__(self):
+        return '<ImportedLine {0} {1}>'.format(self.account_id, self.digest)
+
+
 #questionable use of natural_keys?
 class AccountEntryManager(models.Manager):
     def get_by_natural_key(self, account, transaction):
@@ -235,6 +503,7 @@ class AccountEntry(models.Model):
 
     class Meta(object):
         unique_together= (('account', 'transaction'),)
+        index_together = (('account', 't_stamp', 'transaction'),)
 
     def natural_key(self):
         return (self.transaction.pk,) + self.account.natural_key()
@@ -245,9 +514,12 @@ class AccountEntry(models.Model):
 
     transaction = models.ForeignKey(Transaction, db_column='tid', related_name='entries')
 
+    t_stamp = models.DateTimeField(
+        help_text="""A copy of the transaction's t_stamp, so entries can be found by time without a join.""")
+
     account = models.ForeignKey(Account, db_column='accid', related_name='entries')
 
-    amount = models.DecimalField(max_digits=8, decimal_places=2,
+    amount = AmountField(
         help_text="""Debits: positive; Credits: negative.""")
 
     description = models.TextField(
@@ -255,7 +527,108 @@ class AccountEntry(models.Model):
 
     third_party = models.ForeignKey(ThirdParty, related_name='account_entries', null=True)
 
+    reconciled_at = models.DateTimeField(null=True, blank=True,
+        help_text="""When this entry was matched to a statement line; see swingtix.bookkeeper.reconcile.""")
+
+    def save(self, *args, **kwargs):
+        if self.t_stamp is None:
+            self.t_stamp = self.transaction.t_stamp
+        super(AccountEntry, self).save(*args, **kwargs)
+
     def __str__(self):
         base = "%d %s" % (self.amount, self.description)
 
         return base
+
+
+@python_2_unicode_compatible
+class PeriodClose(models.Model):
+    """A record of BookSet.close_period(): the books were closed until 'end'.
+
+    If the period's transactions were archived, 'opening_transactions' are
+    the opening-balance transactions that replaced them (until they're
+    archived in turn by a later close.)
+    """
+
+    id = models.AutoField(primary_key=True)
+
+    bookset = models.ForeignKey(BookSet, related_name='period_closes')
+
+    end = models.DateTimeField(help_text="""The books were closed until this time.""")
+
+    archived = models.BooleanField(default=False,
+        help_text="""The transactions before 'end' were moved to the archive tables.""")
+
+    created = models.DateTimeField(default=timezone.now)
+
+    opening_transactions = models.ManyToManyField(Transaction, related_name='period_closes', blank=True)
+
+    def __str__(self):
+        return '<PeriodClose {0} until {1}>'.format(self.bookset_id, self.end)
+
+
+@python_2_unicode_compatible
+class ArchivedTransaction(models.Model):
+    """A Transaction moved out of the transaction table by
+    BookSet.close_period(archive=True), keeping its id."""
+
+    tid = models.IntegerField(primary_key=True)
+
+    t_stamp = models.DateTimeField()
+    description = models.TextField()
+
+    project = models.ForeignKey(Project, related_name="archived_transactions", null=True)
+
+    def __str__(self):
+        return "<ArchivedTransaction {0}: {1}/>".format(self.tid, self.description)
+
+
+@python_2_unicode_compatible
+class ArchivedAccountEntry(models.Model):
+    """An AccountEntry moved out of the entry table by
+    BookSet.close_period(archive=True), keeping its id.  An account's
+    archived entries are account.archived_entries.
+    """
+
+    class Meta(object):
+        index_together = (('account', 't_stamp', 'transaction'),)
+
+    aeid = models.IntegerField(primary_key=True)
+
+    transaction = models.ForeignKey(ArchivedTransaction, db_column='tid', related_name='entries')
+
+    t_stamp = models.DateTimeField()
+
+    account = models.ForeignKey(Account, db_column='accid', related_name='archived_entries')
+
+    amount = AmountField(help_text="""Debits: positive; Credits: negative.""")
+
+    description = models.TextField()
+
+    third_party = models.ForeignKey(ThirdParty, related_name='archived_entries', null=True)
+
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "%d %s" % (self.amount, self.description)
+
+
+@python_2_unicode_compatible
+class IntegrityMark(models.Model):
+    """How far swingtix.bookkeeper.verify.verify_incremental() has checked
+    the transactions: every tid up to 'checked_through' was verified."""
+
+    id = models.AutoField(primary_key=True)
+
+    name = models.CharField(max_length=40, unique=True,
+        help_text="""Separate marks let independent checks keep their own progress.""")
+
+    checked_through = models.IntegerField(default=0)
+
+    reported = models.TextField(blank=True, default="",
+        help_text="""The ids of the transactions in the overlap already reported, separated by spaces.""")
+
+    updated = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '<IntegrityMark {0} {1}>'.format(self.name, self.checked_through)
@@ -0,0 +1,190 @@
+"""
+
+Reconciles statements (from a bank or payment processor) against an account.
+
+    result = reconcile(bank, read_csv(f), tolerance=timedelta(days=3))
+    for line in result.unmatched:
+        ...
+
+Each StatementLine (see swingtix.bookkeeper.importer) is matched to at most
+one of the account's unreconciled entries with the same amount.  Positive
+amounts increase the account's balance, as when importing.
+
+  * exact matches have the same date, and an entry memo equal to the line's
+    reference.  They're found with a dict keyed on (amount, date, reference).
+  * the other lines are matched to the entry with the same amount closest in
+    time to the line's date, within 'tolerance'.  Each amount's entries are
+    sorted by time and searched with bisect, skipping the ones already taken
+    (see _Candidates), so matching n lines takes O(n log n).
+
+Both passes take the lines in date order (then in the order given), and the
+entries in time order when there's a tie.  Matched entries get their
+reconciled_at set, so later runs only consider what's left.
+
+"""
+
+from __future__ import unicode_literals
+from builtins import object, range
+from bisect import bisect_left
+from collections import defaultdict, deque, namedtuple
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .account_api import _chunked, _filter_range, _minor_units
+from .fields import to_minor_units
+
+#how many entries are marked reconciled per UPDATE
+UPDATE_CHUNK_SIZE = 500
+
+#A statement line and the id of the entry it was matched to; 'exact' is true
+#for a match on (amount, date, reference).
+Match = namedtuple('Match', ['line', 'entry_id', 'exact'])
+
+#The outcome of reconcile(): the Match'es, the lines that weren't matched,
+#and the ids of the unreconciled entries in the window that weren't either.
+ReconcileResult = namedtuple('ReconcileResult', ['matches', 'unmatched', 'unmatched_entries'])
+
+
+def _as_datetime(d):
+    "A line's date as a datetime (midnight, for dates), timezone-aware when USE_TZ is on."
+    if not isinstance(d, datetime):
+        d = datetime(d.year, d.month, d.day)
+    if timezone.is_naive(d) and timezone.is_aware(timezone.now()):
+        d = timezone.make_aware(d)
+    return d
+
+
+def _local_date(t):
+    if timezone.is_aware(t):
+        t = timezone.localtime(t)
+    return t.date()
+
+
+def _find(parent, i):
+    "The root of i in the union-find forest 'parent', compressing the path."
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+class _Candidates(object):
+    """ The entries with one amount, sorted by time, for the fuzzy pass.
+
+    Taken entries stay in the lists; two union-find forests point past them
+    to the closest entry still available on either side, so finding and
+    taking one costs O(log n) (the bisect) plus a near-constant skip.
+    """
+
+    def __init__(self, times, ids):
+        self.times = times
+        self.ids = ids
+        #_right[k]: the first available entry at or after k (n: none)
+        #_left[k]: one more than the last available entry before k (0: none)
+        self._right = list(range(len(times) + 1))
+        self._left = list(range(len(times) + 1))
+
+    def take_closest(self, t, tolerance):
+        "Removes and returns the id of the entry closest to 't', within 'tolerance', or None."
+        n = len(self.times)
+        j = bisect_left(self.times, t)
+        best = None
+        for k in (_find(self._left, j) - 1, _find(self._right, j)):
+            if 0 <= k < n:
+                distance = abs(self.times[k] - t)
+                if distance <= tolerance and (best is None or distance < best[0]):
+                    best = (distance, k)
+        if best is None:
+            return None
+
+        k = best[1]
+        self._right[k] = k + 1
+        self._left[k + 1] = k
+        return self.ids[k]
+
+
+def reconcile(account, lines, start=None, end=None, tolerance=timedelta(days=3), dry_run=False):
+    """ Matches 'lines' (StatementLine's) to the unreconciled entries of
+    'account' from 'start' (inclusive) to 'end' (exclusive), and marks the
+    matched entries reconciled.  Returns a ReconcileResult.
+
+    The window defaults to the lines' dates, widened by 'tolerance' (and a day
+    at the end, for entries on the last line's date.)  The entries are read
+    with one query and marked with one UPDATE per UPDATE_CHUNK_SIZE matches;
+    with dry_run=True, nothing is written.
+    """
+
+    lines = list(lines)
+    if not lines:
+        return ReconcileResult([], [], [])
+
+    times = [_as_datetime(line.date) for line in lines]
+    amounts = [to_minor_units(line.amount) for line in lines]
+    if start is None:
+        start = min(times) - tolerance
+    if end is None:
+        end = max(times) + tolerance + timedelta(days=1)
+
+    sign = account._DEBIT_IN_DB()
+    if account._positive_credit():
+        sign *= -1
+
+    qs = _filter_range(account._entries().filter(reconciled_at__isnull=True), start, end)
+    rows = list(qs.annotate(minor_amount=_minor_units()).values_list(
+        'pk', 't_stamp', 'minor_amount', 'description').order_by('t_stamp', 'pk'))
+
+    matched = {}
+    in_date_order = sorted(range(len(lines)), key=times.__getitem__)
+
+    #exact matches
+    exact = defaultdict(deque)
+    for pk, t_stamp, amount, memo in rows:
+        exact[(amount * sign, _local_date(t_stamp), memo)].append(pk)
+
+    for i in in_date_order:
+        candidates = exact.get((amounts[i], _local_date(times[i]), lines[i].reference))
+        if candidates:
+            matched[i] = Match(lines[i], candidates.popleft(), True)
+
+    #the closest in time, with the same amount
+    taken = set(m.entry_id for m in matched.values())
+    by_amount = defaultdict(lambda: ([], []))
+    for pk, t_stamp, amount, memo in rows:
+        if pk not in taken:
+            entry_times, entry_ids = by_amount[amount * sign]
+            entry_times.append(t_stamp)
+            entry_ids.append(pk)
+    by_amount = dict((amount, _Candidates(entry_times, entry_ids))
+        for amount, (entry_times, entry_ids) in by_amount.items())
+
+    for i in in_date_order:
+        if i in matched or amounts[i] not in by_amount:
+            continue
+        entry_id = by_amount[amounts[i]].take_closest(times[i], tolerance)
+        if entry_id is not None:
+            matched[i] = Match(lines[i], entry_id, False)
+
+    matches = [matched[i] for i in sorted(matched)]
+    if not dry_run and matches:
+        now = timezone.now()
+        with transaction.atomic():
+            for chunk in _chunked((m.entry_id for m in matches), UPDATE_CHUNK_SIZE):
+                account._entries().filter(pk__in=chunk, reconciled_at__isnull=True).update(reconciled_at=now)
+
+    taken = set(m.entry_id for m in matches)
+    return ReconcileResult(
+        matches,
+        [line for i, line in enumerate(lines) if i not in matched],
+        [row[0] for row in rows if row[0] not in taken])
+
+
+def unreconcile(account, start=None, end=None):
+    """ Marks the entries of 'account' from 'start' to 'end' unreconciled
+    again, and returns how many there were. """
+
+    qs = _filter_range(account._entries().filter(reconciled_at__isnull=False), start, end)
+    return qs.update(reconciled_at=None)
@@ -0,0 +1,79 @@
+"""
+
+Reports computed in the database, for accounts with many third parties.
+
+  * aging_report -- accounts receivable/payable aging
+
+"""
+
+from __future__ import unicode_literals
+from builtins import range
+from collections import namedtuple
+from datetime import timedelta
+from django.db.models import BigIntegerField, Case, Sum, Value, When
+from .fields import from_minor_units
+
+#One third party's row of an aging report: its balance and how much of it is
+#in each age bucket, from newest to oldest.
+AgingRow = namedtuple('AgingRow', ['third_party_id', 'balance', 'buckets'])
+
+
+def aging_report(account, as_of, buckets=(30, 60, 90)):
+    """ Returns the aging of every third party's balance on 'account' (typically
+    an AR or AP account) as of 'as_of', as a list of AgingRow's ordered by third
+    party id.  Third parties with a zero balance are left out.
+
+    'buckets' are the ages, in days, where each bucket ends.  The default
+    gives four buckets: under 30 days old, 30 to 59, 60 to 89, and 90 days
+    or older.  Entries that increase the balance (eg. invoices) are put in
+    the bucket for their age; entries that decrease it (eg. payments) are
+    applied to the oldest amounts first.  If a third party has paid more than
+    it owes, the credit shows as a negative amount in the newest bucket.
+
+    Pass a project's account (eg. project.get_account("ar")) to age only
+    that project's entries.  Everything is summed with one query.
+    """
+
+    buckets = sorted(buckets)
+    cutoffs = [as_of - timedelta(days=days) for days in buckets]
+
+    sign = account._DEBIT_IN_DB()
+    if account._positive_credit():
+        sign *= -1
+    increase = {'amount__gt': 0} if sign > 0 else {'amount__lt': 0}
+    decrease = {'amount__lt': 0} if sign > 0 else {'amount__gt': 0}
+
+    def sum_where(**conditions):
+        #summed as whole minor units, to do the FIFO arithmetic with integers
+        return Sum(Case(When(then='amount', **conditions), default=Value(0)), output_field=BigIntegerField())
+
+    aggregates = {'decreases': sum_where(**decrease)}
+    for i in range(len(cutoffs) + 1):
+        age = {}
+        if i < len(cutoffs):
+            age['t_stamp__gt'] = cutoffs[i]
+        if i > 0:
+            age['t_stamp__lte'] = cutoffs[i - 1]
+        age.update(increase)
+        aggregates['bucket{0}'.format(i)] = sum_where(**age)
+
+    qs = account._entries().filter(third_party__isnull=False, t_stamp__lt=as_of)
+    rows = qs.values('third_party').annotate(**aggregates).order_by('third_party')
+
+    report = []
+    for row in rows:
+        amounts = [(row['bucket{0}'.format(i)] or 0) * sign for i in range(len(cutoffs) + 1)]
+        unapplied = (row['decreases'] or 0) * -sign
+
+        for i in reversed(range(len(amounts))):
+            applied = min(amounts[i], unapplied)
+            amounts[i] -= applied
+            unapplied -= applied
+        amounts[0] -= unapplied
+
+        balance = sum(amounts)
+        if balance:
+            report.append(AgingRow(row['third_party'], from_minor_units(balance),
+                tuple(from_minor_units(a) for a in amounts)))
+
+    return report
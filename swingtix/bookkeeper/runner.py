@@ -0,0 +1,108 @@
+"""
+
+Runs reports for many booksets in parallel, using a pool of processes.
+
+    for result in run_reports(BookSet.objects.values_list('id', flat=True), processes=8):
+        if result.error:
+            log.error("bookset %s failed: %s", result.bookset_id, result.error)
+        else:
+            write(result.report)
+
+Each worker process opens its own database connection.  Results are
+yielded in the calling process as they're finished, so a single writer can
+consume them; a report that raises doesn't stop the others, its
+ReportResult has the traceback instead.  The "bookkeeper_reports"
+management command writes them as JSON lines.
+
+A report is a function taking a BookSet and keyword arguments and returning
+something picklable; it must be importable (ie. defined at the module level)
+so the workers can find it.  bookset_report() is the default.
+
+"""
+
+from __future__ import unicode_literals
+from collections import namedtuple
+import multiprocessing
+import traceback
+
+import django
+from django.apps import apps
+from django.db import connections
+
+#The outcome of one bookset's report: 'report' is report()'s return value,
+#or None if it raised, in which case 'error' is the formatted traceback.
+ReportResult = namedtuple('ReportResult', ['bookset_id', 'report', 'error'])
+
+
+def bookset_report(bookset, start=None, end=None, ledgers=False):
+    """ The default report: the bookset's trial balance as of 'end', each
+    account's totals from 'start' to 'end', and optionally their ledgers.
+
+    Returns a dict keyed by account name. """
+
+    accounts = list(bookset.accounts())
+    report = {
+        'bookset': bookset.pk,
+        'description': bookset.description,
+        'trial_balance': dict((a.name, b) for a, b in bookset.trial_balance(end).items()),
+        'totals': dict((a.name, t._asdict()) for a, t in bookset.totals_for(accounts, start, end).items()),
+    }
+
+    if ledgers:
+        report['ledgers'] = dict((a.name, [{
+            'txid': le.txid,
+            'time': le.time,
+            'description': le.description,
+            'memo': le.memo,
+            'debit': le.debit,
+            'credit': le.credit,
+            'closing': le.closing,
+        } for le in a.iter_ledger(start, end, compact=True)]) for a in accounts)
+
+    return report
+
+
+def _init_worker():
+    #with the "spawn" start method, workers start from scratch
+    if not apps.ready:
+        django.setup()
+
+
+def _run_report(args):
+    report, bookset_id, kwargs = args
+    from .models import BookSet
+
+    try:
+        return ReportResult(bookset_id, report(BookSet.objects.get(pk=bookset_id), **kwargs), None)
+    except Exception:
+        return ReportResult(bookset_id, None, traceback.format_exc())
+
+
+def run_reports(bookset_ids, report=bookset_report, processes=None, **kwargs):
+    """ Runs report(bookset, **kwargs) for each of 'bookset_ids' and yields
+    a ReportResult for each, in the order they finish.
+
+    'processes' is the size of the process pool (default: the number of
+    CPUs).  With processes=0 the reports are run one after the other in this
+    process, which is handy for debugging.
+    """
+
+    tasks = ((report, bookset_id, kwargs) for bookset_id in bookset_ids)
+
+    if processes == 0:
+        for task in tasks:
+            yield _run_report(task)
+        return
+
+    #the workers are forked from this process: don't let them share its
+    #database connections.
+    connections.close_all()
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    try:
+        for result in pool.imap_unordered(_run_report, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,67 @@
+from __future__ import unicode_literals
+from builtins import object
+
+import unittest
+
+from django.test import TransactionTestCase
+
+from .account_api import AccountAsyncMixin
+from .models import BookSet, Account
+
+from decimal import Decimal
+from datetime import datetime
+
+try:
+    import asyncio
+except ImportError:  # pragma: no coverage
+    asyncio = None
+
+
+#account_api falls back to the same (future's) object without the asyncio API
+@unittest.skipIf(AccountAsyncMixin is object, "asyncio API needs python 3.6")
+class AsyncApiTest(TransactionTestCase):
+    def setUp(self):
+        self.loop=asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.book=BookSet.objects.create(description="test book")
+        self.revenue=Account.objects.create(bookset=self.book, name="revenue", positive_credit=True)
+        self.bank=Account.objects.create(bookset=self.book, name="bank", positive_credit=False)
+        self.expense=Account.objects.create(bookset=self.book, name="expense", positive_credit=False)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def collect(self, aiterable):
+        l=[]
+        iterator=aiterable.__aiter__()
+        while True:
+            try:
+                l.append(self.run_async(iterator.__anext__()))
+            except StopAsyncIteration:
+                return l
+
+    def test_async_api(self):
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 1, 2, 1, 1, 0)
+
+        self.run_async(self.bank.apost(Decimal("12.00"), self.revenue, "ticket sale", datetime=d1))
+        self.run_async(self.bank.apost_batch([(Decimal("-2.00"), self.expense, "coffee", "", "", d2)]))
+        self.run_async(self.book.apost_many([(self.bank, Decimal("1.00"), self.revenue, "sale", "", "", d2)]))
+        self.run_async(self.book.apost_split("sale", [(self.bank, Decimal("1.00")), (self.revenue, Decimal("-1.00"))], datetime=d2))
+
+        balances=self.run_async(asyncio.gather(self.bank.abalance(), self.revenue.abalance(), self.expense.abalance(d2)))
+        self.assertEqual(balances, [Decimal("12.00"), Decimal("14.00"), Decimal("0.00")])
+
+        self.assertEqual(self.run_async(self.bank.atotals(d1, d2)), (0, Decimal("12.00"), Decimal("12.00")))
+        self.assertEqual(self.run_async(self.book.atotals_for([self.bank], d1, d2))[self.bank], self.bank.totals(d1, d2))
+        self.assertEqual(self.run_async(self.book.atrial_balance()), self.book.trial_balance())
+
+        ledger=self.collect(self.bank.aledger(page_size=2, with_counterparties=True))
+        self.assertEqual([(le.txid, le.closing) for le in ledger], [(le.txid, le.closing) for le in self.bank.ledger()])
+        self.assertEqual(ledger[0].other_entry(), self.revenue)
+        self.assertEqual(self.collect(self.bank.aledger(end=d1)), [])
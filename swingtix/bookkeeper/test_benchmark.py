@@ -0,0 +1,63 @@
+from __future__ import unicode_literals
+
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from .models import BookSet, Account, AccountEntry, ThirdParty, Project, Transaction
+from .benchmark import OPERATIONS, generate_bookset, run_benchmarks
+
+from datetime import datetime, timedelta
+import json
+
+
+class BenchmarkTest(TestCase):
+    def test_generate(self):
+        end=datetime(2010, 6, 1)
+        book=generate_bookset(accounts=4, third_parties=3, projects=2, transactions=50, days=30, end=end)
+
+        self.assertEqual(Account.objects.filter(bookset=book).count(), 4)
+        self.assertEqual(ThirdParty.objects.filter(account__bookset=book).count(), 3)
+        self.assertEqual(Project.objects.filter(bookset=book).count(), 2)
+        self.assertEqual(Transaction.objects.filter(entries__account__bookset=book).distinct().count(), 50)
+
+        entries=AccountEntry.objects.filter(account__bookset=book)
+        self.assertEqual(entries.aggregate(s=Sum('amount'))['s'], 0)
+        self.assertEqual(entries.count(), 100)
+        self.assertFalse(entries.filter(t_stamp__gte=end).exists())
+        self.assertFalse(entries.filter(t_stamp__lt=end - timedelta(days=31)).exists())
+        self.assertTrue(entries.filter(third_party__isnull=False).exists())
+        self.assertTrue(entries.filter(transaction__project__isnull=False).exists())
+
+        #the same seed gives the same books
+        other=generate_bookset(accounts=4, third_parties=3, projects=2, transactions=50, days=30, end=end)
+        self.assertEqual([b for b in book.trial_balance().values()], [b for b in other.trial_balance().values()])
+
+    def test_run(self):
+        book=generate_bookset(accounts=3, third_parties=2, projects=1, transactions=20)
+        results=run_benchmarks([book], repeat=2)
+
+        self.assertEqual(sorted(results['results']), sorted(OPERATIONS))
+        self.assertEqual(results['entries'], 40)
+        for r in results['results'].values():
+            self.assertEqual(r['calls'], 2)
+            self.assertTrue(r['min'] <= r['mean'] <= r['max'])
+        self.assertEqual(results['results']['balance']['queries'], 2)
+        self.assertEqual(results['results']['get_third_party']['queries'], 0)
+
+    def test_commands(self):
+        out=StringIO()
+        call_command('bookkeeper_benchmark', '--transactions=10', '--accounts=2', '--repeat=1', stdout=out)
+        results=json.loads(out.getvalue())
+        self.assertEqual(results['entries'], 20)
+        self.assertEqual(results['scale']['transactions'], 10)
+        #the generated books were rolled back
+        self.assertEqual(BookSet.objects.count(), 0)
+
+        call_command('bookkeeper_generate', '--transactions=10', '--booksets=2', stdout=StringIO())
+        self.assertEqual(BookSet.objects.count(), 2)
+
+        out=StringIO()
+        call_command('bookkeeper_benchmark', '--bookset=%d' % BookSet.objects.first().pk, '--repeat=1', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['entries'], 20)
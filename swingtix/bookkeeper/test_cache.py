@@ -0,0 +1,229 @@
+from __future__ import unicode_literals
+
+from django.core.cache import caches
+from django.core.cache.backends.base import CacheKeyWarning
+from django.db import transaction
+from django.db.models import F
+from django.test import TransactionTestCase, override_settings
+
+from .cache import BalanceCache, SharedBalanceCache, MISSING, set_balance_cache
+from .models import BookSet, Account, ThirdParty, Project, Transaction, AccountEntry
+
+from decimal import Decimal
+from datetime import datetime
+import shutil
+import tempfile
+import unittest
+import warnings
+
+
+class BalanceCacheTest(TransactionTestCase):
+    def setUp(self):
+        self.cache=BalanceCache(max_size=100)
+        self.previous=set_balance_cache(self.cache)
+
+        self.book=BookSet.objects.create(description="test book")
+        self.revenue=Account.objects.create(bookset=self.book, name="revenue", positive_credit=True)
+        self.bank=Account.objects.create(bookset=self.book, name="bank", positive_credit=False)
+        self.ar=Account.objects.create(bookset=self.book, name="ar", positive_credit=False)
+
+    def tearDown(self):
+        set_balance_cache(self.previous)
+
+    def test_lru(self):
+        cache=BalanceCache(max_size=2)
+        value, token=cache.get(((1,), 'balance', None))
+        self.assertIs(value, MISSING)
+        cache.set(((1,), 'balance', None), 1, token)
+        cache.set(((2,), 'balance', None), 2, token)
+        self.assertEqual(cache.get(((1,), 'balance', None))[0], 1)
+        cache.set(((3,), 'balance', None), 3, token)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get(((2,), 'balance', None))[0], MISSING)
+        self.assertEqual(cache.get(((3,), 'balance', None))[0], 3)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        #values computed before an invalidation aren't stored
+        value, token=cache.get(((1,), 'totals', None, None))
+        cache.invalidate(1)
+        cache.set(((1,), 'totals', None, None), 5, token)
+        self.assertIs(cache.get(((1,), 'totals', None, None))[0], MISSING)
+        self.assertIs(cache.get(((1,), 'balance', None))[0], MISSING)
+
+    def test_balance_caching(self):
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 1, 2, 1, 1, 0)
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=d1)
+
+        self.assertEqual(self.bank.balance(), Decimal("12.00"))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.bank.balance(), Decimal("12.00"))
+        self.assertEqual(self.bank.totals(d1, d2), (0, Decimal("12.00"), Decimal("12.00")))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.bank.totals(d1, d2), (0, Decimal("12.00"), Decimal("12.00")))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+        #posting drops only the accounts that were written to
+        self.assertEqual(self.ar.balance(), Decimal("0.00"))
+        self.bank.debit(Decimal("3.00"), self.revenue, "ticket sale", datetime=d2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ar.balance(), Decimal("0.00"))
+        self.assertEqual(self.bank.balance(), Decimal("15.00"))
+        self.assertEqual(self.revenue.balance(), Decimal("15.00"))
+        self.assertEqual(self.bank.totals(d1, d2), (0, Decimal("12.00"), Decimal("12.00")))
+
+        #so do the bulk paths
+        self.book.post_many([(self.bank, Decimal("1.00"), self.revenue, "sale")])
+        self.assertEqual(self.bank.balance(), Decimal("16.00"))
+        self.book.post_split("sale", [(self.bank, Decimal("1.00")), (self.revenue, Decimal("-1.00"))])
+        self.assertEqual(self.bank.balance(), Decimal("17.00"))
+
+    def test_sub_accounts(self):
+        project=Project.objects.create(name="project_jumbo", bookset=self.book)
+        joe=ThirdParty.objects.create(account=self.ar, name="Joe")
+
+        self.assertEqual(self.ar.balance(), Decimal("0.00"))
+        self.assertEqual(self.book.get_third_party(joe).balance(), Decimal("0.00"))
+        self.assertEqual(project.get_third_party(joe).balance(), Decimal("0.00"))
+        self.assertEqual(project.get_account("ar").balance(), Decimal("0.00"))
+
+        project.get_third_party(joe).debit(Decimal("5.00"), project.get_account("revenue"), "invoice")
+        self.assertEqual(self.ar.balance(), Decimal("5.00"))
+        self.assertEqual(self.book.get_third_party(joe).balance(), Decimal("5.00"))
+        self.assertEqual(project.get_third_party(joe).balance(), Decimal("5.00"))
+        self.assertEqual(project.get_account("ar").balance(), Decimal("5.00"))
+
+    def test_uncommitted_entries_are_not_cached(self):
+        self.assertEqual(self.bank.balance(), Decimal("0.00"))
+
+        try:
+            with transaction.atomic():
+                self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale")
+                self.assertEqual(self.bank.balance(), Decimal("12.00"))
+                self.assertEqual(self.bank.balance(), Decimal("12.00"))
+                raise RuntimeError("roll back")
+        except RuntimeError:
+            pass
+
+        self.assertEqual(self.bank.balance(), Decimal("0.00"))
+        with transaction.atomic():
+            self.bank.debit(Decimal("1.00"), self.revenue, "ticket sale")
+        self.assertEqual(self.bank.balance(), Decimal("1.00"))
+
+    @unittest.skipUnless(hasattr(transaction, 'on_commit'), "django 1.8 can't tell when a transaction commits")
+    def test_cached_again_after_commit(self):
+        #eg. with ATOMIC_REQUESTS, where every request is in a transaction
+        with transaction.atomic():
+            self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale")
+            with transaction.atomic():
+                self.revenue.balance()
+        with transaction.atomic():
+            self.assertEqual(self.bank.balance(), Decimal("12.00"))
+            with self.assertNumQueries(0):
+                self.assertEqual(self.bank.balance(), Decimal("12.00"))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        #and after a rollback
+        try:
+            with transaction.atomic():
+                self.bank.debit(Decimal("1.00"), self.revenue, "ticket sale")
+                raise RuntimeError("roll back")
+        except RuntimeError:
+            pass
+        with transaction.atomic():
+            self.assertEqual(self.bank.balance(), Decimal("12.00"))
+            self.assertEqual(self.bank.balance(), Decimal("12.00"))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+        #a rolled back savepoint forgets its writes (though the values they
+        #dropped stay dropped), but not the transaction's
+        with transaction.atomic():
+            self.revenue.credit(Decimal("1.00"), self.ar, "refund")
+            try:
+                with transaction.atomic():
+                    self.bank.debit(Decimal("1.00"), self.revenue, "ticket sale")
+                    raise RuntimeError("roll back")
+            except RuntimeError:
+                pass
+            self.assertEqual(self.bank.balance(), Decimal("12.00"))
+            self.assertEqual(self.revenue.balance(), Decimal("13.00"))
+            self.assertEqual(self.bank.balance(), Decimal("12.00"))
+            self.assertEqual(self.revenue.balance(), Decimal("13.00"))
+        self.assertEqual((self.cache.hits, self.cache.misses), (3, 3))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bookkeeper-test'}})
+class SharedBalanceCacheTest(TransactionTestCase):
+    def setUp(self):
+        self.cache=SharedBalanceCache()
+        self.previous=set_balance_cache(self.cache)
+
+        self.book=BookSet.objects.create(description="test book")
+        self.revenue=Account.objects.create(bookset=self.book, name="revenue", positive_credit=True)
+        self.bank=Account.objects.create(bookset=self.book, name="bank", positive_credit=False)
+
+    def tearDown(self):
+        set_balance_cache(self.previous)
+        caches['default'].clear()
+
+    def test_versions(self):
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 1, 2, 1, 1, 0)
+
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=d1)
+        self.assertEqual(Account.objects.get(pk=self.bank.pk).version, 1)
+        self.book.post_many([(self.bank, Decimal("1.00"), self.revenue, "sale", "", "", d1)] * 3)
+        self.assertEqual(Account.objects.get(pk=self.bank.pk).version, 2)
+        self.assertEqual(Account.objects.get(pk=self.revenue.pk).version, 2)
+
+        #a hit costs a primary key lookup instead of an aggregate
+        self.assertEqual(self.bank.balance(), Decimal("15.00"))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.bank.balance(), Decimal("15.00"))
+        self.assertEqual(self.bank.totals(d1, d2), (0, Decimal("15.00"), Decimal("15.00")))
+        self.assertEqual(self.bank.totals(d1, d2), (0, Decimal("15.00"), Decimal("15.00")))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_other_processes(self):
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale")
+        self.assertEqual(self.bank.balance(), Decimal("12.00"))
+
+        #another process posts: this process isn't told, but the version changes
+        with transaction.atomic():
+            tx=Transaction.objects.create(description="ticket sale")
+            AccountEntry.objects.create(transaction=tx, account=self.bank, amount=Decimal("1.00"))
+            AccountEntry.objects.create(transaction=tx, account=self.revenue, amount=Decimal("-1.00"))
+            Account.objects.filter(pk__in=[self.bank.pk, self.revenue.pk]).update(version=F('version') + 1)
+        self.assertEqual(self.bank.balance(), Decimal("13.00"))
+
+    def test_filebased(self):
+        location=tempfile.mkdtemp()
+        try:
+            with override_settings(CACHES={'default': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}):
+                self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale")
+                self.assertEqual(self.bank.balance(), Decimal("12.00"))
+                self.assertEqual(self.bank.balance(), Decimal("12.00"))
+                self.assertEqual(self.bank.totals(), (0, Decimal("12.00"), Decimal("12.00")))
+                self.assertEqual(self.bank.totals(), (0, Decimal("12.00"), Decimal("12.00")))
+                self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+        finally:
+            shutil.rmtree(location)
+
+    def test_sub_account_keys(self):
+        joe=ThirdParty.objects.create(account=self.bank, name="Joe")
+        project=Project.objects.create(name="jumbo", bookset=self.book)
+        joe_account=self.book.get_third_party(joe)
+        project_account=project.get_third_party(joe)
+        joe_account.debit(Decimal("5.00"), self.revenue, "ticket sale")
+
+        #memcached rejects keys with spaces or quotes; django warns about them
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            for account in (joe_account, project_account):
+                account.balance()
+                account.balance()
+        self.assertEqual(joe_account.balance(), Decimal("5.00"))
+        self.assertEqual(project_account.balance(), Decimal("0.00"))
+        self.assertEqual((self.cache.hits, self.cache.misses), (4, 2))
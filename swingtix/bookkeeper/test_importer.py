@@ -0,0 +1,117 @@
+from __future__ import unicode_literals
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import six
+
+from .models import BookSet, Account, ImportedLine
+from .importer import StatementLine, import_statement, read_csv
+
+from decimal import Decimal
+from datetime import datetime
+from io import StringIO
+import os
+import shutil
+import tempfile
+
+CSV = """Date,Amount,Details,Id
+2010-01-04,100.00,deposit,a1
+2010-01-05,-20.50,coffee,a2
+2010-01-05,-20.50,coffee,a3
+2010-01-06,"-1,000.00",rent,a4
+"""
+
+
+class ImporterTest(TestCase):
+    def setUp(self):
+        self.book = BookSet.objects.create(description="test book")
+        self.bank = Account.objects.create(bookset=self.book, name="bank", positive_credit=False)
+        self.card = Account.objects.create(bookset=self.book, name="card", positive_credit=True)
+        self.suspense = Account.objects.create(bookset=self.book, name="suspense", positive_credit=False)
+
+    def read(self, text=CSV):
+        return read_csv(StringIO(text), date="Date", amount="Amount", description="Details",
+            reference="Id", parse_amount=lambda a: Decimal(a.replace(",", "")))
+
+    def test_read_csv(self):
+        lines = list(self.read())
+        self.assertEqual(lines[0], StatementLine(datetime(2010, 1, 4), Decimal("100.00"), "deposit", "a1"))
+        self.assertEqual(lines[3].amount, Decimal("-1000.00"))
+
+    def test_import(self):
+        progress = []
+        result = import_statement(self.bank, self.suspense, self.read(), chunk_size=3, progress=progress.append)
+        self.assertEqual(result, (4, 4, 0))
+        self.assertEqual(progress, [(3, 3, 0), (4, 4, 0)])
+
+        self.assertEqual(self.bank.balance(), Decimal("-941.00"))
+        self.assertEqual(self.suspense.balance(), Decimal("941.00"))
+        self.assertEqual(ImportedLine.objects.filter(account=self.bank).count(), 4)
+
+        l = list(self.bank.ledger())
+        self.assertEqual([(le.description, le.memo, le.debit, le.credit) for le in l], [
+            ("deposit", "a1", Decimal("100.00"), None),
+            ("coffee", "a2", None, Decimal("20.50")),
+            ("coffee", "a3", None, Decimal("20.50")),
+            ("rent", "a4", None, Decimal("1000.00"))])
+        self.assertEqual(l[0].time, datetime(2010, 1, 4))
+
+        #an overlapping statement only posts the new lines
+        more = CSV + "2010-01-07,5.00,refund,a5\n"
+        result = import_statement(self.bank, self.suspense, self.read(more), chunk_size=3)
+        self.assertEqual(result, (5, 1, 4))
+        self.assertEqual(self.bank.balance(), Decimal("-936.00"))
+
+        #the same lines can go into another account
+        result = import_statement(self.card, self.suspense, self.read())
+        self.assertEqual(result, (4, 4, 0))
+        #positive amounts increase the card's balance
+        self.assertEqual(self.card.balance(), Decimal("-941.00"))
+
+    def test_duplicates_in_statement(self):
+        lines = [StatementLine(datetime(2010, 1, 4), Decimal("1"), "a", "x")] * 3
+        self.assertEqual(import_statement(self.bank, self.suspense, lines), (3, 1, 2))
+        self.assertEqual(self.bank.balance(), Decimal("1"))
+
+    def test_deleted_transaction(self):
+        import_statement(self.bank, self.suspense, self.read())
+        ImportedLine.objects.get(account=self.bank, transaction__description="rent").transaction.delete()
+
+        self.assertEqual(import_statement(self.bank, self.suspense, self.read()), (4, 1, 3))
+        self.assertEqual(self.bank.balance(), Decimal("-941.00"))
+
+    def test_dry_run(self):
+        import_statement(self.bank, self.suspense, list(self.read())[:2])
+        result = import_statement(self.bank, self.suspense, self.read(), dry_run=True)
+        self.assertEqual(result, (4, 2, 2))
+        self.assertEqual(self.bank.balance(), Decimal("79.50"))
+        self.assertEqual(ImportedLine.objects.count(), 2)
+
+        #duplicates in different chunks are counted like a real import would
+        repeated = CSV + CSV.split("\n", 1)[1]
+        self.assertEqual(import_statement(self.bank, self.suspense, self.read(repeated), chunk_size=3, dry_run=True),
+            (8, 2, 6))
+        self.assertEqual(import_statement(self.bank, self.suspense, self.read(repeated), chunk_size=3),
+            (8, 2, 6))
+
+    def test_command(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "statement.csv")
+            with open(path, "w") as f:
+                f.write("date;amount;description\n2010-01-04;100.00;deposit\n2010-01-05;-20.50;coffee\n")
+
+            args = [path, "--bookset=%d" % self.book.pk, "--account=bank", "--other-account=suspense",
+                "--delimiter=;", "--reference-column="]
+
+            out = six.StringIO()
+            call_command("bookkeeper_import", "--dry-run", *args, stdout=out)
+            self.assertIn("2 of 2 lines would be imported", out.getvalue())
+            self.assertEqual(self.bank.balance(), Decimal("0"))
+
+            out = six.StringIO()
+            call_command("bookkeeper_import", *args, stdout=out)
+            self.assertIn("2 lines read, 2 imported, 0 already imported", out.getvalue())
+            self.assertEqual(self.bank.balance(), Decimal("79.50"))
+        finally:
+            shutil.rmtree(tmp)
@@ -0,0 +1,142 @@
+from __future__ import unicode_literals
+
+from django.db import connection
+from django.test import TestCase
+
+from .models import BookSet, Account, ThirdParty
+from .instrumentation import HistogramSink, LoggingSink, Metric, get_metrics_sink, set_metrics_sink
+
+from collections import deque
+from decimal import Decimal
+from datetime import datetime
+import logging
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        self.book = BookSet.objects.create(description="test book")
+        self.revenue = Account.objects.create(bookset=self.book, name="revenue", positive_credit=True)
+        self.bank = Account.objects.create(bookset=self.book, name="bank", positive_credit=False)
+        self.joe = ThirdParty.objects.create(account=self.bank, name="Joe")
+
+        self.metrics = []
+        self.previous = set_metrics_sink(self.metrics.append)
+
+    def tearDown(self):
+        set_metrics_sink(self.previous)
+
+    def test_metrics(self):
+        d1 = datetime(2010, 1, 1)
+        self.bank.debit(Decimal("10.00"), self.revenue, "sale", datetime=d1)
+        self.bank.post_batch([(Decimal(i), self.revenue, "sale") for i in range(1, 4)])
+        self.book.get_account("bank").balance()
+        self.book.get_third_party(self.joe)
+        self.bank.totals()
+
+        self.assertEqual([(m.name, m.rows) for m in self.metrics], [
+            ("post", 2), ("post_batch", 6), ("get_account", None), ("balance", None),
+            ("get_third_party", None), ("totals", None)])
+        post, _, get_account, balance, get_third_party, totals = self.metrics
+        self.assertEqual((get_account.queries, balance.queries, get_third_party.queries, totals.queries),
+            (1, 2, 0, 1))
+        self.assertTrue(post.queries >= 4)
+        self.assertTrue(all(isinstance(m.seconds, float) and m.seconds >= 0 for m in self.metrics))
+
+    def test_ledger(self):
+        for i in range(1, 4):
+            self.bank.debit(Decimal(i), self.revenue, "sale", datetime=datetime(2010, 1, i))
+        del self.metrics[:]
+
+        ledger = self.bank.ledger(start=datetime(2010, 1, 2))
+        #nothing is sent until the ledger has been read, but the balance() call
+        #inside it was.
+        self.assertEqual([m.name for m in self.metrics], ["balance"])
+        entries = list(ledger)
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(self.metrics[1], Metric("ledger", self.metrics[1].seconds, 3, 2))
+
+        #an empty ledger is a list
+        del self.metrics[:]
+        self.assertEqual(self.bank.ledger(end=datetime(2009, 1, 1)), [])
+        self.assertEqual([(m.name, m.queries, m.rows) for m in self.metrics], [("ledger", 1, 0)])
+
+        #queries made by the caller while iterating aren't counted
+        del self.metrics[:]
+        for _ in self.bank.iter_ledger(page_size=2):
+            Account.objects.count()
+        self.assertEqual([(m.name, m.queries, m.rows) for m in self.metrics], [("iter_ledger", 2, 3)])
+
+        #stopping early still sends the metric
+        del self.metrics[:]
+        it = self.bank.iter_ledger(page_size=2)
+        next(it)
+        it.close()
+        self.assertEqual([(m.name, m.rows) for m in self.metrics], [("iter_ledger", 1)])
+
+    def test_full_query_log(self):
+        #queries are counted without the connection's query log, which only
+        #keeps the latest ones
+        self.bank.debit(Decimal("10.00"), self.revenue, "sale")
+        queries_log = connection.queries_log
+        connection.queries_log = deque(maxlen=1)
+        try:
+            self.bank.debit(Decimal("10.00"), self.revenue, "sale")
+        finally:
+            connection.queries_log = queries_log
+
+        self.assertTrue(self.metrics[0].queries >= 4)
+        self.assertEqual(self.metrics[1].queries, self.metrics[0].queries)
+
+    def test_errors(self):
+        with self.assertRaises(Account.DoesNotExist):
+            self.book.get_account("nope")
+        self.assertEqual([(m.name, m.queries, m.rows) for m in self.metrics], [("get_account", 1, None)])
+
+    def test_off(self):
+        set_metrics_sink(None)
+        self.assertEqual(get_metrics_sink(), None)
+        self.bank.debit(Decimal("10.00"), self.revenue, "sale")
+        self.assertEqual(list(self.bank.ledger())[0].debit, Decimal("10.00"))
+        self.assertEqual(self.metrics, [])
+
+    def test_histogram(self):
+        sink = HistogramSink(buckets=(0.5, 10))
+        set_metrics_sink(sink)
+        sink(Metric("x", 0.1, 1, None))
+        sink(Metric("x", 0.7, 3, 4))
+        sink(Metric("x", 20, 0, 1))
+        self.bank.balance()
+
+        summary = sink.summary()
+        self.assertEqual(summary["x"], {
+            'count': 3, 'seconds': 20.8, 'max_seconds': 20, 'queries': 4, 'max_queries': 3,
+            'rows': 5, 'histogram': [1, 1, 1]})
+        self.assertEqual(summary["balance"]["count"], 1)
+        self.assertEqual(summary["balance"]["queries"], 2)
+
+        sink.clear()
+        self.assertEqual(sink.summary(), {})
+
+    def test_logging(self):
+        handler = ListHandler()
+        logger = logging.getLogger("swingtix.bookkeeper.metrics")
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+        try:
+            set_metrics_sink(LoggingSink())
+            self.bank.balance()
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
+
+        self.assertEqual(len(handler.messages), 1)
+        self.assertRegexpMatches(handler.messages[0], r"^balance: \d+\.\d{6}s, 2 queries, None rows$")
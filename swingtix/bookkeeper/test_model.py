@@ -9,13 +9,26 @@ from __future__ import unicode_literals
 from builtins import str
 from builtins import range
 
-from django.db import IntegrityError
-from django.test import TestCase
+from django.core import signing
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
 
-from .models import BookSet, Account, ThirdParty, Project
+from .models import BookSet, Account, AccountEntry, ThirdParty, Project, BalanceCheckpoint
+from .account_api import Leg, LedgerEntry, LedgerRow, Posting
 
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, timedelta
+import pytz
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from collections import namedtuple
 AccountEntryTuple=namedtuple('AccountEntryTuple', 'time description memo debit credit opening closing txid')
@@ -560,3 +573,573 @@ class SimpleTest(TestCase):
     def test_duplicate_accounts(self):
         with self.assertRaises(IntegrityError):
             Account.objects.create(bookset=self.book, name="bank")  # already exists
+
+    def test_post_many(self):
+        project=Project.objects.create(name="project_jumbo", bookset=self.book)
+        party=ThirdParty.objects.create(account=self.ar, name="Joe")
+        ar_party=self.book.get_third_party(party)
+        bank_project=project.get_account("bank")
+        rev_project=project.get_account("revenue")
+
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 1, 1, 1, 1, 1)
+        entries=self.book.post_many([
+            (self.bank, Decimal("12.00"), self.revenue, "ticket sale", "", "", d1),
+            Posting(ar_party, Decimal("5.00"), self.revenue, "invoice", datetime=d2),
+            Posting(bank_project, Decimal("-1.50"), self.expense, "fee", "bank memo", "expense memo"),
+            Posting(rev_project, Decimal("-3.00"), self.bank, "project sale"),
+        ], chunk_size=3)
+
+        self.assertEqual(len(entries), 4)
+        self.assertEqual(entries[2][0].description, "bank memo")
+        self.assertEqual(entries[2][1].description, "expense memo")
+
+        self.assertEqual(self.bank.balance(), Decimal("13.50"))
+        self.assertEqual(self.revenue.balance(), Decimal("20.00"))
+        self.assertEqual(self.expense.balance(), Decimal("1.50"))
+        self.assertEqual(self.ar.balance(), Decimal("5.00"))
+        self.assertEqual(ar_party.balance(), Decimal("5.00"))
+        self.assertEqual(bank_project.balance(), Decimal("1.50"))
+        self.assertEqual(rev_project.balance(), Decimal("3.00"))
+        self.assertEqual(self.bank.balance(d2), Decimal("12.00"))
+
+        self.assertEqualLedgers(list(ar_party.ledger()), [
+            AccountEntryTuple(time=d2, debit=Decimal("5.00"), credit=None, opening=Decimal("0.00"), closing=Decimal("5.00"),
+                description="invoice", memo="", txid=None),
+        ])
+
+        #accounts of another bookset are rejected, and nothing is written
+        other_book=BookSet.objects.create(description="other book")
+        other_bank=Account.objects.create(bookset=other_book, name="bank", positive_credit=False)
+        with self.assertRaises(ValueError):
+            self.book.post_many([
+                (self.bank, Decimal("1.00"), self.revenue, "sale"),
+                (self.bank, Decimal("1.00"), other_bank, "transfer"),
+            ], chunk_size=1)
+        self.assertEqual(self.bank.balance(), Decimal("13.50"))
+        self.assertEqual(other_bank.balance(), Decimal("0.00"))
+
+    def test_post_batch(self):
+        postings=[(Decimal(i), self.revenue, "sale %d" % i) for i in range(1, 11)]
+
+        #at most one insert per transaction, plus a bulk insert for the entries,
+        #a version update and a checkpoint clean-up for each chunk (and a
+        #savepoint, and a look at the bookset's closed_until.)
+        with CaptureQueriesContext(connection) as queries:
+            entries=self.bank.post_batch(postings, chunk_size=5)
+        self.assertLessEqual(len(queries), 10 + 2*3 + 2 + 1)
+
+        self.assertEqual(len(entries), 10)
+        self.assertEqual(self.bank.balance(), Decimal("55.00"))
+        self.assertEqual(self.revenue.balance(), Decimal("55.00"))
+        self.assertEqual([le.description for le in self.bank.ledger()], ["sale %d" % i for i in range(1, 11)])
+
+    def test_post_split(self):
+        party=ThirdParty.objects.create(account=self.ar, name="Joe")
+        tax=Account.objects.create(bookset=self.book, name="tax", positive_credit=True)
+
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        entries=self.book.post_split("ticket sale", [
+            (self.ar, Decimal("23.00"), "", party),
+            Leg(self.expense, Decimal("0.90"), "processor fee"),
+            Leg(self.revenue, Decimal("-20.90")),
+            Leg(tax, Decimal("-3.00")),
+        ], datetime=d1)
+
+        self.assertEqual(len(entries), 4)
+        self.assertEqual(len(set(e.transaction_id for e in entries)), 1)
+        self.assertEqual(entries[1].description, "processor fee")
+        self.assertEqual(self.book.get_third_party(party).balance(), Decimal("23.00"))
+        self.assertEqual(self.expense.balance(), Decimal("0.90"))
+        self.assertEqual(self.revenue.balance(), Decimal("20.90"))
+        self.assertEqual(tax.balance(), Decimal("3.00"))
+
+        le=list(self.revenue.ledger())[0]
+        self.assertEqual(le.time, d1)
+        self.assertEqual(sorted(amount for amount, account in le.other_entries()),
+            [Decimal("-3.00"), Decimal("0.90"), Decimal("23.00")])
+
+        #unbalanced transactions are rejected before anything is written
+        with self.assertRaises(ValueError):
+            self.book.post_split("bad", [(self.bank, Decimal("1.00")), (self.revenue, Decimal("-0.99"))])
+        with self.assertRaises(ValueError):
+            self.book.post_split("bad", [(self.bank, Decimal("0.00"))])
+        #the amounts are checked as they'll be stored, in whole cents
+        with self.assertRaises(ValueError):
+            self.book.post_split("bad", [(self.bank, Decimal("0.004")), (self.revenue, Decimal("0.004")),
+                (self.expense, Decimal("-0.008"))])
+        #one leg per account, in this bookset
+        with self.assertRaises(ValueError):
+            self.book.post_split("bad", [(self.bank, Decimal("1.00")), (self.revenue, Decimal("-0.50")),
+                (self.bank, Decimal("-0.50"))])
+        with self.assertRaises(ValueError):
+            self.book.post_split("bad", [(self.ar, Decimal("1.00"), "", party), (self.ar, Decimal("-1.00"))])
+        other_book=BookSet.objects.create(description="other book")
+        other_bank=Account.objects.create(bookset=other_book, name="bank", positive_credit=False)
+        with self.assertRaises(ValueError):
+            self.book.post_split("bad", [(self.bank, Decimal("1.00")), (other_bank, Decimal("-1.00"))])
+        self.assertEqual(self.bank.balance(), Decimal("0.00"))
+        self.assertEqual(AccountEntry.objects.count(), 4)
+
+        #sub-cent amounts are rounded like the stored amounts
+        entries=self.book.post_split("rounded", [(self.bank, Decimal("0.006")), (self.revenue, Decimal("-0.006"))])
+        self.assertEqual([e.amount for e in entries], [Decimal("0.01"), Decimal("-0.01")])
+
+    def test_project_post_split(self):
+        project=Project.objects.create(name="project_jumbo", bookset=self.book)
+        party=ThirdParty.objects.create(account=self.ar, name="Joe")
+
+        project.post_split("registration", [
+            (self.ar, Decimal("10.00"), "", party),
+            (self.revenue, Decimal("-10.00")),
+        ])
+
+        self.assertEqual(project.get_third_party(party).balance(), Decimal("10.00"))
+        self.assertEqual(project.get_account("revenue").balance(), Decimal("10.00"))
+        self.assertEqual(self.revenue.balance(), Decimal("10.00"))
+
+    def test_balance_checkpoints(self):
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 2, 1, 0, 0, 0)
+        d3=datetime(2010, 2, 2, 1, 1, 0)
+        d4=datetime(2010, 3, 1, 0, 0, 0)
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=d1)
+        self.bank.credit(Decimal("2.00"), self.expense, "coffee", datetime=d3)
+
+        self.book.checkpoint_balances(d2)
+        self.assertEqual(self.bank.checkpoints.get().balance, Decimal("12.00"))
+        self.assertEqual(self.revenue.checkpoints.get().balance, Decimal("-12.00"))
+        self.assertEqual(self.expense.checkpoints.count(), 0)
+
+        #only the entries after the checkpoint are summed
+        BalanceCheckpoint.objects.filter(account=self.bank).update(balance=Decimal("100.00"))
+        self.assertEqual(self.bank.balance(), Decimal("98.00"))
+        self.assertEqual(self.bank.balance(d4), Decimal("98.00"))
+        self.assertEqual(self.bank.balance(d2), Decimal("100.00"))
+        self.assertEqual(self.bank.balance(d1), Decimal("0.00"))
+        self.assertEqual([le.opening for le in self.bank.ledger(start=d2)], [Decimal("100.00")])
+
+        #posting after the checkpoint leaves it alone; backdated postings invalidate it
+        self.bank.debit(Decimal("1.00"), self.revenue, "late sale", datetime=d3)
+        self.assertEqual(self.bank.checkpoints.count(), 1)
+        self.bank.debit(Decimal("1.00"), self.revenue, "backdated sale", datetime=d1)
+        self.assertEqual(self.bank.checkpoints.count(), 0)
+        self.assertEqual(self.revenue.checkpoints.count(), 0)
+        self.assertEqual(self.bank.balance(), Decimal("12.00"))
+
+        self.bank.checkpoint(d2)
+        self.bank.checkpoint(d4)
+        self.assertEqual(self.bank.checkpoints.get(as_of=d4).balance, Decimal("12.00"))
+        self.book.post_many([(self.expense, Decimal("0.50"), self.bank, "backdated coffee", "", "", d3)])
+        self.assertEqual(list(self.bank.checkpoints.values_list('as_of', flat=True)), [d2])
+        self.assertEqual(self.bank.balance(), Decimal("11.50"))
+
+        #third party sub-accounts can't use their parent's checkpoints
+        party=ThirdParty.objects.create(account=self.bank, name="Joe")
+        self.assertEqual(self.book.get_third_party(party).balance(), Decimal("0.00"))
+
+    def test_checkpoint_command(self):
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=d1)
+
+        call_command('bookkeeper_checkpoint', as_of='2010-02-01T00:00:00', booksets=[self.book.id], stdout=StringIO())
+        self.assertEqual(self.bank.checkpoints.get().as_of, datetime(2010, 2, 1))
+        self.assertEqual(self.bank.balance(), Decimal("12.00"))
+
+    def test_ledger_query_count(self):
+        d0=datetime(2010, 1, 1, 1, 0, 0)
+        self.bank.post_batch((Decimal(i), self.revenue, "sale %d" % i, "", "", datetime(2010, 1, 1, 1, i, 0))
+            for i in range(1, 31))
+
+        #one query for the entries (plus two for the opening balance), no matter how many rows
+        for start, expected in [(None, 1), (d0, 3)]:
+            with self.assertNumQueries(expected):
+                entries=[(le.time, le.description, le.memo, le.txid, le.closing) for le in self.bank.ledger(start=start)]
+            self.assertEqual(len(entries), 30)
+            self.assertEqual(entries[-1][4], Decimal("465.00"))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.bank.ledger(end=d0), [])
+
+    def test_ledger_with_counterparties(self):
+        self.bank.post_batch((Decimal(i), self.revenue, "sale %d" % i, "", "", datetime(2010, 1, 1, 1, i, 0))
+            for i in range(1, 21))
+        self.book.post_split("split sale", [
+            (self.bank, Decimal("5.00")),
+            (self.revenue, Decimal("-4.00")),
+            (self.expense, Decimal("-1.00")),
+        ], datetime=datetime(2010, 1, 2))
+
+        #one query for the entries and one for all of the other legs
+        with self.assertNumQueries(2):
+            ledger=list(self.bank.ledger(with_counterparties=True))
+            others=[le.other_entries() for le in ledger]
+            other=ledger[0].other_entry()
+
+        self.assertEqual(len(others), 21)
+        self.assertEqual(other, self.revenue)
+        self.assertEqual(others[0], [(Decimal("-1.00"), self.revenue)])
+        self.assertEqual(sorted(others[-1]), sorted([(Decimal("-4.00"), self.revenue), (Decimal("-1.00"), self.expense)]))
+        self.assertEqual(others, [le.other_entries() for le in self.bank.ledger()])
+
+    def test_trial_balance(self):
+        project=Project.objects.create(name="project_jumbo", bookset=self.book)
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 1, 2, 1, 1, 0)
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=d1)
+        self.bank.credit(Decimal("2.00"), self.expense, "coffee", datetime=d2)
+        project.get_account("ar").debit(Decimal("7.00"), project.get_account("revenue"), "registration", datetime=d2)
+
+        with self.assertNumQueries(2):
+            tb=self.book.trial_balance()
+        self.assertEqual(list(tb.keys()), list(self.book.accounts()))
+        self.assertEqual(dict((a.name, b) for a, b in tb.items()), {
+            "bank": Decimal("10.00"), "revenue": Decimal("19.00"), "expense": Decimal("2.00"), "ar": Decimal("7.00")})
+        for a, b in tb.items():
+            self.assertEqual(b, a.balance())
+
+        self.assertEqual(dict((a.name, b) for a, b in self.book.trial_balance(d2).items()), {
+            "bank": Decimal("12.00"), "revenue": Decimal("12.00"), "expense": Decimal("0.00"), "ar": Decimal("0.00")})
+
+        with self.assertNumQueries(2):
+            tb=project.trial_balance()
+        self.assertEqual(dict((a.name, b) for a, b in tb.items()), {
+            "bank": Decimal("0.00"), "revenue": Decimal("7.00"), "expense": Decimal("0.00"), "ar": Decimal("7.00")})
+
+    def test_totals_series(self):
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=datetime(2010, 1, 1, 1, 1, 0))
+        self.bank.debit(Decimal("3.00"), self.revenue, "ticket sale", datetime=datetime(2010, 1, 1, 23, 0, 0))
+        self.bank.credit(Decimal("2.00"), self.expense, "coffee", datetime=datetime(2010, 1, 3, 1, 0, 0))
+        self.bank.credit(Decimal("1.00"), self.expense, "coffee", datetime=datetime(2010, 1, 5, 1, 0, 0))
+        self.bank.debit(Decimal("1.50"), self.revenue, "refund", datetime=datetime(2010, 2, 1, 1, 0, 0))
+
+        start=datetime(2010, 1, 1)
+        end=datetime(2010, 1, 5)
+        with self.assertNumQueries(1):
+            series=self.bank.totals_series(start, end)
+        self.assertEqual(series, [
+            (datetime(2010, 1, 1), (Decimal("0.00"), Decimal("15.00"), Decimal("15.00"))),
+            (datetime(2010, 1, 2), (0, 0, 0)),
+            (datetime(2010, 1, 3), (Decimal("2.00"), Decimal("0.00"), Decimal("-2.00"))),
+            (datetime(2010, 1, 4), (0, 0, 0)),
+        ])
+        for day, totals in series:
+            self.assertEqual(totals, self.bank.totals(day, day + timedelta(days=1)))
+
+        #2010-01-01 is a Friday
+        self.assertEqual(self.revenue.totals_series(start, datetime(2010, 1, 12), bucket='week'), [
+            (datetime(2009, 12, 28), (Decimal("15.00"), Decimal("0.00"), Decimal("15.00"))),
+            (datetime(2010, 1, 4), (0, 0, 0)),
+            (datetime(2010, 1, 11), (0, 0, 0)),
+        ])
+        self.assertEqual(self.bank.totals_series(datetime(2010, 1, 2), datetime(2010, 3, 1), bucket='month'), [
+            (datetime(2010, 1, 1), (Decimal("3.00"), Decimal("0.00"), Decimal("-3.00"))),
+            (datetime(2010, 2, 1), (Decimal("0.00"), Decimal("1.50"), Decimal("1.50"))),
+        ])
+
+        with self.assertRaises(ValueError):
+            self.bank.totals_series(start, end, bucket='fortnight')
+
+    @override_settings(USE_TZ=True)
+    def test_totals_series_timezone(self):
+        toronto=pytz.timezone("America/Toronto")
+        #late in the evening of Jan 1st in Toronto, but Jan 2nd in UTC
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=datetime(2010, 1, 2, 1, 0, 0, tzinfo=pytz.utc))
+
+        start=toronto.localize(datetime(2010, 1, 1))
+        end=toronto.localize(datetime(2010, 1, 3))
+        self.assertEqual(self.bank.totals_series(start, end, tz=toronto), [
+            (start, (0, Decimal("12.00"), Decimal("12.00"))),
+            (toronto.localize(datetime(2010, 1, 2)), (0, 0, 0)),
+        ])
+        self.assertEqual(self.bank.totals_series(start, end, tz=pytz.utc), [
+            (datetime(2010, 1, 1, tzinfo=pytz.utc), (0, 0, 0)),
+            (datetime(2010, 1, 2, tzinfo=pytz.utc), (0, Decimal("12.00"), Decimal("12.00"))),
+            (datetime(2010, 1, 3, tzinfo=pytz.utc), (0, 0, 0)),
+        ])
+
+    @override_settings(USE_TZ=True)
+    def test_totals_series_dst_at_midnight(self):
+        #Sao Paulo's clocks went from 00:00 to 01:00 on 2016-10-16: that day
+        #had no midnight
+        sao_paulo=pytz.timezone("America/Sao_Paulo")
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=sao_paulo.localize(datetime(2016, 10, 16, 12, 0)))
+
+        start=sao_paulo.localize(datetime(2016, 10, 15))
+        end=sao_paulo.localize(datetime(2016, 10, 18))
+        series=self.bank.totals_series(start, end, tz=sao_paulo)
+        self.assertEqual(series, [
+            (start, (0, 0, 0)),
+            (sao_paulo.localize(datetime(2016, 10, 16, 1, 0)), (0, Decimal("12.00"), Decimal("12.00"))),
+            (sao_paulo.localize(datetime(2016, 10, 17)), (0, 0, 0)),
+        ])
+        self.assertEqual(series[1][1], self.bank.totals(series[1][0], series[2][0]))
+        #2016-10-15 is a Saturday
+        self.assertEqual(self.bank.totals_series(start, end, bucket='week', tz=sao_paulo), [
+            (sao_paulo.localize(datetime(2016, 10, 10)), (0, Decimal("12.00"), Decimal("12.00"))),
+            (sao_paulo.localize(datetime(2016, 10, 17)), (0, 0, 0)),
+        ])
+
+    def test_totals_for(self):
+        project=Project.objects.create(name="project_jumbo", bookset=self.book)
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 1, 2, 1, 1, 0)
+        d3=datetime(2010, 1, 3, 1, 1, 0)
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=d1)
+        self.bank.credit(Decimal("2.00"), self.expense, "coffee", datetime=d2)
+        project.get_account("bank").debit(Decimal("7.00"), project.get_account("revenue"), "registration", datetime=d2)
+
+        with self.assertNumQueries(1):
+            totals=self.bank.totals(d1, d3)
+        self.assertEqual(totals, (Decimal("2.00"), Decimal("19.00"), Decimal("17.00")))
+
+        accounts=[self.bank, self.revenue, self.expense, self.ar]
+        with self.assertNumQueries(1):
+            totals=self.book.totals_for(accounts, d1, d3)
+        self.assertEqual(list(totals.keys()), accounts)
+        for a in accounts:
+            self.assertEqual(totals[a], a.totals(d1, d3))
+        self.assertEqual(totals[self.revenue], (Decimal("19.00"), Decimal("0.00"), Decimal("19.00")))
+
+        totals=self.book.totals_for(accounts, start=d2)
+        self.assertEqual(totals[self.bank], (Decimal("2.00"), Decimal("7.00"), Decimal("5.00")))
+
+        totals=project.totals_for(accounts, end=d3)
+        self.assertEqual(totals[self.bank], (0, Decimal("7.00"), Decimal("7.00")))
+        self.assertEqual(totals[self.expense], (0, 0, 0))
+
+    def test_totals_for_sub_accounts(self):
+        project=Project.objects.create(name="project_jumbo", bookset=self.book)
+        joe=self.book.get_third_party(ThirdParty.objects.create(account=self.ar, name="Joe"))
+        bob=self.book.get_third_party(ThirdParty.objects.create(account=self.ar, name="Bob"))
+        project_bank=project.get_account("bank")
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale")
+        joe.debit(Decimal("5.00"), self.revenue, "invoice")
+        bob.debit(Decimal("3.00"), self.revenue, "invoice")
+        project_bank.debit(Decimal("7.00"), project.get_account("revenue"), "registration")
+
+        accounts=[self.ar, joe, bob, self.bank, project_bank]
+        with self.assertNumQueries(1):
+            totals=self.book.totals_for(accounts)
+        self.assertEqual(list(totals.keys()), accounts)
+        for a in accounts:
+            self.assertEqual(totals[a], a.totals())
+        self.assertEqual(totals[joe], (0, Decimal("5.00"), Decimal("5.00")))
+        self.assertEqual(totals[project_bank], (0, Decimal("7.00"), Decimal("7.00")))
+        self.assertEqual(totals[self.bank], (0, Decimal("19.00"), Decimal("19.00")))
+
+        other_book=BookSet.objects.create(description="other book")
+        other_bank=Account.objects.create(bookset=other_book, name="bank", positive_credit=False)
+        self.assertRaises(ValueError, self.book.totals_for, [self.bank, other_bank])
+
+    def test_ledger_pages(self):
+        d0=datetime(2010, 1, 1, 1, 0, 0)
+        #several transactions share a time stamp to exercise the tie-breakers
+        self.bank.post_batch((Decimal(i), self.revenue, "sale %d" % i, "", "", datetime(2010, 1, 1, 1, i // 3, 0))
+            for i in range(1, 26))
+        expected=[(le.txid, le.opening, le.closing) for le in self.bank.ledger(start=d0)]
+        self.assertEqual(len(expected), 25)
+
+        with self.assertNumQueries(2 + 3):
+            pages=list(self.bank.iter_ledger(start=d0, page_size=10))
+        self.assertEqual([(le.txid, le.opening, le.closing) for le in pages], expected)
+        self.assertEqual([(le.txid, le.opening, le.closing) for le in self.bank.iter_ledger(page_size=5)], expected)
+        self.assertEqual(list(self.bank.iter_ledger(end=d0)), [])
+
+        entries=[]
+        cursor=None
+        page_count=0
+        while True:
+            with self.assertNumQueries(1 if cursor else 3):
+                page, cursor=self.bank.ledger_page(start=d0, cursor=cursor, page_size=10)
+            entries.extend(page)
+            page_count+=1
+            if cursor is None:
+                break
+        self.assertEqual(page_count, 3)
+        self.assertEqual([(le.txid, le.opening, le.closing) for le in entries], expected)
+
+        page, cursor=self.bank.ledger_page(page_size=25)
+        self.assertEqual(len(page), 25)
+        self.assertEqual(cursor, None)
+
+        page, cursor=self.bank.ledger_page(page_size=10)
+        with self.assertRaises(signing.BadSignature):
+            self.bank.ledger_page(cursor="x" + cursor, page_size=10)
+
+    def test_entry_t_stamp(self):
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 1, 2, 1, 1, 0)
+        a1, a2=self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=d1)
+        self.assertEqual((a1.t_stamp, a2.t_stamp), (d1, d1))
+        self.book.post_many([(self.bank, Decimal("1.00"), self.revenue, "sale", "", "", d2)])
+        self.assertEqual(list(self.bank.entries.values_list('t_stamp', flat=True)), [d1, d2])
+
+        #entries are found by time without joining their transactions
+        with CaptureQueriesContext(connection) as queries:
+            self.bank.balance(d2)
+            self.bank.totals(d1, d2)
+            self.book.trial_balance(d2)
+            self.bank.totals_series(d1, d2)
+        for q in queries:
+            self.assertNotIn('bookkeeper_transaction', q['sql'])
+
+        #moving a transaction moves its entries
+        tx=a1.transaction
+        tx.t_stamp=d2
+        tx.save()
+        self.assertEqual(set(tx.entries.values_list('t_stamp', flat=True)), set([d2]))
+        self.assertEqual(self.bank.balance(d2), Decimal("0.00"))
+
+    def test_move_across_checkpoint(self):
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 1, 2, 1, 1, 0)
+        d3=datetime(2010, 1, 3, 1, 1, 0)
+        a1, a2=self.bank.debit(Decimal("10.00"), self.revenue, "ticket sale", datetime=d1)
+        self.book.checkpoint_balances(d2)
+        version=Account.objects.get(pk=self.bank.pk).version
+
+        tx=a1.transaction
+        tx.t_stamp=d3
+        tx.save()
+        self.assertEqual(self.bank.checkpoints.count(), 0)
+        self.assertEqual(self.revenue.checkpoints.count(), 0)
+        self.assertEqual(Account.objects.get(pk=self.bank.pk).version, version + 1)
+        self.assertEqual(self.bank.balance(), Decimal("10.00"))
+        self.assertEqual(self.bank.balance(d2), Decimal("0.00"))
+
+        #and back again
+        self.book.checkpoint_balances(d2)
+        tx.t_stamp=d1
+        tx.save()
+        self.assertEqual(self.bank.checkpoints.count(), 0)
+        self.assertEqual(self.bank.balance(d2), Decimal("10.00"))
+
+    def test_third_party_balances(self):
+        project=Project.objects.create(name="project_jumbo", bookset=self.book)
+        joe=ThirdParty.objects.create(account=self.ar, name="Joe")
+        bob=ThirdParty.objects.create(account=self.ar, name="Bob")
+        ThirdParty.objects.create(account=self.ar, name="Ann")
+        vendor=ThirdParty.objects.create(account=self.revenue, name="Vendor")
+
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 1, 2, 1, 1, 0)
+        self.book.get_third_party(joe).debit(Decimal("10.00"), self.revenue, "invoice", datetime=d1)
+        self.book.get_third_party(joe).credit(Decimal("4.00"), self.bank, "payment", datetime=d2)
+        project.get_third_party(bob).debit(Decimal("3.00"), self.revenue, "invoice", datetime=d2)
+        self.ar.debit(Decimal("1.00"), self.revenue, "no third party", datetime=d1)
+        self.book.get_third_party(vendor).debit(Decimal("2.00"), self.bank, "refund", datetime=d1)
+
+        with self.assertNumQueries(1):
+            balances=self.ar.third_party_balances()
+        self.assertEqual(balances, {joe.id: Decimal("6.00"), bob.id: Decimal("3.00")})
+        self.assertEqual(self.ar.third_party_balances(as_of=d2), {joe.id: Decimal("10.00")})
+        self.assertEqual(self.ar.third_party_balances(project=project), {bob.id: Decimal("3.00")})
+        self.assertEqual(self.revenue.third_party_balances(), {vendor.id: Decimal("-2.00")})
+        self.assertEqual(self.revenue.third_party_balances()[vendor.id], self.book.get_third_party(vendor).balance())
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_ledger_arrays(self):
+        joe=ThirdParty.objects.create(account=self.ar, name="Joe")
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        d2=datetime(2010, 1, 2, 1, 1, 0)
+        self.bank.debit(Decimal("12.00"), self.revenue, "ticket sale", datetime=d1)
+        self.bank.credit(Decimal("0.35"), self.expense, "fee", datetime=d2)
+        self.book.get_third_party(joe).debit(Decimal("5.10"), self.revenue, "invoice", datetime=d2)
+        self.bank.debit(Decimal("3.00"), self.revenue, "ticket sale", datetime=d2 + timedelta(days=1))
+
+        with self.assertNumQueries(1):
+            a=self.bank.ledger_arrays()
+        self.assertEqual(a.amount.dtype, numpy.int64)
+        self.assertEqual(list(a.t_stamp), [numpy.datetime64(d) for d in (d1, d2, d2 + timedelta(days=1))])
+        self.assertEqual(list(a.amount), [1200, -35, 300])
+        self.assertEqual(list(a.opening), [0, 1200, 1165])
+        self.assertEqual(list(a.closing), [1200, 1165, 1465])
+        self.assertEqual(list(a.aeid), [int(le.txid[8:]) for le in self.bank.ledger()])
+        self.assertEqual(list(a.tid), list(self.bank.entries.order_by("t_stamp").values_list("transaction_id", flat=True)))
+
+        #the running balance starts from the balance at 'start'
+        a=self.revenue.ledger_arrays(start=d2)
+        self.assertEqual(list(a.amount), [-510, -300])
+        self.assertEqual(list(a.opening), [1200, 1710])
+        self.assertEqual(list(a.closing), [1710, 2010])
+        self.assertEqual([Decimal(int(c)) / 100 for c in a.closing],
+            [le.closing for le in self.revenue.ledger(start=d2)])
+
+        a=self.book.get_third_party(joe).ledger_arrays(end=d2 + timedelta(seconds=1))
+        self.assertEqual((list(a.amount), list(a.closing)), ([510], [510]))
+
+        a=self.expense.ledger_arrays(start=d2 + timedelta(days=1))
+        self.assertEqual((len(a.t_stamp), len(a.opening)), (0, 0))
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    @override_settings(USE_TZ=True)
+    def test_ledger_arrays_timezone(self):
+        d1=pytz.timezone("America/Vancouver").localize(datetime(2010, 1, 1, 20, 0, 0))
+        self.bank.debit(Decimal("1.00"), self.revenue, "ticket sale", datetime=d1)
+        a=self.bank.ledger_arrays()
+        self.assertEqual(list(a.t_stamp), [numpy.datetime64("2010-01-02T04:00:00")])
+
+    def test_compact_ledger(self):
+        project=Project.objects.create(name="project_jumbo", bookset=self.book)
+        joe=ThirdParty.objects.create(account=self.ar, name="Joe")
+        d0=datetime(2010, 1, 1, 1, 0, 0)
+        self.bank.post_batch((Decimal(i), self.revenue, "sale %d" % i, "memo %d" % i, "", d0 + timedelta(hours=i // 2))
+            for i in range(1, 12))
+        self.bank.credit(Decimal("4.50"), self.expense, "fee", datetime=d0 + timedelta(hours=3))
+        project.get_third_party(joe).debit(Decimal("7.00"), self.revenue, "invoice", datetime=d0)
+
+        def fields(ledger):
+            return [(le.time, le.description, le.memo, le.debit, le.credit, le.opening, le.closing, le.txid, str(le))
+                for le in ledger]
+
+        for account in (self.bank, self.revenue, self.book.get_third_party(joe), project.get_account("revenue")):
+            for start, end in ((None, None), (d0 + timedelta(hours=2), None), (d0, d0 + timedelta(hours=4))):
+                expected=fields(account.ledger(start, end))
+                self.assertEqual(fields(account.ledger(start, end, compact=True)), expected)
+                self.assertEqual(fields(account.iter_ledger(start, end, page_size=3, compact=True)), expected)
+
+        with self.assertNumQueries(1):
+            rows=list(self.bank.ledger(compact=True))
+        self.assertEqual(len(rows), 12)
+        self.assertTrue(all(type(le) is LedgerRow for le in rows))
+        self.assertFalse(hasattr(rows[0], '__dict__'))
+        self.assertEqual(self.expense.ledger(end=d0, compact=True), [])
+        self.assertTrue(all(type(le) is LedgerEntry for le in self.bank.ledger()))
+
+        pages=[]
+        cursor=None
+        while True:
+            page, cursor=self.bank.ledger_page(cursor=cursor, page_size=5, compact=True)
+            pages.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual(fields(pages), fields(self.bank.ledger()))
+
+        with self.assertRaises(ValueError):
+            self.bank.ledger(compact=True, with_counterparties=True)
+
+    def test_amounts_in_minor_units(self):
+        d1=datetime(2010, 1, 1, 1, 1, 0)
+        #well beyond the old DecimalField(max_digits=8) limit
+        big=Decimal("123456789012.34")
+        a1, a2=self.bank.debit(big, self.revenue, "organizer payout", datetime=d1)
+        self.bank.credit(Decimal("0.01"), self.expense, "fee", datetime=d1 + timedelta(days=1))
+        self.bank.checkpoint(d1 + timedelta(hours=1))
+
+        self.assertEqual(AccountEntry.objects.values_list("amount", flat=True).get(pk=a1.pk), big)
+        self.assertEqual(AccountEntry.objects.get(pk=a2.pk).amount, -big)
+        self.assertEqual(AccountEntry.objects.filter(amount__gt=Decimal("123456789012.33")).count(), 1)
+        self.assertEqual(AccountEntry.objects.aggregate(s=Sum("amount"))["s"], 0)
+        self.assertEqual(self.bank.checkpoints.get().balance, big)
+
+        self.assertEqual(self.bank.balance(), Decimal("123456789012.33"))
+        self.assertEqual(self.bank.totals(), (Decimal("0.01"), big, Decimal("123456789012.33")))
+        self.assertEqual([(le.debit, le.credit, le.opening, le.closing) for le in self.bank.ledger()], [
+            (big, None, Decimal("0.00"), big),
+            (None, Decimal("0.01"), big, Decimal("123456789012.33"))])
+        self.assertEqual(str(list(self.bank.ledger(compact=True))[1].closing), "123456789012.33")
+
+        #amounts are rounded to whole cents, half to even
+        _a, a2=self.bank.debit(Decimal("0.125"), self.revenue, "rounding", datetime=d1)
+        self.assertEqual(AccountEntry.objects.get(pk=a2.pk).amount, Decimal("-0.12"))
@@ -0,0 +1,149 @@
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from .models import (BookSet, Account, AccountEntry, ThirdParty, Project, Transaction, PeriodClose,
+    ArchivedTransaction, ArchivedAccountEntry, BalanceCheckpoint, ImportedLine)
+from .account_api import Leg, PeriodClosedError, Posting
+from .importer import StatementLine, import_statement
+
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+
+class PeriodCloseTest(TestCase):
+    def setUp(self):
+        self.book=BookSet.objects.create(description="test book")
+        self.revenue=Account.objects.create(bookset=self.book, name="revenue", positive_credit=True)
+        self.bank=Account.objects.create(bookset=self.book, name="bank", positive_credit=False)
+        self.ar=Account.objects.create(bookset=self.book, name="ar", positive_credit=False)
+        self.joe=ThirdParty.objects.create(account=self.ar, name="Joe")
+        self.bob=ThirdParty.objects.create(account=self.ar, name="Bob")
+        self.project=Project.objects.create(bookset=self.book, name="jumbo")
+
+        self.d1=datetime(2010, 1, 10)
+        self.d2=datetime(2010, 2, 10)
+        self.end=datetime(2010, 2, 1)
+
+    def post_history(self):
+        self.bank.debit(Decimal("100.00"), self.revenue, "sale", datetime=self.d1)
+        self.book.get_third_party(self.joe).debit(Decimal("30.00"), self.revenue, "invoice", datetime=self.d1)
+        self.book.get_third_party(self.joe).credit(Decimal("10.00"), self.bank, "payment", datetime=self.d1)
+        self.book.get_third_party(self.bob).debit(Decimal("5.00"), self.revenue, "invoice", datetime=self.d1)
+        self.book.get_third_party(self.bob).credit(Decimal("5.00"), self.bank, "payment", datetime=self.d1)
+        self.project.get_account("bank").debit(Decimal("7.00"), self.project.get_account("revenue"), "project sale",
+            datetime=self.d1)
+        self.project.get_third_party(self.joe).debit(Decimal("3.00"), self.project.get_account("revenue"),
+            "project invoice", datetime=self.d1)
+        self.bank.debit(Decimal("1.00"), self.revenue, "later sale", datetime=self.d2)
+
+    def balances(self):
+        accounts=[self.bank, self.revenue, self.ar, self.book.get_third_party(self.joe),
+            self.book.get_third_party(self.bob), self.project.get_account("bank"),
+            self.project.get_account("revenue"), self.project.get_third_party(self.joe)]
+        return [[a.balance(t) for a in accounts] for t in (self.end, self.d2, None)]
+
+    def test_close(self):
+        self.post_history()
+        expected=self.balances()
+
+        close=self.book.close_period(self.end)
+        self.assertEqual((close.end, close.archived), (self.end, False))
+        self.assertEqual(BookSet.objects.get(pk=self.book.pk).closed_until, self.end)
+        self.assertEqual(self.balances(), expected)
+        self.assertEqual(BalanceCheckpoint.objects.filter(as_of=self.end).count(), 3)
+
+        #even accounts loaded before the close can't post before it
+        bank=Account.objects.get(pk=self.bank.pk)
+        stale=BookSet.objects.get(pk=self.book.pk)
+        stale.closed_until=None
+        bank.bookset=stale
+        before=self.end - timedelta(seconds=1)
+        attempts=[
+            lambda: bank.debit(Decimal("1.00"), self.revenue, "late", datetime=before),
+            lambda: bank.post_batch([(Decimal("1.00"), self.revenue, "late", "", "", before)]),
+            lambda: self.book.post_many([Posting(self.bank, Decimal("1.00"), self.revenue, "late", "", "", before)]),
+            lambda: self.book.post_split("late", [Leg(self.bank, Decimal("1.00")), Leg(self.revenue, Decimal("-1.00"))],
+                datetime=before),
+            lambda: self.project.get_third_party(self.joe).debit(Decimal("1.00"), self.revenue, "late", datetime=before),
+            lambda: self.book.post_many([Posting(self.bank, Decimal("1.00"), self.revenue, "fine", "", "", self.d2),
+                Posting(self.bank, Decimal("1.00"), self.revenue, "late", "", "", before)], chunk_size=1),
+        ]
+        for attempt in attempts:
+            with self.assertRaises(PeriodClosedError):
+                attempt()
+        self.assertEqual(self.balances(), expected)
+
+        #transactions can't be moved into or out of the closed period
+        closed_tx=self.bank.entries.filter(t_stamp=self.d1).first().transaction
+        open_tx=self.bank.entries.get(t_stamp=self.d2).transaction
+        for tx, t_stamp in ((closed_tx, self.d2), (open_tx, before)):
+            tx.t_stamp=t_stamp
+            with self.assertRaises(PeriodClosedError):
+                tx.save()
+        self.assertEqual(Transaction.objects.filter(t_stamp=self.d2).count(), 1)
+        self.assertEqual(self.balances(), expected)
+
+        #at or after the close is fine
+        open_tx.t_stamp=self.d2 + timedelta(days=1)
+        open_tx.save()
+        self.bank.debit(Decimal("1.00"), self.revenue, "on time", datetime=self.end)
+        self.assertEqual(self.bank.balance(), expected[2][0] + 1)
+
+        #closes can't go backwards
+        with self.assertRaises(ValueError):
+            self.book.close_period(self.end - timedelta(days=1))
+
+    def test_archive(self):
+        self.post_history()
+        import_statement(self.bank, self.revenue, [StatementLine(self.d1, Decimal("2.00"), "deposit", "x1")])
+        self.bank.checkpoint(self.d1 + timedelta(days=1))
+        expected=self.balances()
+        expected_ledger=[(le.debit, le.credit, le.closing) for le in self.bank.ledger(start=self.end)]
+        old_tids=set(Transaction.objects.filter(t_stamp__lt=self.end).values_list('tid', flat=True))
+        old_entries=AccountEntry.objects.filter(t_stamp__lt=self.end).count()
+
+        close=self.book.close_period(self.end, archive=True)
+        self.assertTrue(close.archived)
+
+        self.assertEqual(self.balances(), expected)
+        self.assertEqual([(le.debit, le.credit, le.closing) for le in self.bank.ledger(start=self.end)], expected_ledger)
+        self.assertEqual(self.bank.checkpoints.get().as_of, self.end)
+
+        #the old transactions are in the archive, and replaced by opening balances
+        self.assertEqual(set(ArchivedTransaction.objects.values_list('tid', flat=True)), old_tids)
+        self.assertEqual(ArchivedAccountEntry.objects.count(), old_entries)
+        self.assertEqual(self.bank.archived_entries.count(), 5)
+        self.assertFalse(Transaction.objects.filter(tid__in=old_tids).exists())
+
+        openings=list(close.opening_transactions.all())
+        self.assertTrue(all(tx.t_stamp == self.end - timedelta(microseconds=1) for tx in openings))
+        #bank, revenue, joe and the project's bank, revenue and joe; bob's balance is zero
+        self.assertEqual(len(openings), 6)
+        self.assertEqual(len([tx for tx in openings if tx.project_id == self.project.pk]), 3)
+        clearing=self.book.get_account(BookSet.OPENING_BALANCES_ACCOUNT)
+        self.assertEqual(clearing.balance(), 0)
+        self.assertEqual(self.book.trial_balance()[clearing], 0)
+
+        #imported lines stay imported
+        self.assertEqual(ImportedLine.objects.get().transaction, None)
+        self.assertEqual(import_statement(self.bank, self.revenue,
+            [StatementLine(self.d1, Decimal("2.00"), "deposit", "x1")]).duplicates, 1)
+
+        #a later close archives the opening balances too
+        self.bank.debit(Decimal("4.00"), self.revenue, "sale", datetime=self.d2)
+        expected=self.balances()
+        later=datetime(2010, 3, 1)
+        close2=self.book.close_period(later, archive=True)
+        self.assertEqual(self.balances()[2], expected[2])
+        self.assertEqual(close.opening_transactions.count(), 0)
+        self.assertEqual(close2.opening_transactions.count(), 6)
+        self.assertEqual(AccountEntry.objects.count(), 12)
+        self.assertEqual(PeriodClose.objects.filter(bookset=self.book).count(), 2)
+
+    def test_archive_after_close(self):
+        self.post_history()
+        expected=self.balances()
+        self.book.close_period(self.end)
+        self.book.close_period(self.end, archive=True)
+        self.assertEqual(self.balances(), expected)
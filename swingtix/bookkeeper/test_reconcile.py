@@ -0,0 +1,110 @@
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from .models import BookSet, Account, AccountEntry, ThirdParty
+from .importer import StatementLine
+from .reconcile import Match, reconcile, unreconcile
+
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+
+class ReconcileTest(TestCase):
+    def setUp(self):
+        self.book = BookSet.objects.create(description="test book")
+        self.bank = Account.objects.create(bookset=self.book, name="bank", positive_credit=False)
+        self.card = Account.objects.create(bookset=self.book, name="card", positive_credit=True)
+        self.expense = Account.objects.create(bookset=self.book, name="expense", positive_credit=False)
+
+    def entry(self, account, t):
+        return account.entries.get(t_stamp=t).pk
+
+    def test_exact_and_fuzzy(self):
+        d = datetime(2010, 1, 4, 15, 0)
+        self.bank.debit(Decimal("100.00"), self.expense, "deposit", debit_memo="a1", datetime=d)
+        self.bank.credit(Decimal("20.50"), self.expense, "coffee", credit_memo="x", datetime=d + timedelta(days=1))
+        self.bank.credit(Decimal("20.50"), self.expense, "coffee", credit_memo="y", datetime=d + timedelta(days=4))
+        self.bank.credit(Decimal("7.00"), self.expense, "lunch", datetime=d + timedelta(days=6))
+
+        lines = [
+            StatementLine(datetime(2010, 1, 4), Decimal("100.00"), "deposit", "a1"),
+            StatementLine(datetime(2010, 1, 8), Decimal("-20.50"), "coffee", "b2"),
+            StatementLine(datetime(2010, 1, 6), Decimal("-20.50"), "coffee", "b1"),
+            StatementLine(datetime(2010, 1, 7), Decimal("-7.00"), "lunch", "b3"),
+            StatementLine(datetime(2010, 1, 4), Decimal("-1.00"), "fee", "b4"),
+        ]
+
+        result = reconcile(self.bank, lines, dry_run=True)
+        self.assertEqual(result.matches, [
+            Match(lines[0], self.entry(self.bank, d), True),
+            Match(lines[1], self.entry(self.bank, d + timedelta(days=4)), False),
+            Match(lines[2], self.entry(self.bank, d + timedelta(days=1)), False),
+        ])
+        #the lunch is more than 3 days away
+        self.assertEqual(result.unmatched, lines[3:])
+        self.assertEqual(result.unmatched_entries, [self.entry(self.bank, d + timedelta(days=6))])
+        self.assertFalse(AccountEntry.objects.filter(reconciled_at__isnull=False).exists())
+
+        #a wider tolerance catches it
+        with self.assertNumQueries(4):
+            result = reconcile(self.bank, lines, tolerance=timedelta(days=4))
+        self.assertEqual(len(result.matches), 4)
+        self.assertEqual(result.unmatched, lines[4:])
+        self.assertEqual(self.bank.entries.filter(reconciled_at__isnull=False).count(), 4)
+        self.assertFalse(self.expense.entries.filter(reconciled_at__isnull=False).exists())
+
+        #reconciled entries aren't matched again
+        result = reconcile(self.bank, lines, tolerance=timedelta(days=4))
+        self.assertEqual(result.matches, [])
+        self.assertEqual(result.unmatched, lines)
+
+        self.assertEqual(unreconcile(self.bank, end=d + timedelta(days=2)), 2)
+        result = reconcile(self.bank, lines, tolerance=timedelta(days=4), dry_run=True)
+        self.assertEqual([m.line for m in result.matches], [lines[0], lines[2]])
+
+    def test_duplicates_in_time_order(self):
+        d = datetime(2010, 1, 4)
+        for i in range(3):
+            self.bank.credit(Decimal("5.00"), self.expense, "toll", credit_memo="t", datetime=d + timedelta(hours=i))
+        lines = [StatementLine(datetime(2010, 1, 4), Decimal("-5.00"), "toll", "t")] * 2
+
+        result = reconcile(self.bank, lines)
+        self.assertEqual([m.entry_id for m in result.matches], [self.entry(self.bank, d), self.entry(self.bank, d + timedelta(hours=1))])
+        self.assertTrue(all(m.exact for m in result.matches))
+        self.assertEqual(result.unmatched_entries, [self.entry(self.bank, d + timedelta(hours=2))])
+
+    def test_taken_entries_are_skipped(self):
+        d = datetime(2010, 1, 4)
+        times = [d + timedelta(hours=i) for i in range(8)]
+        for t in times:
+            self.bank.credit(Decimal("5.00"), self.expense, "toll", datetime=t)
+
+        #the lines are matched in date order, whatever order they're given in
+        lines = [StatementLine(t, Decimal("-5.00"), "toll", "x") for t in reversed(times)]
+        result = reconcile(self.bank, lines, dry_run=True)
+        self.assertEqual([m.entry_id for m in result.matches], [self.entry(self.bank, t) for t in reversed(times)])
+
+        #the closest entries are taken, so the next closest are found past them
+        lines = [StatementLine(d + timedelta(hours=3), Decimal("-5.00"), "toll", "x")] * 6
+        result = reconcile(self.bank, lines, tolerance=timedelta(hours=3))
+        self.assertEqual(sorted(m.entry_id for m in result.matches), [self.entry(self.bank, t) for t in times[:6]])
+        self.assertEqual(result.unmatched_entries, [self.entry(self.bank, t) for t in times[6:]])
+
+    def test_positive_credit_and_third_party(self):
+        d = datetime(2010, 2, 1)
+        alice = ThirdParty.objects.create(account=self.card, name="alice")
+        bob = ThirdParty.objects.create(account=self.card, name="bob")
+        self.book.get_third_party(alice).credit(Decimal("30.00"), self.expense, "charge", datetime=d)
+        self.book.get_third_party(bob).credit(Decimal("30.00"), self.expense, "charge", datetime=d)
+        self.assertEqual(self.card.balance(), Decimal("60.00"))
+
+        lines = [StatementLine(d, Decimal("30.00"), "charge", ""), StatementLine(d, Decimal("-30.00"), "charge", "")]
+        result = reconcile(self.book.get_third_party(bob), lines)
+        self.assertEqual(result.matches, [Match(lines[0], self.card.entries.get(third_party=bob).pk, True)])
+        self.assertEqual(result.unmatched, lines[1:])
+        self.assertIsNone(self.card.entries.get(third_party=alice).reconciled_at)
+
+    def test_nothing_to_do(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(reconcile(self.bank, []), ([], [], []))
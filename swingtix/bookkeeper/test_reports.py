@@ -0,0 +1,73 @@
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from .models import BookSet, Account, ThirdParty, Project
+from .reports import aging_report
+
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+
+class AgingReportTest(TestCase):
+    def setUp(self):
+        self.book=BookSet.objects.create(description="test book")
+        self.revenue=Account.objects.create(bookset=self.book, name="revenue", positive_credit=True)
+        self.expense=Account.objects.create(bookset=self.book, name="expense", positive_credit=False)
+        self.bank=Account.objects.create(bookset=self.book, name="bank", positive_credit=False)
+        self.ar=Account.objects.create(bookset=self.book, name="ar", positive_credit=False)
+        self.ap=Account.objects.create(bookset=self.book, name="ap", positive_credit=True)
+
+        self.joe=ThirdParty.objects.create(account=self.ar, name="Joe")
+        self.bob=ThirdParty.objects.create(account=self.ar, name="Bob")
+        self.ann=ThirdParty.objects.create(account=self.ar, name="Ann")
+        self.vendor=ThirdParty.objects.create(account=self.ap, name="Vendor")
+
+        self.as_of=datetime(2010, 6, 1)
+
+    def days_ago(self, days):
+        return self.as_of - timedelta(days=days)
+
+    def test_aging(self):
+        joe=self.book.get_third_party(self.joe)
+        bob=self.book.get_third_party(self.bob)
+        ann=self.book.get_third_party(self.ann)
+
+        joe.debit(Decimal("100.00"), self.revenue, "old invoice", datetime=self.days_ago(95))
+        joe.debit(Decimal("50.00"), self.revenue, "invoice", datetime=self.days_ago(45))
+        joe.debit(Decimal("20.00"), self.revenue, "new invoice", datetime=self.days_ago(5))
+        joe.credit(Decimal("120.00"), self.bank, "payment", datetime=self.days_ago(1))
+
+        bob.debit(Decimal("10.00"), self.revenue, "invoice", datetime=self.days_ago(65))
+        bob.credit(Decimal("15.00"), self.bank, "overpayment", datetime=self.days_ago(2))
+
+        ann.debit(Decimal("10.00"), self.revenue, "invoice", datetime=self.days_ago(65))
+        ann.credit(Decimal("10.00"), self.bank, "payment", datetime=self.days_ago(2))
+
+        #after as_of: ignored
+        joe.debit(Decimal("1000.00"), self.revenue, "future invoice", datetime=datetime(2010, 6, 2))
+
+        with self.assertNumQueries(1):
+            report=aging_report(self.ar, self.as_of)
+        self.assertEqual(report, [
+            (self.joe.id, Decimal("50.00"), (Decimal("20.00"), Decimal("30.00"), Decimal("0.00"), Decimal("0.00"))),
+            (self.bob.id, Decimal("-5.00"), (Decimal("-5.00"), Decimal("0.00"), Decimal("0.00"), Decimal("0.00"))),
+        ])
+        self.assertEqual(report[0].balance, joe.balance(self.as_of))
+        self.assertEqual(report[1].balance, bob.balance(self.as_of))
+
+        report=aging_report(self.ar, self.as_of, buckets=[60])
+        self.assertEqual(report[0].buckets, (Decimal("50.00"), Decimal("0.00")))
+
+    def test_payables_and_projects(self):
+        project=Project.objects.create(name="project_jumbo", bookset=self.book)
+
+        project.get_third_party(self.vendor).credit(Decimal("40.00"), self.expense, "bill", datetime=self.days_ago(31))
+        self.book.get_third_party(self.vendor).credit(Decimal("7.00"), self.expense, "bill", datetime=self.days_ago(3))
+
+        self.assertEqual(aging_report(self.ap, self.as_of), [
+            (self.vendor.id, Decimal("47.00"), (Decimal("7.00"), Decimal("40.00"), 0, 0)),
+        ])
+        self.assertEqual(aging_report(project.get_account("ap"), self.as_of), [
+            (self.vendor.id, Decimal("40.00"), (0, Decimal("40.00"), 0, 0)),
+        ])
@@ -0,0 +1,106 @@
+from __future__ import unicode_literals
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils.six import StringIO
+
+from .models import BookSet, Account
+from .runner import run_reports
+
+from decimal import Decimal
+from datetime import datetime
+import json
+import unittest
+
+
+def failing_report(bookset):
+    if bookset.description == "broken":
+        raise ValueError("no good")
+    return bookset.description
+
+
+def in_memory_sqlite():
+    name = connection.settings_dict['NAME']
+    return connection.vendor == 'sqlite' and (name == ':memory:' or 'mode=memory' in name)
+
+
+class RunnerTestMixin(object):
+    def setUp(self):
+        self.books = []
+        for i in range(3):
+            book = BookSet.objects.create(description="book %d" % i)
+            revenue = Account.objects.create(bookset=book, name="revenue", positive_credit=True)
+            bank = Account.objects.create(bookset=book, name="bank", positive_credit=False)
+            bank.debit(Decimal(10 * (i + 1)), revenue, "sale", datetime=datetime(2010, 1, 15))
+            bank.debit(Decimal(1), revenue, "late sale", datetime=datetime(2010, 2, 15))
+            self.books.append(book)
+
+
+class RunnerTest(RunnerTestMixin, TestCase):
+
+    def test_reports(self):
+        results = list(run_reports([b.pk for b in self.books], processes=0,
+            end=datetime(2010, 2, 1), ledgers=True))
+        self.assertEqual([r.bookset_id for r in results], [b.pk for b in self.books])
+
+        for i, r in enumerate(results):
+            self.assertEqual(r.error, None)
+            report = r.report
+            self.assertEqual(report['description'], "book %d" % i)
+            self.assertEqual(report['trial_balance'], {
+                'revenue': Decimal(10 * (i + 1)), 'bank': Decimal(10 * (i + 1))})
+            self.assertEqual(report['totals']['bank']['debits'], Decimal(10 * (i + 1)))
+            self.assertEqual(report['totals']['revenue']['credits'], Decimal(10 * (i + 1)))
+            self.assertEqual([le['description'] for le in report['ledgers']['bank']], ["sale"])
+
+    def test_failures(self):
+        broken = BookSet.objects.create(description="broken")
+        ids = [self.books[0].pk, broken.pk, self.books[1].pk, 12345]
+        results = list(run_reports(ids, report=failing_report, processes=0))
+
+        self.assertEqual([r.report for r in results], ["book 0", None, "book 1", None])
+        self.assertIn("ValueError: no good", results[1].error)
+        self.assertIn("DoesNotExist", results[3].error)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('bookkeeper_reports', '--processes=0', '--bookset=%d' % self.books[1].pk,
+            '--start=2010-02-01T00:00:00', stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        report = json.loads(lines[0])
+        self.assertEqual(report['bookset'], self.books[1].pk)
+        self.assertEqual(report['trial_balance']['bank'], "21.00")
+        self.assertEqual(report['totals']['bank']['debits'], "1.00")
+        self.assertNotIn('ledgers', report)
+
+        err = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('bookkeeper_reports', '--processes=0', '--bookset=12345', stdout=out, stderr=err)
+        self.assertIn("bookset 12345 failed", err.getvalue())
+
+
+#the workers have their own connections, so they need a database they can
+#see: not the test case's transaction, nor an in-memory sqlite database.
+@unittest.skipIf(in_memory_sqlite(), "workers can't share an in-memory sqlite database")
+class ParallelRunnerTest(RunnerTestMixin, TransactionTestCase):
+    def test_pool(self):
+        ids = [b.pk for b in self.books]
+        expected = dict((r.bookset_id, r.report) for r in run_reports(ids, processes=0, ledgers=True))
+
+        results = list(run_reports(ids, processes=2, ledgers=True))
+        self.assertEqual(sorted(r.bookset_id for r in results), sorted(ids))
+        self.assertEqual(dict((r.bookset_id, r.report) for r in results), expected)
+        self.assertEqual([r.error for r in results], [None] * 3)
+
+        #the pool closed this process's connection before forking; it reconnects
+        self.assertEqual(BookSet.objects.count(), 3)
+
+    def test_failures(self):
+        broken = BookSet.objects.create(description="broken")
+        results = list(run_reports([self.books[0].pk, broken.pk], report=failing_report, processes=1))
+        self.assertEqual(dict((r.bookset_id, r.report) for r in results), {self.books[0].pk: "book 0", broken.pk: None})
+        self.assertIn("ValueError: no good", [r for r in results if r.error][0].error)
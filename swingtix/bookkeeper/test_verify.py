@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from .models import BookSet, Account, AccountEntry, IntegrityMark
+from .verify import Problem, verify, verify_incremental
+
+from decimal import Decimal
+from datetime import datetime
+
+
+class VerifyTest(TestCase):
+    def setUp(self):
+        self.book = BookSet.objects.create(description="test book")
+        self.other_book = BookSet.objects.create(description="other book")
+        self.bank = Account.objects.create(bookset=self.book, name="bank", positive_credit=False)
+        self.revenue = Account.objects.create(bookset=self.book, name="revenue", positive_credit=True)
+        self.other_bank = Account.objects.create(bookset=self.other_book, name="bank", positive_credit=False)
+
+    def post(self, n):
+        return [self.bank.debit(Decimal("10.00"), self.revenue, "sale", datetime=datetime(2010, 1, 1))
+            for i in range(n)]
+
+    def test_verify(self):
+        tids = [t.transaction_id for t, c in self.post(5)]
+        self.assertEqual(list(verify()), [])
+
+        self.revenue.entries.filter(transaction_id=tids[1]).update(amount=Decimal("-9.99"))
+        self.revenue.entries.filter(transaction_id=tids[3]).update(account=self.other_bank)
+        AccountEntry.objects.filter(account=self.bank, transaction_id=tids[4]).delete()
+
+        expected = [
+            Problem(tids[1], Decimal("0.01"), 1),
+            Problem(tids[3], Decimal("0.00"), 2),
+            Problem(tids[4], Decimal("-10.00"), 1)]
+        with self.assertNumQueries(4):
+            self.assertEqual(list(verify(chunk_size=2)), expected)
+        self.assertEqual(list(verify(start=tids[2], end=tids[4])), expected[1:2])
+
+    def test_incremental(self):
+        tids = [t.transaction_id for t, c in self.post(3)]
+        self.revenue.entries.filter(transaction_id=tids[0]).update(amount=Decimal("-1.00"))
+
+        self.assertEqual([p.tid for p in verify_incremental(overlap=0)], [tids[0]])
+        self.assertEqual(IntegrityMark.objects.get(name="default").checked_through, tids[2])
+
+        #only the new transactions are checked
+        self.assertEqual(verify_incremental(overlap=0), [])
+        tids += [t.transaction_id for t, c in self.post(2)]
+        self.revenue.entries.filter(transaction_id=tids[4]).update(amount=Decimal("-1.00"))
+        self.assertEqual([p.tid for p in verify_incremental(overlap=2)], [tids[4]])
+        mark = IntegrityMark.objects.get(name="default")
+        self.assertEqual((mark.checked_through, mark.reported), (tids[4], str(tids[4])))
+
+        #the overlap catches late commits, but doesn't report a problem twice
+        self.assertEqual(verify_incremental(overlap=2), [])
+        self.revenue.entries.filter(transaction_id=tids[3]).update(amount=Decimal("-1.00"))
+        self.assertEqual([p.tid for p in verify_incremental(overlap=2)], [tids[3]])
+        self.assertEqual(verify_incremental(overlap=2), [])
+
+        #marks are independent
+        self.assertEqual(len(verify_incremental("nightly")), 3)
+
+    def test_command(self):
+        tids = [t.transaction_id for t, c in self.post(2)]
+        call_command('bookkeeper_verify', stdout=StringIO())
+
+        self.revenue.entries.filter(transaction_id=tids[0]).update(amount=Decimal("-1.00"))
+        err = StringIO()
+        #already past the mark
+        call_command('bookkeeper_verify', overlap=0, stdout=StringIO(), stderr=err)
+        with self.assertRaises(CommandError):
+            call_command('bookkeeper_verify', full=True, stdout=StringIO(), stderr=err)
+        self.assertIn("transaction {0}: entries add up to 9.00, in 1 booksets".format(tids[0]), err.getvalue())
@@ -0,0 +1,105 @@
+"""
+
+Checks the invariants in Transaction's docstring: the entries of each
+transaction add up to zero, and are all in the same BookSet.
+
+    for problem in verify():
+        print(problem.tid, problem.imbalance, problem.booksets)
+
+Both are checked with one GROUP BY ... HAVING query over the entry table per
+CHUNK_SIZE transaction ids, so only the offending transactions ever leave
+the database.
+
+verify_incremental() only checks the transactions after a stored
+IntegrityMark, moving the mark forward as it goes, so it's cheap enough to
+run every few minutes.  Transaction ids can be allocated before a concurrent
+post commits, so it re-checks the last 'overlap' ids every time; the mark
+remembers which of those were reported, so each problem is reported once.
+Entries changed in older transactions without the account API (eg. in the
+admin) are only found by a full verify().
+
+"""
+
+from __future__ import unicode_literals
+from builtins import range
+from collections import namedtuple
+
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+
+from .account_api import _minor_units
+from .fields import from_minor_units
+from .models import AccountEntry, IntegrityMark, Transaction
+
+#how many transaction ids are checked per query
+CHUNK_SIZE = 10000
+
+#how many ids before the mark verify_incremental() checks again
+OVERLAP = 1000
+
+#A transaction breaking an invariant: its entries add up to 'imbalance'
+#(a Decimal) instead of zero, and/or span more than one bookset.
+Problem = namedtuple('Problem', ['tid', 'imbalance', 'booksets'])
+
+
+def _problems(start, end):
+    "The Problem's of the transactions with start <= tid < end."
+
+    rows = (AccountEntry.objects
+        .filter(transaction_id__gte=start, transaction_id__lt=end)
+        .values('transaction_id')
+        .annotate(total=Sum(_minor_units()), booksets=Count('account__bookset', distinct=True))
+        .filter(~Q(total=0) | Q(booksets__gt=1))
+        .order_by('transaction_id')
+        .values_list('transaction_id', 'total', 'booksets'))
+
+    return [Problem(tid, from_minor_units(total), booksets) for tid, total, booksets in rows]
+
+
+def _tid_range():
+    "The first transaction id, and one past the last."
+    tids = Transaction.objects.aggregate(first=Min('tid'), last=Max('tid'))
+    if tids['first'] is None:
+        return 0, 0
+    return tids['first'], tids['last'] + 1
+
+
+def verify(start=None, end=None, chunk_size=CHUNK_SIZE):
+    """ Yields a Problem for each transaction with start <= tid < end
+    (default: all of them) breaking an invariant, in tid order. """
+
+    if start is None or end is None:
+        first, last = _tid_range()
+        start = first if start is None else start
+        end = last if end is None else end
+
+    for chunk_start in range(start, end, chunk_size):
+        for problem in _problems(chunk_start, min(chunk_start + chunk_size, end)):
+            yield problem
+
+
+def verify_incremental(name="default", chunk_size=CHUNK_SIZE, overlap=OVERLAP):
+    """ Checks the transactions after the IntegrityMark called 'name' (all
+    of them, the first time) and returns the list of the Problem's not
+    reported by an earlier run.  The mark is saved after each chunk, so an
+    interrupted run picks up where it left off.
+    """
+
+    mark, _ = IntegrityMark.objects.get_or_create(name=name)
+    checked_through = mark.checked_through
+    reported = set(int(tid) for tid in mark.reported.split())
+    end = _tid_range()[1]
+
+    problems = []
+    for chunk_start in range(max(checked_through - overlap + 1, 0), end, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, end)
+        found = [p for p in _problems(chunk_start, chunk_end) if p.tid not in reported]
+        problems.extend(found)
+
+        #only the ids the next run will check again need remembering
+        checked_through = max(checked_through, chunk_end - 1)
+        reported = set(tid for tid in reported.union(p.tid for p in found) if tid > checked_through - overlap)
+        IntegrityMark.objects.filter(pk=mark.pk).update(checked_through=checked_through,
+            reported=" ".join(str(tid) for tid in sorted(reported)), updated=timezone.now())
+
+    return problems